@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+
+# Admission control for /api/chat (per worker process):
+# - ChatAdmission: at most max_concurrent chats run at once; a few more may wait briefly for a slot,
+#   everything beyond that is rejected at once (503) instead of hanging until the gunicorn timeout.
+# - RateLimiter: token bucket per client key (session id or IP); an empty bucket gets 429.
+# Both reply with Retry-After. Limits are per worker, so the service-wide ceiling is workers x limit.
+
+
+class ChatAdmission:
+    def __init__(self, *, max_concurrent: int, max_queue: int, queue_timeout_s: float) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+
+    def _publish(self) -> None:
+        metrics.gauge("admission.in_flight", self._in_flight)
+        metrics.gauge("admission.queue_depth", self._waiting)
+
+    def try_acquire(self, slots: int = 1) -> bool:
+        """
+        Take `slots` chat slots (a batch takes one per LLM call it runs at once), waiting at most
+        queue_timeout_s. False = overloaded (caller replies 503).
+        """
+        with self._cond:
+            if self._in_flight + slots <= self.max_concurrent:
+                self._in_flight += slots
+                self._publish()
+                return True
+            if self._waiting >= self.max_queue:
+                metrics.incr("admission.rejected.queue_full")
+                return False
+            self._waiting += 1
+            self._publish()
+            t0 = time.perf_counter()
+            admitted = self._cond.wait_for(lambda: self._in_flight + slots <= self.max_concurrent, self.queue_timeout_s)
+            self._waiting -= 1
+            metrics.observe("admission.queue_wait_s", time.perf_counter() - t0)
+            if admitted:
+                self._in_flight += slots
+            else:
+                metrics.incr("admission.rejected.queue_timeout")
+            self._publish()
+            return admitted
+
+    def release(self, slots: int = 1) -> None:
+        with self._cond:
+            self._in_flight -= slots
+            self._publish()
+            self._cond.notify_all()  # waiters may need different numbers of slots
+
+
+class RateLimiter:
+    def __init__(self, *, rate_per_s: float, burst: int, max_keys: int = 10000) -> None:
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key: str, cost: int = 1) -> float:
+        """
+        Spend `cost` tokens for key (a batch pays one per question). Returns 0 if allowed, else seconds
+        until a token is available. A request is allowed while the bucket holds a token; a cost larger
+        than that leaves the bucket in debt, so the client waits until the rate has paid it back.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate_per_s)
+            if tokens >= 1.0:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / self.rate_per_s
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)  # least recently seen client
+        if wait:
+            metrics.incr("admission.rejected.rate_limited")
+        return wait
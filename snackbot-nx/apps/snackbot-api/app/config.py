@@ -3,6 +3,8 @@ from __future__ import annotations
 import os
 from dataclasses import dataclass
 
+from .logs import parse_sampling
+
 
 def _getenv(name: str, default: str | None = None) -> str:
     val = os.getenv(name, default)
@@ -23,6 +25,12 @@ def _parse_embed_dimensions(raw: str | None) -> int | None:
         return None
 
 
+def _parse_bool(raw: str | None, default: bool) -> bool:
+    if raw is None or not raw.strip():
+        return default
+    return raw.strip().lower() in ("1", "true", "yes", "on")
+
+
 @dataclass(frozen=True)
 class Settings:
     openai_api_key: str
@@ -33,6 +41,59 @@ class Settings:
     gdocs_published_urls: list[str]
     allowed_origins: list[str]
     port: int
+    rag_product_filter: bool  # Search only the detected product's chunks first (falls back to full search when weak).
+    warmup_on_start: bool  # Open Chroma, load the index and prime caches in the background when the app starts.
+    warmup_queries: list[str]  # Top questions whose query embeddings are primed during warm-up ("|"-separated env var).
+    index_backend: str  # "chroma" (query Chroma) or "memory" (NumPy copy of the collection, see app/rag/chunkstore.py).
+    preload_index: bool  # Load the memory index in the gunicorn master before fork so workers share it (implies "memory").
+    index_quantization: str  # Memory index vectors: "none" (float32), "float16" or "int8".
+    index_search_dims: int | None  # Memory index: search on the first N dims only (Matryoshka truncation). None = all.
+    index_rescore: int  # Memory index: candidates re-ranked with full-precision vectors when quantized/truncated.
+    index_space: str  # Chroma distance space for new collections: "cosine", "l2" or "ip" (existing ones: scripts/reindex.py).
+    index_hnsw_m: int  # HNSW graph degree for new collections (more = better recall, more memory and build time).
+    index_hnsw_construction_ef: int  # HNSW build-time beam width for new collections.
+    index_hnsw_search_ef: int  # HNSW query-time beam width (recall vs latency); fixed when a collection is built.
+    catalog_path: str  # Product catalog JSON (names, aliases, slugs, packs); "" = app/rag/catalog.json. Reloaded on change.
+    answer_format: str  # "text" (LLM writes the reply) or "json" (structured output rendered by the server).
+    rerank: str  # Second-stage ranking of retrieved chunks: "off", "lexical" or "cross-encoder" (see app/rag/rerank.py).
+    rerank_top_n: int  # Chunks kept for the prompt after reranking.
+    rerank_model: str  # sentence-transformers CrossEncoder for rerank="cross-encoder".
+    index_check_interval_s: float  # How often each worker checks the index root for a newly published snapshot.
+    index_keep_snapshots: int  # Snapshots kept on disk by ingest (the active and the previous one included, so >= 2).
+    sessions_enabled: bool  # Keep conversation state server-side so clients send only session_id + message.
+    session_db_path: str  # SQLite file shared by all workers.
+    session_ttl_s: int  # Sessions idle longer than this are forgotten.
+    session_max: int  # Upper bound on stored sessions (oldest are dropped).
+    jobs_db_path: str  # SQLite job queue shared by all workers (order post-processing, see app/jobs.py).
+    jobs_worker: str  # "thread" (job worker threads in each web worker) or "external" (scripts/jobs_worker.py only).
+    jobs_threads: int  # Job worker threads per process.
+    jobs_poll_interval_s: float  # How often idle job workers look for jobs enqueued by other processes.
+    jobs_max_attempts: int  # Attempts per job before it is dead-lettered.
+    jobs_retry_base_s: float  # Backoff before the first retry; doubles per attempt (capped at 5 minutes).
+    order_webhook_url: str  # POSTed every order by the order job; "" = orders are only logged and kept in the queue DB.
+    history_keep_last: int  # Most recent history messages sent to the LLM verbatim; older ones are condensed.
+    history_token_budget: int  # Approximate token cap for all history in the LLM prompt.
+    chat_max_concurrent: int  # Chats answered at once per worker (0 = no limit); keep below gunicorn threads.
+    chat_max_queue: int  # Chats allowed to wait for a slot; more are rejected at once with 503.
+    chat_queue_timeout_s: float  # Longest a queued chat waits for a slot before 503.
+    rate_limit_per_min: float  # Chat requests per minute per client (session or IP), per worker. 0 = off.
+    rate_limit_burst: int  # Requests a client may send back-to-back before the per-minute rate applies.
+    proxy_hops: int  # Reverse proxies in front of the app (0 = reached directly; Render: 1). Must match the deployment.
+    llm_timeout_s: float  # Deadline for each LLM call (no SDK retries); past it the chat answers from retrieval only.
+    llm_hedge: bool  # Send a second identical completion when the first is slower than the recent p95.
+    llm_breaker_failures: int  # Consecutive LLM failures that open the circuit (retrieval-only answers meanwhile).
+    llm_breaker_reset_s: float  # How long the circuit stays open before one probe call is let through.
+    batch_max_items: int  # Questions accepted by one /api/chat/batch call.
+    batch_concurrency: int  # Rewrites/completions a batch runs at once.
+    log_format: str  # "json" (one object per line) or "text"; written by a background thread (see app/logs.py).
+    log_level: str  # Level for ordinary log calls (warnings/errors); per-request diagnostics are sampled instead.
+    log_sampling: dict[str, float]  # Per-request diagnostic sampling rate per category ("*" = the rest).
+    log_debug_token: str  # Requests with X-Debug-Token: <this> log every diagnostic; "" = disabled.
+    profile_dir: str  # Where profiled chats' collapsed stacks and summaries are written (see app/profiling.py).
+    profile_token: str  # Chats sent with X-Profile-Token: <this> are profiled; also guards /api/admin/profiles. "" = off.
+    profile_sample_rate: float  # Fraction of all chats profiled (0 = only on request).
+    profile_interval_ms: float  # Stack sampling interval of a profiled chat.
+    profile_keep: int  # Newest profiles kept in profile_dir (older ones are deleted).
 
 
 def load_settings() -> Settings:
@@ -40,6 +101,39 @@ def load_settings() -> Settings:
     raw_urls = os.getenv("GDOCS_PUBLISHED_URLS", "").strip()
     urls = [u.strip() for u in raw_urls.split(",") if u.strip()]
 
+    # "|"-separated so questions can contain commas
+    raw_warmup = os.getenv("WARMUP_QUERIES", "").strip()
+    warmup_queries = [q.strip() for q in raw_warmup.split("|") if q.strip()]
+
+    preload_index = _parse_bool(os.getenv("PRELOAD_INDEX"), False)
+    index_backend = os.getenv("INDEX_BACKEND", "chroma").strip().lower()
+    if index_backend not in ("chroma", "memory"):
+        raise RuntimeError(f"INDEX_BACKEND must be 'chroma' or 'memory', got: {index_backend}")
+    if preload_index:
+        index_backend = "memory"
+    index_quantization = os.getenv("INDEX_QUANTIZATION", "none").strip().lower()
+    if index_quantization not in ("none", "float16", "int8"):
+        raise RuntimeError(f"INDEX_QUANTIZATION must be 'none', 'float16' or 'int8', got: {index_quantization}")
+
+    index_space = os.getenv("INDEX_SPACE", "cosine").strip().lower()
+    if index_space not in ("l2", "cosine", "ip"):
+        raise RuntimeError(f"INDEX_SPACE must be 'cosine', 'l2' or 'ip', got: {index_space}")
+
+    answer_format = os.getenv("ANSWER_FORMAT", "text").strip().lower()
+    if answer_format not in ("text", "json"):
+        raise RuntimeError(f"ANSWER_FORMAT must be 'text' or 'json', got: {answer_format}")
+    rerank = os.getenv("RERANK", "off").strip().lower()
+    if rerank not in ("off", "lexical", "cross-encoder"):
+        raise RuntimeError(f"RERANK must be 'off', 'lexical' or 'cross-encoder', got: {rerank}")
+
+    jobs_worker = os.getenv("JOBS_WORKER", "thread").strip().lower()
+    if jobs_worker not in ("thread", "external"):
+        raise RuntimeError(f"JOBS_WORKER must be 'thread' or 'external', got: {jobs_worker}")
+
+    log_format = os.getenv("LOG_FORMAT", "json").strip().lower()
+    if log_format not in ("json", "text"):
+        raise RuntimeError(f"LOG_FORMAT must be 'json' or 'text', got: {log_format}")
+
     raw_origins = os.getenv("ALLOWED_ORIGINS", "*").strip()
     origins = [o.strip() for o in raw_origins.split(",") if o.strip()] if raw_origins else ["*"]
 
@@ -52,5 +146,58 @@ def load_settings() -> Settings:
         gdocs_published_urls=urls,
         allowed_origins=origins,
         port=int(os.getenv("PORT", "5000")),
+        rag_product_filter=_parse_bool(os.getenv("RAG_PRODUCT_FILTER"), True),
+        warmup_on_start=_parse_bool(os.getenv("WARMUP_ON_START"), True),
+        warmup_queries=warmup_queries,
+        index_backend=index_backend,
+        preload_index=preload_index,
+        index_quantization=index_quantization,
+        index_search_dims=_parse_embed_dimensions(os.getenv("INDEX_SEARCH_DIMS")),
+        index_rescore=int(os.getenv("INDEX_RESCORE", "50")),
+        index_space=index_space,
+        index_hnsw_m=max(2, int(os.getenv("INDEX_HNSW_M", "16"))),
+        index_hnsw_construction_ef=max(1, int(os.getenv("INDEX_HNSW_CONSTRUCTION_EF", "100"))),
+        index_hnsw_search_ef=max(1, int(os.getenv("INDEX_HNSW_SEARCH_EF", "100"))),
+        catalog_path=os.getenv("CATALOG_PATH", "").strip(),
+        answer_format=answer_format,
+        rerank=rerank,
+        rerank_top_n=max(1, int(os.getenv("RERANK_TOP_N", "4"))),
+        rerank_model=os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2").strip(),
+        index_check_interval_s=float(os.getenv("INDEX_CHECK_INTERVAL_S", "10")),
+        index_keep_snapshots=max(2, int(os.getenv("INDEX_KEEP_SNAPSHOTS", "3"))),
+        sessions_enabled=_parse_bool(os.getenv("SESSIONS"), True),
+        session_db_path=os.getenv("SESSION_DB_PATH", os.path.join(".", "data", "sessions.sqlite3")),
+        session_ttl_s=int(os.getenv("SESSION_TTL_S", "1800")),
+        session_max=int(os.getenv("SESSION_MAX", "10000")),
+        jobs_db_path=os.getenv("JOBS_DB_PATH", os.path.join(".", "data", "jobs.sqlite3")),
+        jobs_worker=jobs_worker,
+        jobs_threads=max(1, int(os.getenv("JOBS_THREADS", "1"))),
+        jobs_poll_interval_s=float(os.getenv("JOBS_POLL_INTERVAL_S", "1")),
+        jobs_max_attempts=max(1, int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))),
+        jobs_retry_base_s=float(os.getenv("JOBS_RETRY_BASE_S", "2")),
+        order_webhook_url=os.getenv("ORDER_WEBHOOK_URL", "").strip(),
+        history_keep_last=int(os.getenv("HISTORY_KEEP_LAST", "4")),
+        history_token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "800")),
+        chat_max_concurrent=int(os.getenv("CHAT_MAX_CONCURRENT", "4")),
+        chat_max_queue=int(os.getenv("CHAT_MAX_QUEUE", "4")),
+        chat_queue_timeout_s=float(os.getenv("CHAT_QUEUE_TIMEOUT_S", "2")),
+        rate_limit_per_min=float(os.getenv("RATE_LIMIT_PER_MIN", "30")),
+        rate_limit_burst=int(os.getenv("RATE_LIMIT_BURST", "10")),
+        proxy_hops=max(0, int(os.getenv("PROXY_HOPS", "0"))),
+        llm_timeout_s=float(os.getenv("LLM_TIMEOUT_S", "15")),
+        llm_hedge=_parse_bool(os.getenv("LLM_HEDGE"), False),
+        llm_breaker_failures=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+        llm_breaker_reset_s=float(os.getenv("LLM_BREAKER_RESET_S", "30")),
+        batch_max_items=int(os.getenv("BATCH_MAX_ITEMS", "500")),
+        batch_concurrency=int(os.getenv("BATCH_CONCURRENCY", "4")),
+        log_format=log_format,
+        log_level=os.getenv("LOG_LEVEL", "WARNING").strip().upper(),
+        log_sampling=parse_sampling(os.getenv("LOG_SAMPLING", "chunks=0,*=0.1")),
+        log_debug_token=os.getenv("LOG_DEBUG_TOKEN", "").strip(),
+        profile_dir=os.getenv("PROFILE_DIR", os.path.join(".", "data", "profiles")),
+        profile_token=os.getenv("PROFILE_TOKEN", "").strip(),
+        profile_sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+        profile_interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+        profile_keep=max(1, int(os.getenv("PROFILE_KEEP", "100"))),
     )
 
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from . import metrics
+
+# Local background job queue: request handlers enqueue() a row and return; worker threads (in each
+# web worker, or a separate `python -m scripts.jobs_worker` process) claim jobs one at a time and run
+# the handler registered for the job's kind. SQLite (WAL) like the session store, so every gunicorn
+# worker and the standalone worker share one queue and queued jobs survive a restart.
+#   - A job is claimed with a lease; a worker that dies mid-job loses it when the lease expires and
+#     the job is picked up again.
+#   - A failing job is retried with exponential backoff (retry_base_s * 2^(attempt-1), capped);
+#     after max_attempts it is moved to the dead-letter state ("dead") with its last error, and
+#     stays there until requeue_dead() (scripts/jobs_worker.py --requeue-dead).
+#   - Finished jobs are purged after keep_done_s.
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, DEAD = "queued", "running", "done", "dead"
+
+_RETRY_MAX_DELAY_S = 300.0
+# Done jobs are purged on every Nth completion rather than on every job.
+_PURGE_EVERY = 100
+
+Handler = Callable[[dict[str, Any]], None]
+_handlers: dict[str, Handler] = {}
+
+
+def register(kind: str, handler: Handler) -> None:
+    """handler(payload) runs jobs of this kind; raising marks the attempt failed (retried, then dead-lettered)."""
+    _handlers[kind] = handler
+
+
+@dataclass(frozen=True)
+class Job:
+    id: int
+    kind: str
+    payload: dict[str, Any]
+    attempt: int  # 1 for the first run
+    max_attempts: int
+    created_at: float
+
+
+class JobQueue:
+    def __init__(
+        self,
+        path: str,
+        *,
+        max_attempts: int = 5,
+        retry_base_s: float = 2.0,
+        lease_s: float = 60.0,
+        keep_done_s: float = 7 * 86400,
+    ) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_base_s = retry_base_s
+        self.lease_s = lease_s
+        self.keep_done_s = keep_done_s
+        self._local = threading.local()
+        self._completed = 0
+        # Wakes this process's workers as soon as it enqueues (other processes find jobs by polling).
+        self._wakeup = threading.Event()
+        # Writes from this process's threads take turns here instead of in SQLite's busy handler,
+        # which sleeps in steps of up to 100ms while the database is locked.
+        self._write_lock = threading.Lock()
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL,"
+                " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL,"
+                " run_at REAL NOT NULL, locked_until REAL, locked_by TEXT, last_error TEXT,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads; one per thread (and per forked worker).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, kind: str, payload: dict[str, Any], *, max_attempts: int | None = None) -> int:
+        """Queue a job and return its id (one INSERT; the handler runs later on a worker)."""
+        now = time.time()
+        with self._write_lock:
+            cur = self._conn().execute(
+                "INSERT INTO jobs (kind, payload, status, max_attempts, run_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), QUEUED, max_attempts or self.max_attempts, now, now, now),
+            )
+        self._wakeup.set()
+        metrics.incr("jobs.enqueued")
+        return int(cur.lastrowid)
+
+    def claim(self, worker_id: str) -> Job | None:
+        """Lease the next due job (queued, or running with an expired lease) to worker_id; None if there is none."""
+        conn = self._conn()
+        now = time.time()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # A worker that died on its last allowed attempt: dead-letter instead of running it again.
+                conn.execute(
+                    "UPDATE jobs SET status = ?, locked_until = NULL, last_error = ?, updated_at = ?"
+                    " WHERE status = ? AND locked_until < ? AND attempts >= max_attempts",
+                    (DEAD, "lease expired (worker stopped during the job)", now, RUNNING, now),
+                )
+                row = conn.execute(
+                    "SELECT id, kind, payload, attempts, max_attempts, created_at FROM jobs"
+                    " WHERE (status = ? AND run_at <= ?) OR (status = ? AND locked_until < ?)"
+                    " ORDER BY run_at, id LIMIT 1",
+                    (QUEUED, now, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ?, locked_by = ?, updated_at = ?"
+                        " WHERE id = ?",
+                        (RUNNING, now + self.lease_s, worker_id, now, row[0]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return Job(
+            id=row[0], kind=row[1], payload=json.loads(row[2]), attempt=row[3] + 1, max_attempts=row[4], created_at=row[5]
+        )
+
+    def complete(self, job: Job) -> None:
+        with self._write_lock:
+            self._conn().execute(
+                "UPDATE jobs SET status = ?, locked_until = NULL, last_error = NULL, updated_at = ? WHERE id = ?",
+                (DONE, time.time(), job.id),
+            )
+        self._completed += 1
+        if self._completed % _PURGE_EVERY == 0:
+            self.purge()
+
+    def fail(self, job: Job, error: str) -> bool:
+        """Record a failed attempt: retry later with backoff, or dead-letter it. Returns True if dead-lettered."""
+        now = time.time()
+        dead = job.attempt >= job.max_attempts
+        delay = min(_RETRY_MAX_DELAY_S, self.retry_base_s * 2 ** (job.attempt - 1))
+        with self._write_lock:
+            self._conn().execute(
+                "UPDATE jobs SET status = ?, run_at = ?, locked_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                (DEAD if dead else QUEUED, now if dead else now + delay, error[:2000], now, job.id),
+            )
+        return dead
+
+    def counts(self) -> dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {QUEUED: 0, RUNNING: 0, DONE: 0, DEAD: 0, **{status: n for status, n in rows}}
+
+    def dead_letters(self, limit: int = 50) -> list[dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT id, kind, payload, attempts, last_error, updated_at FROM jobs WHERE status = ?"
+            " ORDER BY updated_at DESC LIMIT ?",
+            (DEAD, limit),
+        ).fetchall()
+        return [
+            {"id": r[0], "kind": r[1], "payload": json.loads(r[2]), "attempts": r[3], "error": r[4], "failed_at": r[5]}
+            for r in rows
+        ]
+
+    def requeue_dead(self, ids: list[int] | None = None) -> int:
+        """Give dead-lettered jobs (all, or the given ids) a fresh set of attempts. Returns how many."""
+        now = time.time()
+        sql = "UPDATE jobs SET status = ?, attempts = 0, run_at = ?, updated_at = ? WHERE status = ?"
+        params: list[Any] = [QUEUED, now, now, DEAD]
+        if ids:
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params.extend(ids)
+        n = self._conn().execute(sql, params).rowcount
+        if n:
+            self._wakeup.set()
+        return n
+
+    def purge(self) -> None:
+        """Drop finished jobs older than keep_done_s (dead letters are kept)."""
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status = ? AND updated_at < ?", (DONE, time.time() - self.keep_done_s)
+        )
+
+    def run_one(self, worker_id: str) -> bool:
+        """Claim and run one job. Returns False when nothing was due."""
+        job = self.claim(worker_id)
+        if job is None:
+            return False
+        handler = _handlers.get(job.kind)
+        t0 = time.perf_counter()
+        metrics.observe("jobs.queue_delay_s", max(0.0, time.time() - job.created_at))
+        try:
+            if handler is None:
+                raise LookupError(f"no handler registered for job kind {job.kind!r}")
+            handler(job.payload)
+        except Exception as e:
+            if self.fail(job, f"{type(e).__name__}: {e}"):
+                metrics.incr("jobs.dead")
+                logger.warning(f"Job {job.id} ({job.kind}) dead-lettered after {job.attempt} attempt(s): {e}")
+            else:
+                metrics.incr("jobs.retried")
+                logger.warning(f"Job {job.id} ({job.kind}) attempt {job.attempt} failed, will retry: {e}")
+            return True
+        self.complete(job)
+        metrics.incr("jobs.done")
+        metrics.observe(f"jobs.{job.kind}.latency_s", time.perf_counter() - t0)
+        return True
+
+    def work(self, stop: threading.Event, *, poll_interval_s: float = 1.0, worker_id: str | None = None) -> None:
+        """Run jobs until stop is set, sleeping up to poll_interval_s (or until an enqueue) when idle."""
+        worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        while not stop.is_set():
+            try:
+                if self.run_one(worker_id):
+                    continue
+            except sqlite3.Error as e:
+                logger.warning(f"Job worker {worker_id}: queue error: {e}")
+            self._wakeup.wait(poll_interval_s)
+            self._wakeup.clear()
+
+
+_deferred: tuple[JobQueue, int, float] | None = None
+_stop = threading.Event()
+
+
+def start_workers(queue: JobQueue, *, threads: int = 1, poll_interval_s: float = 1.0) -> None:
+    """Daemon worker threads for queue in this process."""
+    for n in range(threads):
+        threading.Thread(
+            target=queue.work,
+            args=(_stop,),
+            kwargs={"poll_interval_s": poll_interval_s},
+            name=f"snackbot-jobs-{n}",
+            daemon=True,
+        ).start()
+
+
+def defer_until_fork(queue: JobQueue, *, threads: int = 1, poll_interval_s: float = 1.0) -> None:
+    """App is being created in the gunicorn master: threads don't survive fork, so each worker starts them in post_fork."""
+    global _deferred
+    _deferred = (queue, threads, poll_interval_s)
+
+
+def start_deferred() -> None:
+    if _deferred is not None:
+        queue, threads, poll_interval_s = _deferred
+        start_workers(queue, threads=threads, poll_interval_s=poll_interval_s)
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+from . import metrics
+
+# Logging for the request hot path. Request threads only put records on a bounded in-memory queue;
+# one listener thread per process formats them (JSON lines by default) and writes them to stderr,
+# so a request never waits on stderr or on other threads writing to it, and a record is only
+# formatted (args interpolated, JSON encoded) if it is actually written.
+#
+# Per-request diagnostics (timings, query rewrites, retrieval details, chunk previews) go through
+# diag(category, ...) instead of logger.warning: each category has a sampling rate (LOG_SAMPLING),
+# decided once per request so a sampled request logs all of its lines of that category, and a
+# request sent with X-Debug-Token: <LOG_DEBUG_TOKEN> logs every category. Real warnings and errors
+# are plain logger calls and are never sampled.
+
+CATEGORIES = ("request", "query", "retrieval", "chunks", "timing")
+
+_QUEUE_SIZE = 10000
+
+
+@dataclass
+class _RequestContext:
+    request_id: str
+    debug: bool = False
+    sampled: dict[str, bool] = field(default_factory=dict)
+
+
+_request: contextvars.ContextVar[_RequestContext | None] = contextvars.ContextVar("log_request", default=None)
+_sampling: dict[str, float] = {}
+_default_rate = 1.0
+_debug_token = ""
+
+
+def parse_sampling(raw: str) -> dict[str, float]:
+    """"timing=0.1,chunks=0,*=0.2" -> {"timing": 0.1, "chunks": 0.0, "*": 0.2} ("*" = categories not listed)."""
+    rates: dict[str, float] = {}
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        name, sep, value = part.partition("=")
+        name = name.strip().lower()
+        if not sep or (name != "*" and name not in CATEGORIES):
+            raise RuntimeError(f"LOG_SAMPLING entries must be <category>=<rate> with category in {CATEGORIES} or *, got: {part}")
+        rates[name] = min(1.0, max(0.0, float(value)))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out: dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("category", "request_id"):
+            value = getattr(record, key, None)
+            if value:
+                out[key] = value
+        out.update(getattr(record, "fields", None) or {})
+        if record.exc_text or record.exc_info:
+            out["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _RequestIdFilter(logging.Filter):
+    """Runs in the thread that logs: tags the record with its request before the record is queued."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = _request.get()
+        if ctx is not None and not hasattr(record, "request_id"):
+            record.request_id = ctx.request_id
+        return True
+
+
+class _BatchingStreamHandler(logging.StreamHandler):
+    """Collects formatted lines and writes them in one call per batch (one syscall, not one per line)."""
+
+    _MAX_PENDING = 256
+
+    def __init__(self, stream) -> None:
+        super().__init__(stream)
+        self._pending: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self._pending.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+        if len(self._pending) >= self._MAX_PENDING:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self._pending:
+                text = "\n".join(self._pending) + "\n"
+                self._pending.clear()
+                self.stream.write(text)
+            if hasattr(self.stream, "flush"):
+                self.stream.flush()
+
+
+class _Listener(QueueListener):
+    def handle(self, record: logging.LogRecord) -> None:
+        super().handle(record)
+        if self.queue.empty():  # caught up: write the batch out
+            for handler in self.handlers:
+                handler.flush()
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)  # waits for room; the stdlib's put_nowait fails on a full queue
+
+
+class _AsyncHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener and drops records (counted in
+    logs.dropped) when the queue is full instead of blocking the request. The queue and listener
+    are per process: after a fork (gunicorn preload) the first record starts new ones.
+    """
+
+    def __init__(self, target: logging.Handler, queue_size: int) -> None:
+        super().__init__(queue.Queue(queue_size))
+        self.target = target
+        self.queue_size = queue_size
+        self.listener: _Listener | None = None
+        self._pid: int | None = None
+        self._start_lock = threading.Lock()
+        self.addFilter(_RequestIdFilter())
+
+    def _ensure_listener(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self.queue = queue.Queue(self.queue_size)  # the parent's queue (and its lock) stay behind
+            self.listener = _Listener(self.queue, self.target, respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the traceback is rendered here (it refers to this thread's frames); msg % args is not.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr("logs.dropped")
+
+    def close(self) -> None:
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()  # writes out what is queued
+            self.listener = None
+            self.target.flush()
+        super().close()
+
+
+def configure(
+    *,
+    fmt: str = "json",
+    level: str = "WARNING",
+    sampling: dict[str, float] | None = None,
+    debug_token: str = "",
+    stream=None,
+    queue_size: int = _QUEUE_SIZE,
+) -> None:
+    """Route all logging through the background writer (replaces the root handlers)."""
+    global _sampling, _default_rate, _debug_token
+    _sampling = dict(sampling or {})
+    _default_rate = _sampling.pop("*", 1.0)
+    _debug_token = debug_token
+
+    target = _BatchingStreamHandler(stream or sys.stderr)
+    target.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter("%(levelname)s: %(message)s"))
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+        h.close()
+    root.addHandler(_AsyncHandler(target, queue_size))
+    root.setLevel(level.upper())
+
+
+def shutdown() -> None:
+    """Write out what is still queued (tests/scripts; the listener thread is a daemon)."""
+    for h in logging.getLogger().handlers:
+        if isinstance(h, _AsyncHandler):
+            h.close()
+
+
+def begin_request(request_id: str, *, debug_token: str | None = None) -> contextvars.Token:
+    debug = bool(_debug_token) and debug_token == _debug_token
+    return _request.set(_RequestContext(request_id=request_id, debug=debug))
+
+
+def end_request(token: contextvars.Token) -> None:
+    try:
+        _request.reset(token)
+    except ValueError:  # token from another context (e.g. a streamed response finishing elsewhere)
+        _request.set(None)
+
+
+def current_request_id() -> str | None:
+    ctx = _request.get()
+    return ctx.request_id if ctx else None
+
+
+def enabled(category: str) -> bool:
+    """Whether diag(category, ...) would log now: per-request debug, else the category's sampling rate."""
+    ctx = _request.get()
+    if ctx is not None and ctx.debug:
+        return True
+    rate = _sampling.get(category, _default_rate)
+    if rate >= 1.0:
+        return True
+    if rate <= 0.0:
+        return False
+    if ctx is None:
+        return random.random() < rate
+    sampled = ctx.sampled.get(category)
+    if sampled is None:
+        sampled = ctx.sampled[category] = random.random() < rate
+    return sampled
+
+
+def diag(logger: logging.Logger, category: str, msg: str, *args: Any, **fields: Any) -> None:
+    """
+    A sampled per-request diagnostic: msg % args (formatted only if written) plus structured fields.
+    Bypasses the logger level - the category's sampling rate decides instead.
+    """
+    if enabled(category):
+        _emit(logger, category, msg, args, fields)
+
+
+def timing(logger: logging.Logger, stage: str, t0: float, detail: str = "") -> None:
+    """TIMING line for a stage started at t0 (time.perf_counter())."""
+    if enabled("timing"):
+        seconds = time.perf_counter() - t0
+        _emit(
+            logger,
+            "timing",
+            "TIMING %s: %.3fs%s",
+            (stage, seconds, f" ({detail})" if detail else ""),
+            {"stage": stage, "seconds": round(seconds, 4)},
+        )
+
+
+def _emit(logger: logging.Logger, category: str, msg: str, args: tuple, fields: dict[str, Any]) -> None:
+    record = logger.makeRecord(
+        logger.name, logging.INFO, "(diag)", 0, msg, args, None, extra={"category": category, "fields": fields}
+    )
+    logger.handle(record)
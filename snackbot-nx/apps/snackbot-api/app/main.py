@@ -1,15 +1,25 @@
 from __future__ import annotations
 
+import json
 import logging
+import math
 import os
+import secrets
+import sqlite3
 import time
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, Response, send_from_directory
+from flask import Flask, g, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from . import jobs, logs, metrics, orders, profiling, warmup
+from .admission import ChatAdmission, RateLimiter
 from .config import load_settings
-from .rag.rag import answer_question
+from .rag import catalog, llm, rerank, snapshots, vectorstore
+from .rag.rag import answer_question, answer_questions, detect_single_product
+from .sessions import SessionState, SessionStore, new_session_id, valid_session_id
+from .static_assets import IMMUTABLE_PREFIX, StaticSite
 
 logger = logging.getLogger(__name__)
 
@@ -17,9 +27,16 @@ logger = logging.getLogger(__name__)
 MAX_MESSAGE_LENGTH = 2000
 MAX_HISTORY_ITEMS = 20
 
-# Simple in-memory list to store "request order" submissions (no database for now).
-# In production you would use a database (e.g. SQLite, PostgreSQL).
-ORDER_STORE: list[dict] = []
+
+def _clean_history(raw_history: object) -> list[dict[str, str]] | None:
+    if not isinstance(raw_history, list):
+        return None
+    history = [
+        {"role": str(h.get("role", "")), "content": str(h.get("content", ""))[:MAX_MESSAGE_LENGTH]}
+        for h in raw_history[:MAX_HISTORY_ITEMS]
+        if isinstance(h, dict)
+    ]
+    return history or None
 
 
 def create_app() -> Flask:
@@ -40,18 +57,162 @@ def create_app() -> Flask:
         # If no .env found, try default location
         load_dotenv(override=False)
 
-    # Enable WARNING level logging to see debug messages
-    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
-
     s = load_settings()
+    logs.configure(fmt=s.log_format, level=s.log_level, sampling=s.log_sampling, debug_token=s.log_debug_token)
+
+    profiling.configure(
+        directory=s.profile_dir,
+        token=s.profile_token,
+        sample_rate=s.profile_sample_rate,
+        interval_ms=s.profile_interval_ms,
+        keep=s.profile_keep,
+    )
 
     app = Flask(__name__)
+    if s.proxy_hops:
+        # remote_addr = the address the outermost of PROXY_HOPS proxies saw. Entries the client wrote into
+        # X-Forwarded-For are ignored only if exactly that many proxies append to it (more trusted hops
+        # than real ones would let clients pick their own rate-limit key).
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=s.proxy_hops)
     CORS(app, resources={r"/api/*": {"origins": s.allowed_origins}})
 
+    @app.before_request
+    def _log_context():
+        # Every log record of this request carries its id; X-Debug-Token turns on all diagnostics.
+        rid = request.headers.get("X-Request-ID", "")
+        g.request_id = rid if 0 < len(rid) <= 64 and rid.isprintable() else secrets.token_hex(6)
+        g.log_token = logs.begin_request(g.request_id, debug_token=request.headers.get("X-Debug-Token"))
+
+    @app.after_request
+    def _request_id_header(response):
+        if "request_id" in g:
+            response.headers["X-Request-ID"] = g.request_id
+        if "profile_id" in g:
+            response.headers["X-Profile-ID"] = g.profile_id
+        return response
+
+    @app.teardown_request
+    def _end_log_context(exc):
+        token = g.pop("log_token", None)
+        if token is not None:
+            logs.end_request(token)
+
+    llm.configure(
+        llm.LLMOptions(
+            timeout_s=s.llm_timeout_s,
+            hedge=s.llm_hedge,
+            breaker_failures=s.llm_breaker_failures,
+            breaker_reset_s=s.llm_breaker_reset_s,
+        )
+    )
+
+    catalog.configure(path=s.catalog_path)
+    rerank.configure(rerank.RerankOptions(mode=s.rerank, top_n=s.rerank_top_n, model=s.rerank_model))
+    snapshots.configure(check_interval_s=s.index_check_interval_s)
+    vectorstore.configure(
+        vectorstore.IndexParams(
+            space=s.index_space,
+            m=s.index_hnsw_m,
+            construction_ef=s.index_hnsw_construction_ef,
+            search_ef=s.index_hnsw_search_ef,
+        )
+    )
+
+    if s.index_backend == "memory":
+        from .rag import chunkstore
+
+        chunkstore.configure(
+            chunkstore.StoreOptions(
+                quantization=s.index_quantization,
+                search_dims=s.index_search_dims,
+                rescore=s.index_rescore,
+            )
+        )
+        if s.preload_index:
+            # Under gunicorn preload_app this runs in the master: load the read-only index once so
+            # forked workers share its pages, and leave the (thread-based) warm-up to post_fork.
+            # The Chroma client it was read through is closed again (load_chunk_store), so workers
+            # don't inherit its sqlite connection.
+            chunkstore.get_chunk_store(persist_dir=s.chroma_persist_dir)
+    else:
+        vectorstore.warm_new_snapshots()
+    if not s.warmup_on_start:
+        warmup.mark_ready()
+    elif s.preload_index:
+        warmup.defer_until_fork(s)
+    else:
+        warmup.start_warmup_thread(s)
+
+    sessions = (
+        SessionStore(s.session_db_path, ttl_s=s.session_ttl_s, max_sessions=s.session_max)
+        if s.sessions_enabled
+        else None
+    )
+
+    orders.configure(webhook_url=s.order_webhook_url)
+    job_queue = jobs.JobQueue(s.jobs_db_path, max_attempts=s.jobs_max_attempts, retry_base_s=s.jobs_retry_base_s)
+    if s.jobs_worker == "thread":
+        if s.preload_index:
+            jobs.defer_until_fork(job_queue, threads=s.jobs_threads, poll_interval_s=s.jobs_poll_interval_s)
+        else:
+            jobs.start_workers(job_queue, threads=s.jobs_threads, poll_interval_s=s.jobs_poll_interval_s)
+
+    admission = (
+        ChatAdmission(
+            max_concurrent=s.chat_max_concurrent,
+            max_queue=s.chat_max_queue,
+            queue_timeout_s=s.chat_queue_timeout_s,
+        )
+        if s.chat_max_concurrent > 0
+        else None
+    )
+    limiter = (
+        RateLimiter(rate_per_s=s.rate_limit_per_min / 60.0, burst=max(1, s.rate_limit_burst))
+        if s.rate_limit_per_min > 0
+        else None
+    )
+
+    def _busy(error: str, status: int, retry_after_s: float):
+        resp = jsonify({"error": error})
+        resp.headers["Retry-After"] = str(max(1, math.ceil(retry_after_s)))
+        return resp, status
+
     @app.get("/health")
     def health():
+        """Liveness: the process is up (may still be warming up)."""
         return jsonify({"ok": True})
 
+    @app.get("/ready")
+    def ready():
+        """Readiness: warm-up finished (collection open, index loaded, caches primed). 503 until then."""
+        st = warmup.status()
+        return jsonify(st), (200 if st["ready"] else 503)
+
+    @app.get("/api/metrics")
+    def api_metrics():
+        """Per-worker counters/observations (e.g. retrieval path taken and context size)."""
+        # The job queue is shared, so its backlog is the same in every worker.
+        for status, n in job_queue.counts().items():
+            metrics.gauge(f"jobs.{status}", n)
+        return jsonify(metrics.snapshot())
+
+    @app.get("/api/admin/profiles")
+    def admin_profiles():
+        """Newest chat profiles of all workers (summaries with the top frames). Needs X-Profile-Token."""
+        if not profiling.authorized(request.headers.get(profiling.HEADER)):
+            return jsonify({"error": "Not found"}), 404
+        limit = request.args.get("limit", default=20, type=int)
+        return jsonify({"profiles": profiling.recent_profiles(min(max(limit, 1), 200))})
+
+    @app.get("/api/admin/profiles/<name>")
+    def admin_profile(name: str):
+        """One profile as collapsed stacks (flamegraph.pl / speedscope input). Needs X-Profile-Token."""
+        path = profiling.collapsed_path(name) if profiling.authorized(request.headers.get(profiling.HEADER)) else None
+        if path is None:
+            return jsonify({"error": "Not found"}), 404
+        with open(path, encoding="utf-8") as f:
+            return Response(f.read(), mimetype="text/plain")
+
     @app.get("/api/test-newlines")
     def test_newlines():
         """Return plain text with newlines. If you see separate lines → newlines work."""
@@ -75,89 +236,199 @@ def create_app() -> Flask:
     @app.post("/api/order")
     def order():
         """
-        Request order: save name, phone, address and cart items.
-        Returns success. Orders are stored in memory (ORDER_STORE).
+        Request order: validate name, phone, address and cart items, then queue the order for
+        post-processing (app/orders.py) and return without waiting for it.
         """
-        data = request.get_json(silent=True) or {}
-        name = (data.get("name") or "").strip()
-        phone = (data.get("phone") or "").strip()
-        address = (data.get("address") or "").strip()
-        items = data.get("items")
-        if not name:
-            return jsonify({"error": "Name is required"}), 400
-        if not phone:
-            return jsonify({"error": "Phone is required"}), 400
-        if not address:
-            return jsonify({"error": "Address is required"}), 400
-        if not isinstance(items, list) or len(items) == 0:
-            return jsonify({"error": "At least one item is required"}), 400
-        order_record = {
-            "name": name,
-            "phone": phone,
-            "address": address,
-            "items": [
-                {
-                    "productId": str(i.get("productId", "")),
-                    "productName": str(i.get("productName", "")),
-                    "quantity": int(i.get("quantity", 1)) if isinstance(i.get("quantity"), (int, float)) else 1,
-                }
-                for i in items[:50]
-                if isinstance(i, dict)
-            ],
-        }
-        ORDER_STORE.append(order_record)
-        logger.warning(f"Order received from {name}: {len(order_record['items'])} item(s)")
+        order_record, error = orders.parse_order(request.get_json(silent=True) or {})
+        if error:
+            return jsonify({"error": error}), 400
+        job_queue.enqueue(orders.ORDER_JOB, order_record)
         return jsonify({"success": True, "message": "Order received! We'll contact you soon."})
 
+    def _rate_limited(data: dict, cost: int = 1):
+        if limiter is None:
+            return None
+        # Per session for a session the store knows (a made-up id would get a fresh bucket every time),
+        # else per IP as seen by the trusted proxy (ProxyFix above).
+        sid = data.get("session_id")
+        try:
+            known = sessions is not None and valid_session_id(sid) and sessions.exists(sid)
+        except sqlite3.Error as e:
+            logger.warning(f"Session store unavailable for rate limiting: {e}")
+            known = False
+        client_key = f"s:{sid}" if known else f"ip:{request.remote_addr}"
+        wait = limiter.take(client_key, cost)
+        if wait:
+            return _busy("Too many messages. Please slow down.", 429, wait)
+        return None
+
     @app.post("/api/chat")
     def chat():
         data = request.get_json(silent=True) or {}
+        limited = _rate_limited(data)
+        if limited is not None:
+            return limited
         msg = (data.get("message") or "").strip()
         if not msg:
             return jsonify({"error": "Missing 'message'"}), 400
         if len(msg) > MAX_MESSAGE_LENGTH:
             return jsonify({"error": f"Message too long (max {MAX_MESSAGE_LENGTH} characters)"}), 400
 
-        raw_history = data.get("history")
-        history = None
-        if isinstance(raw_history, list):
-            history = [
-                {"role": str(h.get("role", "")), "content": str(h.get("content", ""))[:MAX_MESSAGE_LENGTH]}
-                for h in raw_history[:MAX_HISTORY_ITEMS]
-                if isinstance(h, dict)
-            ]
-            history = history if history else None
+        history = _clean_history(data.get("history"))
+
+        # Server-side session: when the client sends only session_id, rebuild a compact history from it.
+        # Only ids the store knows are used; any other id (expired, purged or made up) is replaced by a
+        # new one and flagged with session_reset, so the client knows its context is gone.
+        session_id = None
+        session = None
+        session_reset = False
+        sent_id = data.get("session_id")
+        if sessions is not None:
+            try:
+                known = sessions.get(sent_id) if sent_id and valid_session_id(sent_id) else None
+            except sqlite3.Error as e:
+                # e.g. "database is locked" past the timeout: answer without a session rather than fail.
+                logger.warning(f"Session store unavailable, answering without a session: {e}")
+            else:
+                if known is not None:
+                    session_id, session = sent_id, known
+                else:
+                    session_id, session = new_session_id(), SessionState()
+                    session_reset = bool(sent_id)
+                if session_reset and history is None:
+                    # Nothing to answer from: the client resends the message with its history.
+                    return jsonify({"error": "Session expired", "session_reset": True}), 409
+                if history is None and session.turns:
+                    history = session.to_history()
 
+        if admission is not None and not admission.try_acquire():
+            return _busy("Snackbot is busy right now. Please try again in a moment.", 503, admission.queue_timeout_s)
         try:
             t_request_start = time.perf_counter()
-            logger.warning(f"📨 Received question: '{msg}'")
-            logger.warning(f"📚 History: {len(history) if history else 0} messages")
-
-            t_rag_start = time.perf_counter()
-            res = answer_question(
-                openai_api_key=s.openai_api_key,
-                chat_model=s.openai_chat_model,
-                embed_model=s.openai_embed_model,
-                embed_dimensions=s.openai_embed_dimensions,
-                persist_dir=s.chroma_persist_dir,
-                question=msg,
-                history=history,
+            logs.diag(
+                logger, "request", "Received question: %r (%d history messages)", msg, len(history or ()),
+                history_messages=len(history or ()),
             )
-            t_rag_elapsed = time.perf_counter() - t_rag_start
-            logger.warning(f"TIMING rag_total: {t_rag_elapsed:.3f}s")
 
-            t_request_elapsed = time.perf_counter() - t_request_start
-            logger.warning(f"TIMING request_total: {t_request_elapsed:.3f}s")
-            logger.warning(f"✅ Answer length: {len(res.answer)} chars")
+            t_rag_start = time.perf_counter()
+            # A no-op unless this chat is to be profiled (X-Profile-Token or PROFILE_SAMPLE_RATE).
+            with profiling.profile_request(request.headers.get(profiling.HEADER), request_id=g.request_id) as profile:
+                res = answer_question(
+                    openai_api_key=s.openai_api_key,
+                    chat_model=s.openai_chat_model,
+                    embed_model=s.openai_embed_model,
+                    embed_dimensions=s.openai_embed_dimensions,
+                    persist_dir=s.chroma_persist_dir,
+                    question=msg,
+                    history=history,
+                    use_product_filter=s.rag_product_filter,
+                    index_backend=s.index_backend,
+                    history_keep_last=s.history_keep_last,
+                    history_token_budget=s.history_token_budget,
+                    answer_format=s.answer_format,
+                )
+            if profile is not None and profile.name:
+                g.profile_id = profile.name
+            logs.timing(logger, "rag_total", t_rag_start)
+            logs.timing(logger, "request_total", t_request_start)
+            logs.diag(logger, "request", "Answer length: %d chars", len(res.answer), answer_chars=len(res.answer))
             payload = {"answer": res.answer, "answer_lines": list(res.answer_lines)}
+            if session is not None:
+                session.record_turn(
+                    question=msg,
+                    answer=res.answer,
+                    product=detect_single_product(msg, [{"content": res.answer}]),
+                    intent=res.intent or "answer",
+                )
+                try:
+                    sessions.put(session_id, session)
+                except sqlite3.Error as e:
+                    logger.warning(f"Session {session_id} not saved: {e}")
+                else:
+                    payload["session_id"] = session_id
+                    if session_reset:
+                        payload["session_reset"] = True
             if getattr(res, "intent", None) is not None:
                 payload["intent"] = res.intent
             if getattr(res, "product", None) is not None:
                 payload["product"] = res.product
             return jsonify(payload)
         except Exception as e:
-            logger.exception("❌ Chat request failed")
+            logger.exception("Chat request failed")
             return jsonify({"error": "Something went wrong. Please try again."}), 500
+        finally:
+            if admission is not None:
+                admission.release()
+
+    @app.post("/api/chat/batch")
+    def chat_batch():
+        """
+        Answer many questions in one call: {"items": [{"question": ..., "history": [...]}, ...]} or
+        {"questions": [...]}. Streams one JSON object per line (application/x-ndjson) as answers
+        finish, each with the item's "index"; order is completion order, not request order.
+        """
+        data = request.get_json(silent=True) or {}
+        raw_items = data.get("items")
+        if raw_items is None and isinstance(data.get("questions"), list):
+            raw_items = [{"question": q} for q in data["questions"]]
+        if not isinstance(raw_items, list) or not raw_items:
+            return jsonify({"error": "Missing 'items' (or 'questions')"}), 400
+        if len(raw_items) > s.batch_max_items:
+            return jsonify({"error": f"Too many items (max {s.batch_max_items})"}), 400
+        items = []
+        for i, it in enumerate(raw_items):
+            q = (str(it.get("question") or "") if isinstance(it, dict) else "").strip()
+            if not q or len(q) > MAX_MESSAGE_LENGTH:
+                return jsonify({"error": f"Item {i}: 'question' missing or longer than {MAX_MESSAGE_LENGTH} characters"}), 400
+            items.append({"question": q, "history": _clean_history(it.get("history"))})
+        # Each question counts against the client's rate limit like one /api/chat message.
+        limited = _rate_limited(data, cost=len(items))
+        if limited is not None:
+            return limited
+
+        # The batch runs up to `concurrency` LLM calls at once and holds that many chat slots meanwhile.
+        concurrency = max(1, min(s.batch_concurrency, len(items)))
+        if admission is not None:
+            concurrency = min(concurrency, admission.max_concurrent)
+            if not admission.try_acquire(concurrency):
+                return _busy("Snackbot is busy right now. Please try again in a moment.", 503, admission.queue_timeout_s)
+
+        def stream():
+            try:
+                for i, res in answer_questions(
+                    openai_api_key=s.openai_api_key,
+                    chat_model=s.openai_chat_model,
+                    embed_model=s.openai_embed_model,
+                    embed_dimensions=s.openai_embed_dimensions,
+                    persist_dir=s.chroma_persist_dir,
+                    items=items,
+                    use_product_filter=s.rag_product_filter,
+                    index_backend=s.index_backend,
+                    history_keep_last=s.history_keep_last,
+                    history_token_budget=s.history_token_budget,
+                    answer_format=s.answer_format,
+                    concurrency=concurrency,
+                ):
+                    line: dict = {"index": i, "question": items[i]["question"]}
+                    if isinstance(res, Exception):
+                        logger.error(f"Batch item {i} failed: {res!r}")
+                        line["error"] = "Something went wrong for this question."
+                    else:
+                        line.update(answer=res.answer, answer_lines=list(res.answer_lines))
+                        if res.intent is not None:
+                            line["intent"] = res.intent
+                        if res.product is not None:
+                            line["product"] = res.product
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+            except Exception:
+                logger.exception("Batch chat request failed")
+                yield json.dumps({"error": "Something went wrong. Please try again."}) + "\n"
+
+        resp = Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+        if admission is not None:
+            # Slots are held until the stream is done (or the client goes away and queued items are dropped).
+            resp.call_on_close(lambda: admission.release(concurrency))
+        return resp
 
     # One-app: serve React site at / when built (product listing + chat)
     static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
@@ -165,20 +436,25 @@ def create_app() -> Flask:
     site_has_build = os.path.isfile(os.path.join(site_dir, "index.html"))
 
     if site_has_build:
+        site = StaticSite(site_dir)  # manifest, ETags and compressed variants built once here
 
         @app.get("/")
         def index():
-            return send_from_directory(site_dir, "index.html")
+            return site.index_response(request)
 
         @app.get("/<path:path>")
         def serve_site(path):
-            if not path or path.startswith("api/") or path == "health":
+            if not path or path.startswith("api/") or path in ("health", "ready"):
+                from flask import abort
+                abort(404)
+            resp = site.response(path, request)
+            if resp is not None:
+                return resp
+            if path.startswith(IMMUTABLE_PREFIX):
+                # A missing hashed asset must not be answered (and cached for a year) as index.html.
                 from flask import abort
                 abort(404)
-            file_path = os.path.join(site_dir, path)
-            if os.path.isfile(file_path):
-                return send_from_directory(site_dir, path)
-            return send_from_directory(site_dir, "index.html")  # SPA fallback
+            return site.index_response(request)  # SPA fallback
     else:
 
         @app.get("/")
@@ -194,6 +470,9 @@ def create_app() -> Flask:
 def main() -> None:
     app = create_app()
     s = load_settings()
+    # No fork with the dev server: start what create_app() left for post_fork under PRELOAD_INDEX.
+    warmup.start_deferred()
+    jobs.start_deferred()
     debug = os.getenv("FLASK_DEBUG", "0").strip().lower() in ("1", "true", "yes")
     app.run(host="0.0.0.0", port=s.port, debug=debug)
 
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import threading
+from typing import Any
+
+# Lightweight in-process metrics (per worker process). Exposed as JSON at GET /api/metrics.
+_lock = threading.Lock()
+_counters: dict[str, int] = {}
+_observations: dict[str, dict[str, float]] = {}
+_gauges: dict[str, float] = {}
+
+
+def incr(name: str, n: int = 1) -> None:
+    """Increment a counter (e.g. how often a code path is taken)."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def observe(name: str, value: float) -> None:
+    """Record one value of a distribution (count/sum/min/max; avg is derived in snapshot)."""
+    with _lock:
+        o = _observations.get(name)
+        if o is None:
+            _observations[name] = {"count": 1, "sum": value, "min": value, "max": value}
+            return
+        o["count"] += 1
+        o["sum"] += value
+        if value < o["min"]:
+            o["min"] = value
+        if value > o["max"]:
+            o["max"] = value
+
+
+def gauge(name: str, value: float) -> None:
+    """Set a current value (e.g. requests in flight or waiting)."""
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot() -> dict[str, Any]:
+    with _lock:
+        observations = {
+            name: {**o, "avg": (o["sum"] / o["count"]) if o["count"] else 0.0}
+            for name, o in _observations.items()
+        }
+        return {"counters": dict(_counters), "gauges": dict(_gauges), "observations": observations}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _observations.clear()
+        _gauges.clear()
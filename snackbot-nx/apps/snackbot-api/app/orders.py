@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+from . import jobs
+
+# "Request order" submissions. /api/order only validates and enqueues an ORDER_JOB (the order row in
+# the job queue is its durable record); handle_order() does the rest on a job worker, so anything
+# added here later (confirmation messages, inventory checks) doesn't slow the request down.
+
+logger = logging.getLogger(__name__)
+
+ORDER_JOB = "order.received"
+MAX_ITEMS = 50
+
+_webhook_url = ""
+_webhook_timeout_s = 10.0
+
+
+def configure(*, webhook_url: str = "", webhook_timeout_s: float = 10.0) -> None:
+    global _webhook_url, _webhook_timeout_s
+    _webhook_url = webhook_url
+    _webhook_timeout_s = webhook_timeout_s
+
+
+def parse_order(data: dict[str, Any]) -> tuple[dict[str, Any] | None, str | None]:
+    """(order record, None) for a valid request body, else (None, error message)."""
+    name = (data.get("name") or "").strip()
+    phone = (data.get("phone") or "").strip()
+    address = (data.get("address") or "").strip()
+    items = data.get("items")
+    if not name:
+        return None, "Name is required"
+    if not phone:
+        return None, "Phone is required"
+    if not address:
+        return None, "Address is required"
+    if not isinstance(items, list) or len(items) == 0:
+        return None, "At least one item is required"
+    return {
+        "name": name,
+        "phone": phone,
+        "address": address,
+        "items": [
+            {
+                "productId": str(i.get("productId", "")),
+                "productName": str(i.get("productName", "")),
+                "quantity": int(i.get("quantity", 1)) if isinstance(i.get("quantity"), (int, float)) else 1,
+            }
+            for i in items[:MAX_ITEMS]
+            if isinstance(i, dict)
+        ],
+    }, None
+
+
+def handle_order(order: dict[str, Any]) -> None:
+    """Post-process one order: log it and, with ORDER_WEBHOOK_URL set, notify the shop (raises to retry)."""
+    logger.warning(f"Order received from {order['name']}: {len(order['items'])} item(s)")
+    if _webhook_url:
+        import requests
+
+        resp = requests.post(_webhook_url, json={"type": ORDER_JOB, "order": order}, timeout=_webhook_timeout_s)
+        resp.raise_for_status()
+
+
+jobs.register(ORDER_JOB, handle_order)
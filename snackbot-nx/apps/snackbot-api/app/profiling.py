@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from types import CodeType, FrameType
+from typing import Any
+
+from . import metrics
+
+# On-demand profiling of single chat requests. A profiled request runs with a sampler thread that
+# reads the request thread's stack every PROFILE_INTERVAL_MS (wall clock, so time spent waiting on
+# OpenAI shows up as socket reads next to the Python work) and writes it to PROFILE_DIR as collapsed
+# stacks ("root;caller;callee <samples>" lines, the input of flamegraph.pl and speedscope) plus a JSON
+# summary. A chat is profiled when it is sent with X-Profile-Token: <PROFILE_TOKEN>, or at random for
+# a PROFILE_SAMPLE_RATE fraction of chats. With neither configured, profile_request() returns a
+# no-op context at once: no thread, no stack reads. The sampler needs the GIL to read a stack, so
+# during pure-Python stretches it gets a sample in at most every sys.getswitchinterval() (5ms).
+
+logger = logging.getLogger(__name__)
+
+HEADER = "X-Profile-Token"
+COLLAPSED_SUFFIX = ".collapsed"
+SUMMARY_SUFFIX = ".json"
+_NAME_RE = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9]{3}-[A-Za-z0-9_-]{1,64}$")
+_TOP_FRAMES = 15
+
+_dir = os.path.join(".", "data", "profiles")
+_token = ""
+_sample_rate = 0.0
+_interval_s = 0.005
+_keep = 100
+_write_lock = threading.Lock()
+_OFF = nullcontext(None)
+
+
+def configure(
+    *, directory: str, token: str = "", sample_rate: float = 0.0, interval_ms: float = 5.0, keep: int = 100
+) -> None:
+    global _dir, _token, _sample_rate, _interval_s, _keep
+    _dir = directory
+    _token = token
+    _sample_rate = min(1.0, max(0.0, sample_rate))
+    _interval_s = max(0.001, interval_ms / 1000)
+    _keep = max(1, keep)
+
+
+def authorized(header_token: str | None) -> bool:
+    """Whether a request may use the admin endpoints (PROFILE_TOKEN set and sent)."""
+    return bool(_token) and header_token is not None and hmac.compare_digest(header_token, _token)
+
+
+def profile_request(header_token: str | None, *, request_id: str):
+    """
+    Context manager around the work of one request: a Profile (named on entry; its files are written
+    just after exit) when the request is to be profiled, else a shared no-op context yielding None.
+    """
+    if not _token and _sample_rate <= 0.0:
+        return _OFF
+    if header_token is not None and authorized(header_token):
+        return Profile(request_id=request_id, trigger="header")
+    if _sample_rate > 0.0 and random.random() < _sample_rate:
+        return Profile(request_id=request_id, trigger="sampled")
+    return _OFF
+
+
+class Profile:
+    """Samples the calling thread's stack from a background thread between __enter__ and __exit__."""
+
+    def __init__(self, *, request_id: str, trigger: str) -> None:
+        self.request_id = re.sub(r"[^A-Za-z0-9_-]", "_", request_id)[:64] or "request"
+        self.trigger = trigger
+        self.name: str | None = None
+        self.stacks: Counter[tuple[CodeType, ...]] = Counter()
+        self.samples = 0
+        self._labels: dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self) -> "Profile":
+        self._target = threading.get_ident()
+        self._root = sys._getframe(1)  # stacks stop at the frame that opened the profile
+        self.started = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        self.name = f"{stamp}-{int(self.started * 1000) % 1000:03d}-{self.request_id}"
+        self._t0 = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        # The sampler thread writes the files after its last sample, so the request doesn't wait for them.
+        self.duration_s = time.perf_counter() - self._t0
+        self._stop.set()
+
+    def _run(self) -> None:
+        current_frames = sys._current_frames
+        while not self._stop.wait(_interval_s):
+            frame: FrameType | None = current_frames().get(self._target)
+            stack: list[CodeType] = []
+            while frame is not None:
+                code = frame.f_code
+                if code not in self._labels:
+                    self._labels[code] = f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+                stack.append(code)
+                if frame is self._root:
+                    break
+                frame = frame.f_back
+            del frame
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+        self._root = None
+        try:
+            self._write()
+            metrics.incr(f"profiles.{self.trigger}")
+        except OSError as e:
+            logger.warning("Could not write profile %s: %s", self.name, e)
+
+    def collapsed(self) -> str:
+        """One "root;...;leaf <samples>" line per distinct stack."""
+        return "".join(
+            ";".join(self._labels[c] for c in stack) + f" {n}\n" for stack, n in self.stacks.most_common()
+        )
+
+    def summary(self) -> dict[str, Any]:
+        leaf: Counter[str] = Counter()
+        for stack, n in self.stacks.items():
+            leaf[self._labels[stack[-1]]] += n
+        total = self.samples or 1
+        return {
+            "name": self.name,
+            "request_id": self.request_id,
+            "trigger": self.trigger,
+            "started": round(self.started, 3),
+            "duration_ms": round(self.duration_s * 1000, 1),
+            "interval_ms": round(_interval_s * 1000, 2),
+            "samples": self.samples,
+            "top_frames": [
+                {"frame": frame, "samples": n, "share": round(n / total, 3)} for frame, n in leaf.most_common(_TOP_FRAMES)
+            ],
+        }
+
+    def _write(self) -> None:
+        os.makedirs(_dir, exist_ok=True)
+        with open(os.path.join(_dir, self.name + COLLAPSED_SUFFIX), "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        # The summary is written last: listings only show profiles whose summary exists.
+        with open(os.path.join(_dir, self.name + SUMMARY_SUFFIX), "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f)
+        _prune()
+
+
+def _names() -> list[str]:
+    """Profile names in PROFILE_DIR, newest first (names start with their timestamp)."""
+    try:
+        files = os.listdir(_dir)
+    except FileNotFoundError:
+        return []
+    return sorted((f[: -len(SUMMARY_SUFFIX)] for f in files if f.endswith(SUMMARY_SUFFIX)), reverse=True)
+
+
+def _prune() -> None:
+    # Workers share the directory; the lock only keeps this process's threads from racing each other.
+    with _write_lock:
+        for name in _names()[_keep:]:
+            for suffix in (SUMMARY_SUFFIX, COLLAPSED_SUFFIX):
+                try:
+                    os.remove(os.path.join(_dir, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+def recent_profiles(limit: int = 20) -> list[dict[str, Any]]:
+    """Summaries of the newest profiles (all workers), newest first."""
+    out = []
+    for name in _names()[: max(0, limit)]:
+        try:
+            with open(os.path.join(_dir, name + SUMMARY_SUFFIX), encoding="utf-8") as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # pruned or still being written by another worker
+    return out
+
+
+def collapsed_path(name: str) -> str | None:
+    """Path of a profile's collapsed-stack file, or None for an unknown or malformed name."""
+    if not _NAME_RE.match(name):
+        return None
+    path = os.path.join(_dir, name + COLLAPSED_SUFFIX)
+    return path if os.path.isfile(path) else None
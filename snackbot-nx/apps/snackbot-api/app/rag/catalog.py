@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+from .. import metrics
+
+# The product catalog (names, aliases users type, slugs and purchasable packs), loaded from a JSON
+# file into lookup tables once, so per-request product work doesn't grow with the catalog:
+#   - lookup(term): exact name/alias/slug -> product, one dict probe;
+#   - mentions(text): products named in free text by matching word n-grams (up to the longest
+#     alias) against the alias table - O(words in text), whatever the number of products;
+#   - by_pack_id: pack id -> (product, pack) for the purchase flow.
+# The file is re-read when it changes (checked at most every check_interval_s); a bad file keeps
+# the previous catalog. Used by the API and by ingest (product headings).
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json")
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*", re.IGNORECASE)
+
+
+def _norm(token: str) -> str:
+    return token.lower().replace("'", "")
+
+
+def normalize(text: str) -> str:
+    """Lowercase words without apostrophes or punctuation: "Lay's" -> "lays", "parle-g" -> "parle g"."""
+    return " ".join(_norm(t) for t in _TOKEN_RE.findall(text or ""))
+
+
+@dataclass(frozen=True)
+class Pack:
+    label: str  # e.g. "56g"
+    id: str  # product-detail route slug, e.g. "parle-g-56g"
+
+
+@dataclass(frozen=True)
+class Product:
+    name: str
+    slug: str
+    aliases: tuple[str, ...] = ()
+    packs: tuple[Pack, ...] = ()
+
+
+class Catalog:
+    def __init__(self, products: list[Product]) -> None:
+        self.products = tuple(products)
+        self.names = tuple(p.name for p in products)
+        self.by_slug = {p.slug: p for p in products}
+        self.by_pack_id = {pack.id: (p, pack) for p in products for pack in p.packs}
+        self.by_term: dict[str, Product] = {}
+        # Names and slugs first so an alias can't take over another product's name.
+        for p in products:
+            for term in (p.name, p.slug):
+                self.by_term.setdefault(normalize(term), p)
+        for p in products:
+            for alias in p.aliases:
+                self.by_term.setdefault(normalize(alias), p)
+        self.by_term.pop("", None)
+        self.max_words = max((len(t.split()) for t in self.by_term), default=1)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Catalog:
+        products = []
+        for entry in data["products"]:
+            name = entry["name"].strip()
+            products.append(
+                Product(
+                    name=name,
+                    slug=entry.get("slug") or normalize(name).replace(" ", "-"),
+                    aliases=tuple(a.strip().lower() for a in entry.get("aliases", []) if a.strip()),
+                    packs=tuple(Pack(label=p["label"], id=p["id"]) for p in entry.get("packs", [])),
+                )
+            )
+        if not products:
+            raise ValueError("catalog has no products")
+        return cls(products)
+
+    def lookup(self, term: str) -> Product | None:
+        """Product whose name, slug or alias is exactly term (case/punctuation-insensitive)."""
+        return self.by_term.get(normalize(term))
+
+    def find_spans(self, text: str) -> list[tuple[Product, int, int]]:
+        """(product, start, end) for each whole-word mention in text, longest alias first, left to right."""
+        tokens = list(_TOKEN_RE.finditer(text or ""))
+        words = [_norm(m.group(0)) for m in tokens]
+        found: list[tuple[Product, int, int]] = []
+        i = 0
+        while i < len(words):
+            for n in range(min(self.max_words, len(words) - i), 0, -1):
+                product = self.by_term.get(" ".join(words[i : i + n]))
+                if product is not None:
+                    found.append((product, tokens[i].start(), tokens[i + n - 1].end()))
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def mentions(self, text: str) -> list[Product]:
+        """Distinct products named in text, in order of first mention."""
+        seen: dict[str, Product] = {}
+        for product, _, _ in self.find_spans(text):
+            seen.setdefault(product.name, product)
+        return list(seen.values())
+
+    def find(self, text: str) -> Product | None:
+        """The product text is (or first names): exact term first, then the first mention."""
+        product = self.lookup(text)
+        if product is not None:
+            return product
+        spans = self.find_spans(text)
+        return spans[0][0] if spans else None
+
+
+def load_catalog(path: str) -> Catalog:
+    with open(path, encoding="utf-8") as f:
+        return Catalog.from_dict(json.load(f))
+
+
+_path = DEFAULT_PATH
+_check_interval_s = 10.0
+_lock = threading.Lock()
+_catalog: Catalog | None = None
+_stamp: tuple[int, int] | None = None
+_checked_at = 0.0
+
+
+def configure(*, path: str | None = None, check_interval_s: float | None = None) -> None:
+    global _path, _check_interval_s, _catalog, _stamp
+    with _lock:
+        if path and os.path.abspath(path) != _path:
+            _path, _catalog, _stamp = os.path.abspath(path), None, None
+        if check_interval_s is not None:
+            _check_interval_s = check_interval_s
+
+
+def _file_stamp(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def get_catalog() -> Catalog:
+    """The current catalog, reloaded if the file changed since the last check."""
+    global _catalog, _stamp, _checked_at
+    now = time.monotonic()
+    catalog = _catalog
+    if catalog is not None and now - _checked_at < _check_interval_s:
+        return catalog
+    with _lock:
+        if _catalog is not None and now - _checked_at < _check_interval_s:
+            return _catalog
+        _checked_at = now
+        stamp = _file_stamp(_path)
+        if _catalog is not None and stamp == _stamp:
+            return _catalog
+        try:
+            loaded = load_catalog(_path)
+        except Exception as e:
+            if _catalog is None:
+                raise
+            metrics.incr("catalog.reload_failed")
+            logger.warning(f"Catalog {_path} could not be reloaded, keeping the previous one: {e}")
+            _stamp = stamp
+            return _catalog
+        if _catalog is not None:
+            metrics.incr("catalog.reloads")
+            logger.warning(f"Catalog reloaded: {len(loaded.products)} products")
+        _catalog, _stamp = loaded, stamp
+        return _catalog
@@ -0,0 +1,405 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from . import snapshots
+
+logger = logging.getLogger(__name__)
+
+# Read-only in-memory copy of the Chroma collection, searched with NumPy (INDEX_BACKEND=memory).
+# Everything lives in a few large buffers (one float32 matrix, UTF-8 blobs + offsets, interned
+# product/url/title codes), so when it is loaded in the gunicorn master before fork (PRELOAD_INDEX=1)
+# the workers share the pages: refcount updates only touch the handful of array objects, not one
+# Python object per chunk. Searches return row/distance arrays (ChunkHits), not per-hit dicts.
+_stores: dict[str, "ChunkStore"] = {}
+_stores_lock = threading.Lock()
+
+# Full-precision vectors for rescoring, written into the snapshot by ingest/reindex (write_full_vectors)
+# and memory-mapped by every load; loads never write into a snapshot.
+FULL_VECTORS_FILENAME = "chunkstore-full-f32.npy"
+
+# Rows scored per step when the search matrix is quantized, so the float32 upcast stays small.
+_SCORE_BLOCK_ROWS = 4096
+
+
+@dataclass(frozen=True)
+class StoreOptions:
+    """
+    How the search vectors are held in memory (INDEX_QUANTIZATION / INDEX_SEARCH_DIMS / INDEX_RESCORE).
+    quantization: "none" (float32), "float16" or "int8" (per-row scale).
+    search_dims: Matryoshka truncation - search on the first N dims only (text-embedding-3 models allow this).
+    rescore: when quantized/truncated, this many candidates are re-ranked with the full float32 vectors,
+      memory-mapped from the snapshot's FULL_VECTORS_FILENAME so only those rows are paged in. A snapshot
+      without the file (built before it existed) is searched without rescoring until reindexed.
+    """
+
+    quantization: str = "none"
+    search_dims: int | None = None
+    rescore: int = 50
+
+
+_options = StoreOptions()
+
+
+def configure(options: StoreOptions) -> None:
+    """Set how stores are built; call before the first get_chunk_store() (create_app does)."""
+    global _options
+    _options = options
+
+
+def _pack_strings(values: list[str]) -> tuple[bytes, np.ndarray]:
+    """All strings in one UTF-8 buffer; string i is blob[offsets[i]:offsets[i + 1]]."""
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return b"".join(encoded), offsets
+
+
+def _intern(values: list[str]) -> tuple[tuple[str, ...], np.ndarray]:
+    """Repeated metadata (url/title) as a small table of distinct strings plus one int32 code per chunk."""
+    table: dict[str, int] = {}
+    codes = np.array([table.setdefault(v, len(table)) for v in values], dtype=np.int32)
+    return tuple(table), codes
+
+
+class ChunkStore:
+    """
+    Chunk ids, texts, products and embeddings of one persist_dir, ordered by product so each
+    product's chunks are a contiguous row range (product-filtered search is a slice, not a scan).
+    space is the collection's distance space, so rows rank as Chroma ranks them: "cosine" normalizes
+    rows and queries, "l2" ranks by squared L2 and "ip" by 1 - dot. Distances are reported as cosine
+    distances like vectorstore.ChromaHits (squared L2 is halved; exact for unit-length embeddings).
+    """
+
+    def __init__(
+        self,
+        *,
+        ids: list[str],
+        texts: list[str],
+        products: list[str],
+        embeddings: np.ndarray,
+        urls: list[str] | None = None,
+        titles: list[str] | None = None,
+        options: StoreOptions | None = None,
+        full_path: str | None = None,
+        space: str = "l2",
+    ) -> None:
+        self.space = space
+        order = sorted(range(len(ids)), key=lambda i: (products[i], ids[i]))
+        self.product_names: tuple[str, ...] = tuple(sorted(set(products)))
+        code_of = {p: c for c, p in enumerate(self.product_names)}
+        self.product_codes = np.array([code_of[products[i]] for i in order], dtype=np.int32)
+        # product code -> [start, end) row range
+        self.product_ranges = np.zeros((len(self.product_names), 2), dtype=np.int64)
+        for code in range(len(self.product_names)):
+            rows = np.flatnonzero(self.product_codes == code)
+            self.product_ranges[code] = (rows[0], rows[-1] + 1)
+        self._code_of = code_of
+
+        self.urls, self.url_codes = _intern([(urls or [""] * len(ids))[i] for i in order])
+        self.titles, self.title_codes = _intern([(titles or [""] * len(ids))[i] for i in order])
+
+        self.id_blob, self.id_offsets = _pack_strings([ids[i] for i in order])
+        self.text_blob, self.text_offsets = _pack_strings([texts[i] for i in order])
+        full = np.ascontiguousarray(embeddings[order], dtype=np.float32)
+        if space == "cosine" and len(full):
+            norms = np.linalg.norm(full, axis=1, keepdims=True)
+            full /= np.where(norms == 0, 1.0, norms)
+        self._build_search_matrix(full, options or StoreOptions(), full_path)
+
+    def _build_search_matrix(self, full: np.ndarray, options: StoreOptions, full_path: str | None) -> None:
+        dim = full.shape[1] if full.ndim == 2 else 0
+        d = min(options.search_dims or dim, dim)
+        m = full[:, :d]
+        if d < dim:
+            # Matryoshka: the leading dims are a usable embedding on their own once re-normalized.
+            norms = np.linalg.norm(m, axis=1, keepdims=True)
+            m = m / np.where(norms == 0, 1.0, norms)
+        self.search_dims = d
+        self.quantization = options.quantization
+        self.scales: np.ndarray | None = None
+        if options.quantization == "float16":
+            self.search_matrix = m.astype(np.float16)
+        elif options.quantization == "int8":
+            scales = np.abs(m).max(axis=1) / 127.0 if len(m) else np.zeros(0, dtype=np.float32)
+            scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+            self.search_matrix = np.round(m / scales[:, None]).astype(np.int8)
+            self.scales = scales
+        else:
+            self.search_matrix = np.ascontiguousarray(m, dtype=np.float32)
+        self.sq_norms = np.einsum("ij,ij->i", m, m).astype(np.float32)
+
+        # Full-precision vectors for rescoring. Without quantization/truncation they are the search matrix.
+        self.rescore = options.rescore if (d < dim or options.quantization != "none") else 0
+        if not self.rescore:
+            self.embeddings = self.search_matrix
+            self.full_sq_norms = self.sq_norms
+            return
+        if full_path:
+            mapped = _mapped_full_vectors(full_path, full)
+            if mapped is None:
+                # Holding `full` in memory next to the quantized copy would cost more than quantizing saves.
+                self.rescore = 0
+                self.embeddings = self.search_matrix
+                self.full_sq_norms = self.sq_norms
+                return
+            self.embeddings = mapped
+        else:
+            self.embeddings = full
+        self.full_sq_norms = np.einsum("ij,ij->i", full, full).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.product_codes)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.vector_nbytes + len(self.text_blob) + self.text_offsets.nbytes
+            + len(self.id_blob) + self.id_offsets.nbytes + self.product_codes.nbytes + self.product_ranges.nbytes
+            + self.url_codes.nbytes + self.title_codes.nbytes
+        )
+
+    @property
+    def vector_nbytes(self) -> int:
+        """Resident bytes of the vectors (the memory-mapped full-precision copy is not counted)."""
+        n = self.search_matrix.nbytes + self.sq_norms.nbytes
+        if self.scales is not None:
+            n += self.scales.nbytes
+        if self.rescore:
+            n += self.full_sq_norms.nbytes
+        return n
+
+    def chunk_id(self, row: int) -> str:
+        return self.id_blob[self.id_offsets[row]:self.id_offsets[row + 1]].decode("utf-8")
+
+    def text(self, row: int) -> str:
+        return self.text_blob[self.text_offsets[row]:self.text_offsets[row + 1]].decode("utf-8")
+
+    def product(self, row: int) -> str:
+        return self.product_names[self.product_codes[row]]
+
+    def metadata(self, row: int) -> dict[str, str]:
+        """Chroma-style metadata dict, only built when a caller needs it (e.g. for sources)."""
+        return {
+            "product": self.product(row),
+            "url": self.urls[self.url_codes[row]],
+            "title": self.titles[self.title_codes[row]],
+        }
+
+    def search(self, q_emb: list[float], k: int, product: str | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k rows in the store's space (optionally within one product). Returns (rows, distances).
+        With quantized/truncated vectors the top `rescore` candidates are re-ranked on full precision,
+        so returned distances are always exact.
+        """
+        return self.search_many([q_emb], k, product=product)[0]
+
+    def search_many(
+        self, q_embs: list[list[float]], k: int, product: str | None = None
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """search() for several queries with one matrix product over the (product's) rows."""
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        lo, hi = 0, len(self)
+        if product is not None:
+            code = self._code_of.get(product)
+            if code is None:
+                return [empty] * len(q_embs)
+            lo, hi = self.product_ranges[code]
+        k = min(k, hi - lo)
+        if k <= 0 or not len(q_embs):
+            return [empty] * len(q_embs)
+        q_full = np.asarray(q_embs, dtype=np.float32).reshape(len(q_embs), -1)
+        if self.space == "cosine":
+            norms = np.linalg.norm(q_full, axis=1, keepdims=True)
+            q_full = q_full / np.where(norms > 0, norms, 1.0)
+        q = q_full[:, : self.search_dims]
+        if self.search_dims < q_full.shape[1]:
+            norms = np.linalg.norm(q, axis=1, keepdims=True)
+            q = q / np.where(norms > 0, norms, 1.0)
+
+        dists = self._approx_distances(q, lo, hi)
+        return [self._top_k(q_full[j], dists[j], k, lo, hi) for j in range(len(q_full))]
+
+    def _top_k(self, q_full: np.ndarray, dists: np.ndarray, k: int, lo: int, hi: int) -> tuple[np.ndarray, np.ndarray]:
+        n_candidates = min(max(k, self.rescore), hi - lo)
+        top = np.argpartition(dists, n_candidates - 1)[:n_candidates] if n_candidates < len(dists) else np.arange(len(dists))
+        rows = top + lo
+        if self.rescore:
+            cand = np.sort(rows)  # sorted row order keeps reads from the memory-mapped file sequential
+            exact = self._distances(
+                np.asarray(self.embeddings[cand]) @ q_full, self.full_sq_norms[cand], np.dot(q_full, q_full)
+            )
+            best = np.argsort(exact)[:k]
+            return cand[best], np.maximum(exact[best], 0.0)
+        best = np.argsort(dists[top])[:k]
+        return rows[best], np.maximum(dists[top][best], 0.0)
+
+    def _distances(self, dots: np.ndarray, sq_norms: np.ndarray, q_sq: np.ndarray | float) -> np.ndarray:
+        """Dot products -> cosine-scale distances, in place: 1 - x.q for "ip", else |x - q|^2 / 2."""
+        if self.space == "ip":
+            dots *= -1.0
+            dots += 1.0
+            return dots
+        # |x - q|^2 = |x|^2 + |q|^2 - 2 x.q
+        dots *= -2.0
+        dots += sq_norms
+        dots += q_sq
+        dots *= 0.5
+        return dots
+
+    def _approx_distances(self, q: np.ndarray, lo: int, hi: int) -> np.ndarray:
+        # (queries, dims) matrix q -> (queries, rows) distances
+        if self.quantization == "none":
+            dots = q @ self.search_matrix[lo:hi].T
+        else:
+            dots = np.empty((len(q), hi - lo), dtype=np.float32)
+            for b in range(lo, hi, _SCORE_BLOCK_ROWS):
+                e = min(hi, b + _SCORE_BLOCK_ROWS)
+                dots[:, b - lo:e - lo] = q @ self.search_matrix[b:e].astype(np.float32).T
+            if self.scales is not None:
+                dots *= self.scales[lo:hi]
+        return self._distances(dots, self.sq_norms[lo:hi], np.einsum("ij,ij->i", q, q)[:, None])
+
+
+def _mapped_full_vectors(path: str, full: np.ndarray) -> np.ndarray | None:
+    """The snapshot's full-precision file memory-mapped, or None if it is missing or stale."""
+    try:
+        mapped = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        logger.warning(
+            f"No full-precision vectors at {path} (older snapshot?); searching without rescoring "
+            "until `python -m scripts.reindex` rebuilds it"
+        )
+        return None
+    # Same rows in the same order (spot-checked at both ends), else the file belongs to other data.
+    if mapped.shape != full.shape or mapped.dtype != full.dtype or (
+        len(full) and not (np.array_equal(mapped[0], full[0]) and np.array_equal(mapped[-1], full[-1]))
+    ):
+        logger.warning(
+            f"Full-precision vectors at {path} don't match the collection; searching without rescoring "
+            "until `python -m scripts.reindex` rebuilds it"
+        )
+        return None
+    return mapped
+
+
+class ChunkHits:
+    """
+    Search result as two small arrays (store rows + distances); texts and metadata are read from the
+    store on access instead of being copied into nested lists/dicts per hit. Same interface as
+    vectorstore.ChromaHits.
+    """
+
+    __slots__ = ("store", "rows", "distances")
+
+    def __init__(self, store: ChunkStore, rows: np.ndarray, distances: np.ndarray) -> None:
+        self.store = store
+        self.rows = rows
+        self.distances = distances
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def text(self, i: int) -> str:
+        return self.store.text(self.rows[i])
+
+    def product(self, i: int) -> str:
+        return self.store.product(self.rows[i])
+
+    def chunk_id(self, i: int) -> str:
+        return self.store.chunk_id(self.rows[i])
+
+    def metadata(self, i: int) -> dict[str, str]:
+        return self.store.metadata(self.rows[i])
+
+
+def read_collection(*, persist_dir: str) -> dict[str, Any]:
+    """Every chunk of the Chroma collection as ChunkStore constructor arguments."""
+    from .vectorstore import collection_space, get_chroma_collection
+
+    col = get_chroma_collection(persist_dir=persist_dir)
+    data: dict[str, Any] = col.get(include=["embeddings", "documents", "metadatas"])
+    metas = [m or {} for m in (data.get("metadatas") or [])]
+    embeddings = data.get("embeddings")
+    return {
+        "ids": list(data.get("ids") or []),
+        "texts": [d or "" for d in (data.get("documents") or [])],
+        "products": [m.get("product", "Unknown") for m in metas],
+        "urls": [m.get("url", "") for m in metas],
+        "titles": [m.get("title", "") for m in metas],
+        "space": collection_space(col),
+        "embeddings": np.asarray(
+            embeddings if embeddings is not None and len(embeddings) else np.zeros((0, 0)), dtype=np.float32
+        ),
+    }
+
+
+def write_full_vectors(*, snapshot_dir: str) -> int:
+    """
+    Write snapshot_dir's full-precision rescoring vectors (store row order, normalized for cosine)
+    to FULL_VECTORS_FILENAME. Ingest and reindex call this before publishing. Returns the row count.
+    """
+    store = ChunkStore(**read_collection(persist_dir=snapshot_dir))
+    path = os.path.join(snapshot_dir, FULL_VECTORS_FILENAME)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, store.embeddings)
+    os.replace(tmp, path)
+    return len(store)
+
+
+def load_chunk_store(*, persist_dir: str) -> ChunkStore:
+    """
+    Read every chunk (with its embedding) from the Chroma collection into a ChunkStore, then close
+    the collection: searches don't need it, and in the gunicorn master its sqlite connection must
+    not be inherited by forked workers.
+    """
+    from .vectorstore import release_collection
+
+    t0 = time.perf_counter()
+    store = ChunkStore(
+        **read_collection(persist_dir=persist_dir),
+        options=_options,
+        full_path=os.path.join(persist_dir, FULL_VECTORS_FILENAME),
+    )
+    release_collection(persist_dir=persist_dir)
+    per_chunk = store.nbytes / len(store) if len(store) else 0
+    logger.warning(
+        f"TIMING chunk_store_load: {time.perf_counter() - t0:.3f}s "
+        f"({len(store)} chunks, {store.nbytes / 1e6:.1f} MB, {per_chunk:.0f} B/chunk, "
+        f"vectors {store.quantization} x {store.search_dims} dims, {store.space})"
+    )
+    return store
+
+
+def get_chunk_store(*, persist_dir: str) -> ChunkStore:
+    """
+    Chunk store for the active snapshot of persist_dir, loaded once per process (or inherited from
+    the gunicorn master).
+    """
+    key = snapshots.active_dir(persist_dir)
+    store = _stores.get(key)
+    if store is not None:
+        return store
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = load_chunk_store(persist_dir=key)
+        return _stores[key]
+
+
+def _drop_store(old_dir: str, new_dir: str) -> None:
+    with _stores_lock:
+        _stores.pop(old_dir, None)
+
+
+# A new snapshot is loaded before it is swapped in; the old store is released after.
+snapshots.on_load(lambda snapshot_dir: get_chunk_store(persist_dir=snapshot_dir))
+snapshots.on_swap(_drop_store)
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+
+from . import snapshots
+
+# Structured product facts read straight from retrieved chunk text (no LLM), and the deterministic
+# product card rendered from them. Used when the completion is unavailable (see llm.py).
+# With ANSWER_FORMAT=json the LLM returns the same facts as JSON (PRODUCT_ANSWER_SCHEMA) and the
+# card is rendered from those; the facts are remembered per product for the purchase flow.
+# Chunks are whitespace-flattened doc text, e.g. "... Stock Availability In Stock Price Range (INR)
+# 30g – ₹10 55g – ₹20 Available Pack Sizes 30g, 55g, 90g Ingredients ...".
+
+_SIZE = r"\d+(?:\.\d+)?\s*(?:kg|g|ml|l)\b"
+_AVAILABILITY_RE = re.compile(r"(?i)Stock\s+Availability\s*:?\s*(In\s+Stock|Out\s+of\s+Stock)")
+_PRICE_RE = re.compile(rf"(?i)({_SIZE})\s*[–—:-]\s*₹\s*(\d+(?:\.\d+)?)")
+_PACK_SIZES_RE = re.compile(rf"(?i)Available\s+Pack\s+Sizes\s*:?\s*((?:{_SIZE}[\s,/&]*(?:and\s+)?)+)")
+_SIZE_RE = re.compile(rf"(?i){_SIZE}")
+
+
+def _norm_size(size: str) -> str:
+    return re.sub(r"\s+", "", size).lower()
+
+
+def extract_product_facts(product: str, texts: list[str]) -> dict | None:
+    """
+    Availability, pack-wise prices and pack sizes for product from chunk texts (nearest first; the
+    first chunk that states a fact wins). None when the chunks state none of them.
+    """
+    availability = None
+    prices: dict[str, str] = {}
+    pack_sizes: list[str] = []
+    for text in texts:
+        if availability is None:
+            m = _AVAILABILITY_RE.search(text)
+            if m:
+                availability = " ".join(m.group(1).split()).title().replace(" Of ", " of ")
+        for size, price in _PRICE_RE.findall(text):
+            prices.setdefault(_norm_size(size), price)
+        if not pack_sizes:
+            m = _PACK_SIZES_RE.search(text)
+            if m:
+                pack_sizes = list(dict.fromkeys(_norm_size(s) for s in _SIZE_RE.findall(m.group(1))))
+    if availability is None and not prices and not pack_sizes:
+        return None
+    return {
+        "product": product,
+        "availability": availability,
+        "prices": [f"{size} – ₹{price}" for size, price in prices.items()],
+        "pack_sizes": pack_sizes or list(prices),
+    }
+
+
+def render_product_card(facts: dict, *, purchase_question: bool = True) -> str:
+    """The product reply in the same layout the LLM is asked to produce."""
+    parts = [f"Yes, we have {facts['product']}."]
+    if facts.get("availability"):
+        parts.append(f"Availability: {facts['availability']}")
+    if facts.get("prices"):
+        parts.append("Price:\n" + "\n".join(f"- {p}" for p in facts["prices"]))
+    if facts.get("pack_sizes"):
+        parts.append("Pack sizes:\n" + "\n".join(f"- {s}" for s in facts["pack_sizes"]))
+    if purchase_question:
+        parts.append("Would you like to buy this product? (Yes/No)")
+    return "\n\n".join(parts)
+
+
+# Structured-outputs schema for the answer completion (strict mode: every key required, nulls allowed).
+PRODUCT_ANSWER_SCHEMA = {
+    "name": "product_answer",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "additionalProperties": False,
+        "required": ["product", "availability", "prices", "pack_sizes", "message", "follow_up"],
+        "properties": {
+            "product": {"type": ["string", "null"]},
+            "availability": {"type": ["string", "null"], "enum": ["In Stock", "Out of Stock", None]},
+            "prices": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "additionalProperties": False,
+                    "required": ["size", "inr"],
+                    "properties": {"size": {"type": "string"}, "inr": {"type": "number"}},
+                },
+            },
+            "pack_sizes": {"type": "array", "items": {"type": "string"}},
+            "message": {"type": ["string", "null"]},
+            "follow_up": {"type": "boolean"},
+        },
+    },
+}
+
+
+def parse_structured_answer(content: str) -> dict | None:
+    """Product facts (extract_product_facts layout) plus "message" and "follow_up"; None if not valid."""
+    try:
+        data = json.loads(content)
+        prices = [
+            f"{_norm_size(p['size'])} – ₹{p['inr']:g}" for p in data["prices"] if str(p["size"]).strip()
+        ]
+        return {
+            "product": (data["product"] or "").strip() or None,
+            "availability": data["availability"] or None,
+            "prices": prices,
+            "pack_sizes": [_norm_size(s) for s in data["pack_sizes"] if s.strip()],
+            "message": (data["message"] or "").strip() or None,
+            "follow_up": bool(data["follow_up"]),
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def render_structured_answer(answer: dict) -> str:
+    """Text for a parsed structured answer: the card (when there are product facts), message, purchase question."""
+    parts = []
+    if answer["product"] and (answer["availability"] or answer["prices"] or answer["pack_sizes"]):
+        parts.append(render_product_card(answer, purchase_question=False))
+    elif answer["product"] and not answer["message"]:
+        parts.append(f"Yes, we have {answer['product']}.")
+    if answer["message"]:
+        parts.append(answer["message"])
+    if answer["follow_up"] and answer["product"]:
+        parts.append("Would you like to buy this product? (Yes/No)")
+    return "\n\n".join(parts)
+
+
+# Latest structured facts per product, from answers already given. Cleared when a new index snapshot
+# is swapped in, since the facts came from the old one.
+_remembered: dict[str, dict] = {}
+_remembered_lock = threading.Lock()
+
+
+def remember_product_facts(facts: dict) -> None:
+    with _remembered_lock:
+        _remembered[facts["product"]] = {k: facts[k] for k in ("product", "availability", "prices", "pack_sizes")}
+
+
+def remembered_product_facts(product: str) -> dict | None:
+    return _remembered.get(product)
+
+
+def _forget_all(old_dir: str, new_dir: str) -> None:
+    with _remembered_lock:
+        _remembered.clear()
+
+
+snapshots.on_swap(_forget_all)
@@ -53,13 +53,22 @@ def fetch_published_doc(url: str, *, timeout_s: int = 20) -> GDoc:
     Works well for URLs like:
     - https://docs.google.com/document/d/e/<id>/pub?embedded=true
     """
+    return parse_html(url, fetch_html(url, timeout_s=timeout_s))
+
+
+def fetch_html(url: str, *, timeout_s: int = 20) -> str:
+    """Raw HTML of a published (or publicly shared) Google Doc."""
     # If user pasted an /edit link, try fetching the export HTML instead.
     fetch_url = _to_export_url(url)
 
     resp = requests.get(fetch_url, timeout=timeout_s)
     resp.raise_for_status()
+    return resp.text
+
 
-    soup = BeautifulSoup(resp.text, "html.parser")
+def parse_html(url: str, html: str) -> GDoc:
+    """Title and visible text of an HTML document (CPU-bound; ingest runs it in worker processes)."""
+    soup = BeautifulSoup(html, "html.parser")
     title = _guess_title(url, soup)
 
     # Extract visible text
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import re
+
+# History compaction for the LLM prompt: the last few turns stay verbatim, older ones are collapsed
+# into one short message (product cards become one-line facts), and the total is kept under a
+# token budget. Pure string work - no extra LLM call.
+
+_CARD_PRODUCT_RE = re.compile(r"(?i)\bYes,?\s*we have\s+([^.\n]+)\.")
+_AVAILABILITY_RE = re.compile(r"(?i)\bAvailability:\s*([^\n]+?)\s*(?:\n|$)")
+_SECTION_RE = r"(?is)\b{label}:\s*\n?(.*?)(?:\n\s*\n|\n(?=[A-Z][^\n]*:)|Would you like|$)"
+_BULLET_RE = re.compile(r"^\s*-\s*(.+?)\s*$", re.MULTILINE)
+
+# Rough token estimate (OpenAI tokenizers average ~4 chars/token for English).
+CHARS_PER_TOKEN = 4
+# Older non-card messages are cut to this many characters.
+OLD_MESSAGE_CHARS = 160
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _section_items(text: str, label: str) -> list[str]:
+    m = re.search(_SECTION_RE.format(label=label), text)
+    if not m:
+        return []
+    return [b for b in _BULLET_RE.findall(m.group(1)) if b]
+
+
+def parse_product_card(text: str) -> dict | None:
+    """
+    Parse an assistant product reply in the fixed card format
+    ("Yes, we have X." / "Availability: ..." / "Price:" bullets / "Pack sizes:" bullets).
+    Returns {"product", "availability", "prices", "pack_sizes"} or None if it isn't a card.
+    """
+    if not text or "Availability:" not in text:
+        return None
+    m = _CARD_PRODUCT_RE.search(text)
+    if not m:
+        return None
+    availability = _AVAILABILITY_RE.search(text)
+    return {
+        "product": m.group(1).strip(),
+        "availability": availability.group(1).strip() if availability else None,
+        "prices": _section_items(text, "Price"),
+        "pack_sizes": _section_items(text, "Pack sizes"),
+    }
+
+
+def card_to_fact(card: dict) -> str:
+    """One-line structured fact for a parsed product card."""
+    parts = [card["product"]]
+    if card.get("availability"):
+        parts.append(card["availability"])
+    if card.get("prices"):
+        parts.append("price " + ", ".join(card["prices"]))
+    if card.get("pack_sizes"):
+        parts.append("packs " + ", ".join(card["pack_sizes"]))
+    return "; ".join(parts)
+
+
+def _collapse(message: dict[str, str]) -> str:
+    role = message["role"]
+    content = " ".join(message["content"].split())
+    if role == "assistant":
+        card = parse_product_card(message["content"])
+        if card:
+            return f"bot: {card_to_fact(card)}"
+    if len(content) > OLD_MESSAGE_CHARS:
+        content = content[: OLD_MESSAGE_CHARS - 1].rstrip() + "…"
+    return f"{'user' if role == 'user' else 'bot'}: {content}"
+
+
+def compact_history(
+    history: list[dict[str, str]] | None,
+    *,
+    keep_last: int = 4,
+    token_budget: int = 800,
+) -> list[dict[str, str]]:
+    """
+    Chat messages for the prompt: up to keep_last most recent user/assistant messages verbatim, plus
+    one leading assistant message summarizing everything older. The oldest lines of the summary - then
+    the oldest verbatim messages - are dropped until the estimated tokens fit token_budget.
+    """
+    messages = [
+        {"role": (h.get("role") or "").strip().lower(), "content": (h.get("content") or "").strip()}
+        for h in (history or [])
+    ]
+    messages = [m for m in messages if m["role"] in ("user", "assistant") and m["content"]]
+    if not messages:
+        return []
+
+    split = max(0, len(messages) - keep_last)
+    older, recent = messages[:split], messages[split:]
+    summary_lines = [_collapse(m) for m in older]
+
+    def total() -> int:
+        n = sum(estimate_tokens(m["content"]) for m in recent)
+        if summary_lines:
+            n += estimate_tokens("\n".join(summary_lines)) + 10
+        return n
+
+    while summary_lines and total() > token_budget:
+        summary_lines.pop(0)
+    # Always keep the latest message (yes-to-buy and vague follow-ups depend on it).
+    while len(recent) > 1 and total() > token_budget:
+        recent.pop(0)
+
+    if not summary_lines:
+        return recent
+    summary = "Earlier in this conversation (condensed):\n" + "\n".join(summary_lines)
+    return [{"role": "assistant", "content": summary}] + recent
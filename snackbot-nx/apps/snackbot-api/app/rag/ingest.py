@@ -0,0 +1,446 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+
+from .chunking import chunk_text
+from .gdocs import GDoc, fetch_html, parse_html
+from .vectorstore import embed_documents, upsert_documents
+
+# Streaming ingest: fetch -> parse/split -> chunk -> embed -> write, each stage on its own thread(s)
+# and connected by small bounded queues, so memory holds a few documents and batches at a time
+# whatever the catalog size, and chunks are written as soon as they are embedded.
+#   fetch   thread: downloads Google Docs / reads local .html/.md/.txt files
+#   parse   process pool: HTML -> text and the split into per-product sections (CPU-bound)
+#   chunk   thread: chunk_text() per section, batches of batch_size chunks; chunks the checkpoint
+#           already has (same id and text) are skipped
+#   embed   threads: one embeddings call per batch
+#   write   caller's thread: upsert into the snapshot's collection, then append to the checkpoint
+# The checkpoint (CHECKPOINT_FILE in the snapshot being built) makes an interrupted run resumable:
+# a re-run into the same snapshot only embeds what isn't written yet.
+
+CHECKPOINT_FILE = "ingest-checkpoint.jsonl"
+LOCAL_EXTENSIONS = (".html", ".htm", ".md", ".markdown", ".txt")
+
+_QUEUE_SIZE = 2
+_DONE = object()
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Source:
+    uri: str  # Google Docs URL or local file path
+    local: bool = False
+
+
+@dataclass
+class IngestStats:
+    sources: int = 0
+    docs_parsed: int = 0
+    sections: int = 0
+    chunks: int = 0
+    chunks_skipped: int = 0
+    chunks_written: int = 0
+    batches: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        return (
+            f"docs {self.docs_parsed}/{self.sources} | sections {self.sections} | chunks {self.chunks} "
+            f"(written {self.chunks_written}, skipped {self.chunks_skipped}) | "
+            f"{self.chunks_written / elapsed if elapsed else 0:.1f} chunks/s | {elapsed:.1f}s"
+        )
+
+
+def slug(s: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", s.lower()).strip("-")
+
+
+def local_sources(paths: Iterable[str]) -> list[Source]:
+    """Files under paths (files or directories) with a supported extension, in name order."""
+    found: list[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _dirs, files in os.walk(path):
+                found.extend(os.path.join(root, f) for f in files if f.lower().endswith(LOCAL_EXTENSIONS))
+        elif os.path.isfile(path):
+            found.append(path)
+        else:
+            raise FileNotFoundError(path)
+    return [Source(os.path.abspath(p), local=True) for p in sorted(found)]
+
+
+def split_doc_by_products(doc_text: str, products: Iterable[str]) -> dict[str, str]:
+    """
+    Split a single doc into sections by product headings.
+
+    This expects the doc to contain the product names as standalone headings/lines, like:
+      Lays
+      ...
+      Cadbury Dairy Milk Silk
+      ...
+    """
+    text = doc_text or ""
+    parts: dict[str, str] = {}
+
+    # Normalize whitespace a bit while keeping newlines for heading detection.
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+
+    # Build a case-insensitive regex that matches any product heading on its own line.
+    # Also try to match headings that might have extra formatting
+    escaped = [re.escape(p) for p in products]
+    # Match product name at start of line, optionally followed by whitespace and end of line
+    # Case-insensitive matching - also allow partial matches
+    headings_re = re.compile(rf"(?mi)^(?:{'|'.join(escaped)})\s*$")
+
+    # Also try to find headings that contain product names (more flexible)
+    partial_headings_re = re.compile(rf"(?mi)^.*(?:{'|'.join(escaped)}).*$")
+
+    matches = list(headings_re.finditer(text))
+
+    # If no exact matches, try partial matches
+    if not matches:
+        partial_matches = list(partial_headings_re.finditer(text))
+        if partial_matches:
+            logger.info(f"No exact product headings; using {len(partial_matches)} partial matches")
+            matches = partial_matches
+
+    if not matches:
+        # The start of the document helps diagnose headings that don't match the catalog.
+        logger.warning(
+            f"Could not find product headings (case-insensitive: {list(products)}); if the doc uses other "
+            f"product names, add them to the catalog (app/rag/catalog.json). Document starts with: {text[:1000]!r}"
+        )
+        return parts
+
+    logger.info(f"Found {len(matches)} product headings in document")
+
+    for i, m in enumerate(matches):
+        start = m.end()
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        heading = m.group(0).strip()
+
+        # Normalize heading to match one of our product names (case-insensitive)
+        # Try exact match first, then partial match
+        normalized_heading = None
+        for product in products:
+            if heading.lower() == product.lower():
+                normalized_heading = product
+                break
+
+        # If no exact match, try partial match
+        if not normalized_heading:
+            for product in products:
+                if product.lower() in heading.lower() or heading.lower() in product.lower():
+                    normalized_heading = product
+                    break
+
+        if not normalized_heading:
+            normalized_heading = heading  # Use as-is if no match
+
+        section = text[start:end].strip()
+        if section:
+            parts[normalized_heading] = section
+
+    return parts
+
+
+_MD_LINK_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+_MD_MARKUP_RE = re.compile(r"(?m)^\s{0,3}(?:#{1,6}\s+|>\s?|[-*+]\s+(?=\S))|[*_`]{1,3}")
+
+
+def parse_markdown(path: str, text: str) -> GDoc:
+    """Markdown as plain text lines (headings stay on their own line for the product split)."""
+    title_match = re.search(r"(?m)^#\s+(.+)$", text)
+    title = title_match.group(1).strip() if title_match else os.path.splitext(os.path.basename(path))[0]
+    text = re.sub(r"(?ms)^```.*?^```\s*$", "", text)
+    text = _MD_MARKUP_RE.sub("", _MD_LINK_RE.sub(r"\1", text))
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    return GDoc(url=path, title=title, text=text)
+
+
+def parse_document(
+    uri: str, body: str, *, products: list[str], split: bool, default_product: str | None
+) -> list[tuple[str, GDoc]]:
+    """
+    (product, section) pairs for one fetched document. Runs in a worker process.
+    split=True: one master doc holding every product under its own heading.
+    Otherwise the whole doc belongs to default_product (or its title).
+    """
+    lowered = uri.lower()
+    if lowered.endswith((".md", ".markdown")):
+        doc = parse_markdown(uri, body)
+    elif lowered.endswith(".txt"):
+        doc = GDoc(url=uri, title=os.path.splitext(os.path.basename(uri))[0], text=body.strip())
+    else:
+        doc = parse_html(uri, body)
+    if split:
+        sections = split_doc_by_products(doc.text, products)
+        if sections:
+            return [(product, GDoc(url=doc.url, title=doc.title, text=text)) for product, text in sections.items()]
+        logger.warning(f"Ingesting {uri} as a single source (not split by products)")
+        return [(doc.title, doc)]
+    return [(default_product or doc.title, doc)]
+
+
+def _product_for(source: Source, index: int, products: list[str]) -> str | None:
+    # Local files are matched by name (e.g. docs/kurkure.md); URLs keep the documented order mapping.
+    if source.local:
+        stem = slug(os.path.splitext(os.path.basename(source.uri))[0])
+        for product in products:
+            if slug(product) == stem:
+                return product
+        return None
+    return products[index] if index < len(products) else None
+
+
+class Checkpoint:
+    """Append-only record of chunks already written to a snapshot: one {"id", "sha"} JSON line per chunk."""
+
+    def __init__(self, snapshot_dir: str) -> None:
+        self.path = os.path.join(snapshot_dir, CHECKPOINT_FILE)
+        self.done: dict[str, str] = {}
+        open(self.path, "a", encoding="utf-8").close()  # marks the snapshot as unfinished until removed
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn last line after a crash
+                    self.done[entry["id"]] = entry["sha"]
+
+    @staticmethod
+    def sha(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def has(self, chunk_id: str, text: str) -> bool:
+        return self.done.get(chunk_id) == self.sha(text)
+
+    def add(self, ids: list[str], texts: list[str]) -> None:
+        lines = []
+        for chunk_id, text in zip(ids, texts):
+            self.done[chunk_id] = self.sha(text)
+            lines.append(json.dumps({"id": chunk_id, "sha": self.done[chunk_id]}) + "\n")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _Stages:
+    """Threads connected by bounded queues; the first error stops every stage and is re-raised."""
+
+    def __init__(self) -> None:
+        self.stop = threading.Event()
+        self.error: BaseException | None = None
+        self.threads: list[threading.Thread] = []
+
+    def put(self, q: queue.Queue, item: Any) -> None:
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, q: queue.Queue) -> Any:
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def start(self, name: str, fn: Callable[[], None]) -> threading.Thread:
+        def run() -> None:
+            try:
+                fn()
+            except BaseException as e:
+                if self.error is None:
+                    self.error = e
+                self.stop.set()
+
+        t = threading.Thread(target=run, name=f"ingest-{name}", daemon=True)
+        t.start()
+        self.threads.append(t)
+        return t
+
+
+def run_ingest(
+    *,
+    sources: list[Source],
+    products: list[str],
+    snapshot_dir: str,
+    openai_api_key: str,
+    embed_model: str,
+    embed_dimensions: int | None = None,
+    batch_size: int = 64,
+    parse_workers: int = 2,
+    embed_workers: int = 2,
+    progress: Callable[[IngestStats], None] | None = None,
+) -> IngestStats:
+    """
+    Ingest sources into the Chroma collection in snapshot_dir (see the pipeline notes above).
+    A single source is a master doc split by product headings; with several, each is one product.
+    progress(stats) is called after every written batch.
+    """
+    stats = IngestStats(sources=len(sources))
+    checkpoint = Checkpoint(snapshot_dir)
+    stages = _Stages()
+    raw_q: queue.Queue = queue.Queue(_QUEUE_SIZE)
+    section_q: queue.Queue = queue.Queue(_QUEUE_SIZE)
+    batch_q: queue.Queue = queue.Queue(_QUEUE_SIZE)
+    embedded_q: queue.Queue = queue.Queue(_QUEUE_SIZE)
+    split = len(sources) == 1
+
+    def fetch() -> None:
+        for index, source in enumerate(sources):
+            if stages.stop.is_set():
+                return
+            if source.local:
+                with open(source.uri, encoding="utf-8") as f:
+                    body = f.read()
+            else:
+                body = fetch_html(source.uri)
+            stages.put(raw_q, (source, body, _product_for(source, index, products)))
+        stages.put(raw_q, _DONE)
+
+    def parse() -> None:
+        # spawn: forking a process that is running other threads can copy held locks into the child.
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max(1, parse_workers), mp_context=mp_context) as pool:
+            pending: set = set()
+
+            def emit(done: Iterable) -> None:
+                for f in done:
+                    stats.docs_parsed += 1
+                    stages.put(section_q, f.result())
+
+            while True:
+                item = stages.get(raw_q)
+                if item is _DONE:
+                    break
+                source, body, default_product = item
+                pending.add(
+                    pool.submit(
+                        parse_document,
+                        source.uri,
+                        body,
+                        products=products,
+                        split=split,
+                        default_product=default_product,
+                    )
+                )
+                del body, item
+                if len(pending) >= 2 * max(1, parse_workers):
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    emit(done)
+            emit(wait(pending).done)
+        stages.put(section_q, _DONE)
+
+    def chunk() -> None:
+        ids: list[str] = []
+        texts: list[str] = []
+        metas: list[dict] = []
+        while True:
+            sections = stages.get(section_q)
+            if sections is _DONE:
+                break
+            for product, doc in sections:
+                stats.sections += 1
+                for c_idx, text in enumerate(chunk_text(doc.text)):
+                    stats.chunks += 1
+                    cid = f"{slug(product)}-{c_idx}"
+                    if checkpoint.has(cid, text):
+                        stats.chunks_skipped += 1
+                        continue
+                    ids.append(cid)
+                    texts.append(text)
+                    metas.append({"url": doc.url, "title": doc.title, "product": product})
+                    if len(ids) >= batch_size:
+                        stages.put(batch_q, (ids, texts, metas))
+                        ids, texts, metas = [], [], []
+        if ids:
+            stages.put(batch_q, (ids, texts, metas))
+        stages.put(batch_q, _DONE)
+
+    def embed() -> None:
+        while True:
+            batch = stages.get(batch_q)
+            if batch is _DONE:
+                stages.put(batch_q, _DONE)  # let sibling embed threads finish too
+                return
+            ids, texts, metas = batch
+            embeddings = embed_documents(
+                openai_api_key=openai_api_key,
+                embed_model=embed_model,
+                embed_dimensions=embed_dimensions,
+                texts=texts,
+            )
+            stages.put(embedded_q, (ids, texts, metas, embeddings))
+
+    def embed_all() -> None:
+        workers = [stages.start(f"embed-{n}", embed) for n in range(max(1, embed_workers))]
+        for t in workers:
+            t.join()
+        stages.put(embedded_q, _DONE)
+
+    stages.start("fetch", fetch)
+    stages.start("parse", parse)
+    stages.start("chunk", chunk)
+    stages.start("embed", embed_all)
+
+    # Write stage, on this thread: the collection has one writer and the checkpoint follows the data.
+    try:
+        while True:
+            batch = stages.get(embedded_q)
+            if batch is _DONE:
+                break
+            ids, texts, metas, embeddings = batch
+            upsert_documents(
+                persist_dir=snapshot_dir,
+                openai_api_key=openai_api_key,
+                embed_model=embed_model,
+                embed_dimensions=embed_dimensions,
+                ids=ids,
+                texts=texts,
+                metadatas=metas,
+                embeddings=embeddings,
+            )
+            checkpoint.add(ids, texts)
+            stats.chunks_written += len(ids)
+            stats.batches += 1
+            if progress:
+                progress(stats)
+    except BaseException:
+        stages.stop.set()
+        raise
+    finally:
+        for t in stages.threads:
+            t.join(timeout=5)
+    if stages.error is not None:
+        raise stages.error
+    return stats
+
+
+def print_progress(stats: IngestStats) -> None:
+    print(f"\r{stats.line()}", end="", file=sys.stderr, flush=True)
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import collections
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, TypeVar
+
+from .. import metrics
+
+# Guard around upstream LLM calls: a deadline per call, an optional hedged second attempt when the
+# first is slower than the recent p95, and a circuit breaker that stops calling a failing provider
+# for a while. Callers catch LLMUnavailable and degrade (retrieval-only answer) instead of failing.
+
+T = TypeVar("T")
+
+# Hedging needs this many recent latencies before p95 is trusted.
+_HEDGE_MIN_SAMPLES = 20
+_LATENCY_WINDOW = 200
+
+
+class LLMUnavailable(Exception):
+    """Circuit open, deadline exceeded or the provider returned an error."""
+
+
+@dataclass(frozen=True)
+class LLMOptions:
+    timeout_s: float = 15.0
+    hedge: bool = False
+    hedge_min_s: float = 1.0  # never hedge earlier than this, whatever p95 says
+    breaker_failures: int = 5  # consecutive failures that open the circuit
+    breaker_reset_s: float = 30.0  # open circuit lets one probe call through after this
+
+
+_options = LLMOptions()
+
+
+def configure(options: LLMOptions) -> None:
+    global _options
+    _options = options
+
+
+def current_options() -> LLMOptions:
+    return _options
+
+
+class CircuitBreaker:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < _options.breaker_reset_s
+
+    def allow(self) -> bool:
+        """Closed: yes. Open: no, until breaker_reset_s has passed - then one probe call (half-open)."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < _options.breaker_reset_s:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= _options.breaker_failures:
+                if self._opened_at is None:
+                    metrics.incr("llm.breaker.opened")
+                self._opened_at = time.monotonic()
+
+
+class GuardedCall:
+    """One guard per kind of call (e.g. the final completion); keeps its own latencies and breaker."""
+
+    _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self._latencies: collections.deque[float] = collections.deque(maxlen=_LATENCY_WINDOW)
+
+    def _hedge_after(self) -> float | None:
+        if not _options.hedge or len(self._latencies) < _HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        after = max(_options.hedge_min_s, ordered[int(len(ordered) * 0.95) - 1])
+        return after if after < _options.timeout_s else None
+
+    def _hedged(self, fn: Callable[[float], T], hedge_after: float) -> T:
+        deadline = time.monotonic() + _options.timeout_s
+        pending = {self._executor.submit(fn, _options.timeout_s)}
+        done, _ = wait(pending, timeout=hedge_after)
+        if not done:
+            metrics.incr(f"llm.{self.name}.hedged")
+            pending.add(self._executor.submit(fn, max(0.1, deadline - time.monotonic())))
+        error: BaseException | None = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    return f.result()
+                error = f.exception()
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"{self.name}: no response within {_options.timeout_s:.1f}s")
+
+    def call(self, fn: Callable[[float], T]) -> T:
+        """
+        fn(timeout_s) makes the upstream request and must pass timeout_s on to the client (without
+        client-side retries) so the deadline holds. Raises LLMUnavailable when it can't get an answer.
+        """
+        if not self.breaker.allow():
+            metrics.incr(f"llm.{self.name}.short_circuited")
+            raise LLMUnavailable(f"{self.name}: circuit open")
+        t0 = time.perf_counter()
+        try:
+            hedge_after = self._hedge_after()
+            result = fn(_options.timeout_s) if hedge_after is None else self._hedged(fn, hedge_after)
+        except Exception as e:
+            self.breaker.record(False)
+            metrics.incr(f"llm.{self.name}.failed")
+            raise LLMUnavailable(f"{self.name}: {type(e).__name__}: {e}") from e
+        elapsed = time.perf_counter() - t0
+        self.breaker.record(True)
+        self._latencies.append(elapsed)
+        metrics.observe(f"llm.{self.name}.latency_s", elapsed)
+        return result
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+from . import snapshots
+from .catalog import get_catalog
+from .rerank import CARD_FIELDS, FIELD_KEYWORDS, wanted_fields
+from .spelling import COMMON_WORDS, FIELD_EXPANSIONS
+
+logger = logging.getLogger(__name__)
+
+# Query embeddings computed at ingest for every product x doc-field template ("Lays Ingredients",
+# "Lays Stock Availability In Stock Price Range INR pack sizes Available Pack Sizes", ...) and stored
+# next to the index in each snapshot. Most search queries are one of those shapes once the filler
+# words are dropped ("do you have lays?", "Kurkure ingredients please"), so template_text() maps a
+# search query to its template and the query path uses the stored vector instead of calling the
+# embeddings API. Anything else (extra words, pack sizes, two products) is embedded as before.
+TEMPLATES_FILENAME = "query-templates.npz"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _template(product: str, fields: tuple[str, ...]) -> str:
+    return " ".join([product, *(FIELD_EXPANSIONS[f] for f in fields)])
+
+
+def all_templates(products: list[str]) -> list[str]:
+    """Template texts precomputed at ingest: per product, the card fields together and each field alone."""
+    shapes = [CARD_FIELDS, *((f,) for f in FIELD_KEYWORDS)]
+    return [_template(p, fields) for p in products for fields in shapes]
+
+
+# Words that don't change which template a query is: filler, stopwords and the field words themselves.
+_NEUTRAL_WORDS = (
+    COMMON_WORDS
+    | {w for words in FIELD_KEYWORDS.values() for k in words for w in _TOKEN_RE.findall(k)}
+    | {w for label in FIELD_KEYWORDS for w in _TOKEN_RE.findall(label)}
+    | {w for text in FIELD_EXPANSIONS.values() for w in _TOKEN_RE.findall(text.lower())}
+    | set("a am an at be do for has hows i in is it me my of on or our pls plz s the to u us we whats".split())
+)
+
+
+def template_text(query: str) -> str | None:
+    """
+    The template query is an instance of: exactly one product, field words and filler only
+    ("do you have Lay's?" -> the Lays card template). None when anything else is in it.
+    """
+    spans = get_catalog().find_spans(query)
+    if not spans or any(p.name != spans[0][0].name for p, _, _ in spans):
+        return None
+    rest, pos = [], 0
+    for _, start, end in spans:
+        rest.append(query[pos:start])
+        pos = end
+    rest.append(query[pos:])
+    rest_text = " ".join(rest).lower()
+    if any(t not in _NEUTRAL_WORDS for t in _TOKEN_RE.findall(rest_text.replace("'", ""))):
+        return None
+    return _template(spans[0][0].name, wanted_fields(rest_text))
+
+
+class TemplateTable:
+    def __init__(self, texts: list[str], vectors: np.ndarray, *, embed_model: str, embed_dimensions: int | None) -> None:
+        self.embed_model = embed_model
+        self.embed_dimensions = embed_dimensions
+        self.rows = {t: i for i, t in enumerate(texts)}
+        self.vectors = vectors
+
+    def get(self, text: str) -> list[float] | None:
+        i = self.rows.get(text)
+        return None if i is None else self.vectors[i].tolist()
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                texts=np.array(list(self.rows), dtype=str),
+                vectors=self.vectors.astype(np.float32),
+                embed_model=np.array(self.embed_model),
+                embed_dimensions=np.array(self.embed_dimensions or 0),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> TemplateTable:
+        with np.load(path) as data:
+            return cls(
+                [str(t) for t in data["texts"]],
+                np.asarray(data["vectors"], dtype=np.float32),
+                embed_model=str(data["embed_model"]),
+                embed_dimensions=int(data["embed_dimensions"]) or None,
+            )
+
+
+def build_templates(
+    *,
+    snapshot_dir: str,
+    products: list[str],
+    embed,
+    embed_model: str,
+    embed_dimensions: int | None,
+    batch_size: int = 256,
+) -> int:
+    """Embed every template (embed: list of texts -> list of vectors) and write the table into snapshot_dir."""
+    texts = all_templates(products)
+    vectors: list[list[float]] = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(embed(texts[i : i + batch_size]))
+    table = TemplateTable(
+        texts, np.asarray(vectors, dtype=np.float32), embed_model=embed_model, embed_dimensions=embed_dimensions
+    )
+    table.save(os.path.join(snapshot_dir, TEMPLATES_FILENAME))
+    return len(texts)
+
+
+_tables: dict[str, TemplateTable | None] = {}
+_tables_lock = threading.Lock()
+
+
+def get_table(persist_dir: str) -> TemplateTable | None:
+    """Template table of the active snapshot of persist_dir (None if its ingest didn't write one)."""
+    key = snapshots.active_dir(persist_dir)
+    if key in _tables:
+        return _tables[key]
+    with _tables_lock:
+        if key not in _tables:
+            path = os.path.join(key, TEMPLATES_FILENAME)
+            table = None
+            if os.path.exists(path):
+                try:
+                    table = TemplateTable.load(path)
+                except Exception as e:
+                    logger.warning(f"Query templates {path} unreadable, embedding every query: {e}")
+            _tables[key] = table
+        return _tables[key]
+
+
+def lookup(persist_dir: str, query: str, *, embed_model: str, embed_dimensions: int | None) -> list[float] | None:
+    """Stored embedding for query's template, if there is one for this embedding model."""
+    table = get_table(persist_dir)
+    if table is None or table.embed_model != embed_model or table.embed_dimensions != embed_dimensions:
+        return None
+    text = template_text(query)
+    return table.get(text) if text else None
+
+
+def _drop_table(old_dir: str, new_dir: str) -> None:
+    with _tables_lock:
+        _tables.pop(old_dir, None)
+
+
+snapshots.on_load(get_table)
+snapshots.on_swap(_drop_table)
@@ -1,15 +1,52 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import re
+import threading
 import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
-from openai import OpenAI
+from typing import TYPE_CHECKING
+
+from .. import logs, metrics
+from ..singleflight import SingleFlight
+from .catalog import get_catalog
+from .facts import (
+    PRODUCT_ANSWER_SCHEMA,
+    extract_product_facts,
+    parse_structured_answer,
+    remember_product_facts,
+    remembered_product_facts,
+    render_product_card,
+    render_structured_answer,
+)
+from .history import compact_history, estimate_tokens
+from .llm import GuardedCall, LLMUnavailable, current_options as llm_options
+from .rerank import rerank
+from .spelling import get_speller
+from .vectorstore import embed_queries, get_openai_client, query as vs_query, search_batch
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
-from .vectorstore import query as vs_query
+    from .chunkstore import ChunkHits
+    from .vectorstore import ChromaHits
 
 logger = logging.getLogger(__name__)
 
+# Chunks with a larger cosine distance (1 - cosine similarity; hits report that scale whatever the
+# index's space) are dropped from the context. Very lenient - only reject completely unrelated.
+# 0.49 is the 0.98 squared-L2 cutoff of the original L2 index (squared L2 = 2 x cosine distance).
+SIMILARITY_THRESHOLD = 0.49
+
+# Product-filtered retrieval: a product has only a few chunks, so a small k covers it. The filtered
+# hits are trusted only if at least FILTERED_MIN_HITS of them pass SIMILARITY_THRESHOLD.
+FILTERED_RETRIEVAL_K = 4
+FILTERED_MIN_HITS = 1
+
 
 @dataclass(frozen=True)
 class RagResult:
@@ -20,73 +57,21 @@ class RagResult:
     product: str | None = None
 
 
-# Product names for query rewriting context
-KNOWN_PRODUCTS = [
-    "Lays",
-    "Kurkure",
-    "Cadbury Dairy Milk Silk",
-    "Maggi",
-    "Nescafe Classic",
-    "Parle G",
-    "KitKat",
-    "Good Day",
-    "Yippee Noodles",
-    "Knorr Soupy Noodles",
-    "Marie Gold",
-    "Bru",
-    "Davidoff Coffee",
-    "Uncle Chips",
-    "Balaji Wafers",
-]
-
 # In-memory cache for rewritten queries to avoid repeat LLM calls. Key = (question_lower, context_key), max 150.
 _rewrite_cache: dict[tuple[str, str], str] = {}
 _rewrite_cache_max = 150
 
+# Concurrent identical rewrites / completions (e.g. everyone asking about the same promotion) share one call.
+_rewrite_flight = SingleFlight("query_rewrite")
+_completion_flight = SingleFlight("completion")
+_completion_guard = GuardedCall("completion")
+
 # Doc vocabulary: if the query already contains these (case-insensitive), we can skip LLM rewrite for speed
 _DOC_TERMS = (
     "pack size", "price", "cost", "availability", "in stock", "ingredients",
     "nutritional", "allergen", "shelf", "storage", "price range", "stock availability",
 )
 
-# Product name aliases for flexible matching (shortened/case-insensitive names users might use)
-PRODUCT_ALIASES = {
-    "lays": "Lays",
-    "lay's": "Lays",
-    "lay's potato chips": "Lays",
-    "lays potato chips": "Lays",
-    "kurkure": "Kurkure",
-    "maggi": "Maggi",
-    "parle g": "Parle G",
-    "parle-g": "Parle G",
-    "dairy milk": "Cadbury Dairy Milk Silk",
-    "cadbury": "Cadbury Dairy Milk Silk",
-    "cadbury silk": "Cadbury Dairy Milk Silk",
-    "cadbury dairy milk silk": "Cadbury Dairy Milk Silk",
-    "nescafe": "Nescafe Classic",
-    "nescafe classic": "Nescafe Classic",
-    "classic": "Nescafe Classic",
-    "maggi noodles": "Maggi",
-    "kitkat": "KitKat",
-    "kit kat": "KitKat",
-    "good day": "Good Day",
-    "goodday": "Good Day",
-    "yippee": "Yippee Noodles",
-    "yippee noodles": "Yippee Noodles",
-    "knorr": "Knorr Soupy Noodles",
-    "knorr soupy noodles": "Knorr Soupy Noodles",
-    "soupy noodles": "Knorr Soupy Noodles",
-    "marie gold": "Marie Gold",
-    "marie": "Marie Gold",
-    "bru": "Bru",
-    "davidoff": "Davidoff Coffee",
-    "davidoff coffee": "Davidoff Coffee",
-    "uncle chips": "Uncle Chips",
-    "uncle": "Uncle Chips",
-    "balaji": "Balaji Wafers",
-    "balaji wafers": "Balaji Wafers",
-}
-
 
 def _normalize_product_names_in_query(query: str) -> str:
     """
@@ -95,20 +80,14 @@ def _normalize_product_names_in_query(query: str) -> str:
     """
     if not query or not query.strip():
         return query
-    text = query
-    # Build (pattern, canonical) sorted by length descending so longer aliases match first
-    replacements: list[tuple[str, str]] = []
-    for alias, canonical in PRODUCT_ALIASES.items():
-        replacements.append((alias, canonical))
-    for product in KNOWN_PRODUCTS:
-        if product.lower() not in {a for a, _ in replacements}:
-            replacements.append((product.lower(), product))
-    replacements.sort(key=lambda x: -len(x[0]))
-    for alias, canonical in replacements:
-        # Word-boundary replacement, case-insensitive
-        pattern = r"\b" + re.escape(alias) + r"\b"
-        text = re.sub(pattern, canonical, text, flags=re.IGNORECASE)
-    return text
+    parts: list[str] = []
+    pos = 0
+    for product, start, end in get_catalog().find_spans(query):
+        parts.append(query[pos:start])
+        parts.append(product.name)
+        pos = end
+    parts.append(query[pos:])
+    return "".join(parts)
 
 
 def _query_needs_rewrite(question: str) -> bool:
@@ -117,153 +96,60 @@ def _query_needs_rewrite(question: str) -> bool:
     if any(term in q for term in _DOC_TERMS):
         return False
     words = q.split()
-    if len(words) <= 2 and any(p.lower() in q for p in KNOWN_PRODUCTS):
+    if len(words) <= 2 and get_catalog().mentions(q):
         return False  # e.g. "Kurkure" or "Kurkure price"
     return True
 
 
+def _expanded_search_query(question: str) -> str:
+    """
+    Search query used when the LLM rewrite is skipped: canonical product names, plus a lightweight
+    expansion (e.g. "Kurkure" or "Kurkure price") so retrieval still gets availability/price.
+    """
+    search_query = _normalize_product_names_in_query(question)
+    if not any(term in question.lower() for term in _DOC_TERMS):
+        search_query = f"{search_query} Stock Availability Price Range INR pack sizes".strip()
+    return search_query
+
+
+def warmup_search_queries(questions: list[str]) -> list[str]:
+    """Search queries for the given top questions that can be built without an LLM rewrite (used to prime caches)."""
+    return [_expanded_search_query(q) for q in questions if q.strip() and not _query_needs_rewrite(q)]
+
+
 def _normalize_product_name(text: str) -> str | None:
     """
     Try to match a product name from text (handles partial/alias names).
     Returns the full product name if found, None otherwise.
     """
-    text_lower = text.lower().strip()
-    # Normalize apostrophes so "lay's" matches "lays"
-    text_normalized = text_lower.replace("'", "")
-
-    # Check exact match first
-    for product in KNOWN_PRODUCTS:
-        if product.lower() in text_lower or text_lower in product.lower():
-            return product
-        if product.lower() in text_normalized or text_normalized in product.lower():
-            return product
-
-    # Check aliases (also try normalized text for "lay's" -> "lays")
-    for alias, product in PRODUCT_ALIASES.items():
-        if alias in text_lower:
-            return product
-        if alias.replace("'", "") in text_normalized:
-            return product
+    product = get_catalog().find(text)
+    return product.name if product else None
 
+
+def _mentioned_products(text: str) -> list[str]:
+    """Canonical products named in text (whole-word alias match), in order of first mention."""
+    return [p.name for p in get_catalog().mentions(text)]
+
+
+def detect_single_product(question: str, history: list[dict[str, str]] | None) -> str | None:
+    """
+    Return the one product the user is asking about, or None when it's unclear.
+    The question wins; otherwise the most recent history message that names products is used.
+    Two or more products (comparisons, catalog lists) means no single product.
+    """
+    in_question = _mentioned_products(question)
+    if in_question:
+        return in_question[0] if len(in_question) == 1 else None
+    for h in reversed((history or [])[-4:]):
+        mentioned = _mentioned_products(h.get("content", ""))
+        if mentioned:
+            return mentioned[0] if len(mentioned) == 1 else None
     return None
 
 
 # When user confirms purchase: short answer + intent for frontend pack picker.
 PURCHASE_PROMPT_ANSWER = "Please choose a pack:"
 
-# Map canonical product name -> slug + pack links.
-# Slug must match frontend PRODUCT_CONFIG keys; ids must match product-detail route slugs.
-PURCHASE_PRODUCT_CONFIG: dict[str, dict] = {
-    "Parle G": {
-        "slug": "parle-g",
-        "packs": [
-            ("56g", "parle-g-56g"),
-            ("200g", "parle-g-200g"),
-            ("800g", "parle-g-800g"),
-        ],
-    },
-    "Kurkure": {
-        "slug": "kurkure",
-        "packs": [
-            ("30g", "kurkure-30g"),
-            ("55g", "kurkure-55g"),
-            ("90g", "kurkure-90g"),
-            ("115g", "kurkure-115g"),
-        ],
-    },
-    "Lays": {
-        "slug": "lays",
-        "packs": [
-            ("30g", "lays-30g"),
-            ("52g", "lays-52g"),
-            ("90g", "lays-90g"),
-        ],
-    },
-    "Maggi": {
-        "slug": "maggi",
-        "packs": [
-            ("70g", "maggi-70g"),
-            ("140g", "maggi-140g"),
-        ],
-    },
-    "Nescafe Classic": {
-        "slug": "nescafe-classic",
-        "packs": [
-            ("50g", "nescafe-classic-50g"),
-            ("100g", "nescafe-classic-100g"),
-        ],
-    },
-    "KitKat": {
-        "slug": "kitkat",
-        "packs": [
-            ("20g", "kitkat-20g"),
-            ("45g", "kitkat-45g"),
-            ("80g", "kitkat-80g"),
-        ],
-    },
-    "Good Day": {
-        "slug": "good-day",
-        "packs": [
-            ("75g", "good-day-75g"),
-            ("150g", "good-day-150g"),
-            ("300g", "good-day-300g"),
-        ],
-    },
-    "Yippee Noodles": {
-        "slug": "yippee-noodles",
-        "packs": [
-            ("70g", "yippee-noodles-70g"),
-            ("140g", "yippee-noodles-140g"),
-        ],
-    },
-    "Knorr Soupy Noodles": {
-        "slug": "knorr-soupy-noodles",
-        "packs": [
-            ("70g", "knorr-soupy-noodles-70g"),
-            ("140g", "knorr-soupy-noodles-140g"),
-        ],
-    },
-    "Marie Gold": {
-        "slug": "marie-gold",
-        "packs": [
-            ("75g", "marie-gold-75g"),
-            ("150g", "marie-gold-150g"),
-            ("300g", "marie-gold-300g"),
-        ],
-    },
-    "Bru": {
-        "slug": "bru",
-        "packs": [
-            ("50g", "bru-50g"),
-            ("100g", "bru-100g"),
-            ("200g", "bru-200g"),
-        ],
-    },
-    "Davidoff Coffee": {
-        "slug": "davidoff-coffee",
-        "packs": [
-            ("50g", "davidoff-coffee-50g"),
-            ("100g", "davidoff-coffee-100g"),
-        ],
-    },
-    "Uncle Chips": {
-        "slug": "uncle-chips",
-        "packs": [
-            ("28g", "uncle-chips-28g"),
-            ("52g", "uncle-chips-52g"),
-            ("90g", "uncle-chips-90g"),
-        ],
-    },
-    "Balaji Wafers": {
-        "slug": "balaji-wafers",
-        "packs": [
-            ("28g", "balaji-wafers-28g"),
-            ("52g", "balaji-wafers-52g"),
-            ("90g", "balaji-wafers-90g"),
-        ],
-    },
-}
-
 
 def _try_handle_yes_to_buy(question: str, history: list[dict[str, str]] | None) -> RagResult | None:
     """
@@ -298,28 +184,30 @@ def _try_handle_yes_to_buy(question: str, history: list[dict[str, str]] | None)
     if not product:
         return None
 
-    # Find purchase config using a case-insensitive, fuzzy match so slight wording
-    # differences like "Lays potato chips" still map to "Lays".
-    config = None
-    config_slug = None
-    product_lower = product.lower()
-    for name, cfg in PURCHASE_PRODUCT_CONFIG.items():
-        name_lower = name.lower()
-        if name_lower == product_lower or name_lower in product_lower or product_lower in name_lower:
-            config = cfg
-            config_slug = cfg.get("slug")
-            break
-
-    if not config:
+    # Packs come from the catalog; the slug must match frontend PRODUCT_CONFIG keys.
+    entry = get_catalog().lookup(product)
+    if not entry or not entry.packs:
         # Product mentioned but we don't have purchase flows configured for it yet.
         answer = "Purchase options for this product are currently unavailable."
         lines = tuple(s.strip() or "\u00A0" for s in answer.split("\n"))
         return RagResult(answer=answer, sources=[], answer_lines=lines, intent=None, product=None)
 
+    # Facts from an earlier structured answer (ANSWER_FORMAT=json): don't offer an out-of-stock product,
+    # and offer only the packs the docs list.
+    packs = [(pack.label, pack.id) for pack in entry.packs]
+    facts = remembered_product_facts(product)
+    if facts:
+        metrics.incr("purchase.facts_reused")
+        if facts["availability"] == "Out of Stock":
+            answer = f"Sorry, {product} is currently out of stock."
+            return RagResult(answer=answer, sources=[], answer_lines=(answer,), intent=None, product=None)
+        listed = [(label, pack_id) for label, pack_id in packs if label in facts["pack_sizes"]]
+        packs = listed or packs
+
     # Build markdown links for all configured packs so frontend can render both links and pack picker.
     link_lines = [
         f"[{label}](/products/{pack_id})"
-        for (label, pack_id) in config.get("packs", [])
+        for (label, pack_id) in packs
     ]
     links_block = "\n".join(link_lines)
     answer = PURCHASE_PROMPT_ANSWER + ("\n\n" + links_block if links_block else "")
@@ -329,7 +217,7 @@ def _try_handle_yes_to_buy(question: str, history: list[dict[str, str]] | None)
         sources=[],
         answer_lines=lines,
         intent="SHOW_PACK_PICKER",
-        product=config_slug,
+        product=entry.slug,
     )
 
 
@@ -368,17 +256,14 @@ def rewrite_query_for_rag(
     """
     recent_product = ""
     if history:
-        recent_text = " ".join([h.get("content", "") for h in history[-6:]])
-        for product in KNOWN_PRODUCTS:
-            if product.lower() in recent_text.lower():
-                recent_product = product
-                break
+        mentioned = _mentioned_products(" ".join([h.get("content", "") for h in history[-6:]]))
+        recent_product = mentioned[0] if mentioned else ""
 
     cache_key = (question.strip().lower(), recent_product)
     if cache_key in _rewrite_cache:
         return _rewrite_cache[cache_key]
     if len(_rewrite_cache) >= _rewrite_cache_max:
-        _rewrite_cache.pop(next(iter(_rewrite_cache)))
+        _rewrite_cache.pop(next(iter(_rewrite_cache)), None)  # threads may evict concurrently
 
     product_context = f" Conversation context: user was recently asking about: {recent_product}." if recent_product else ""
 
@@ -397,7 +282,7 @@ def rewrite_query_for_rag(
         "- Brand / category -> include: Brand Category\n\n"
         "Rules:\n"
         "- Fix typos (e.g. paxcakge->package, dise->size, avaliable->available, ingrediants->ingredients).\n"
-        f"- Use ONLY these product names if a product is mentioned: {', '.join(KNOWN_PRODUCTS)}.\n"
+        f"- Use ONLY these product names if a product is mentioned: {', '.join(get_catalog().names)}.\n"
         f"{product_context}\n"
         "- If the question is vague (e.g. 'its price', 'what about it'), include the product name from context.\n"
         "- Output ONLY the rewritten search query, no explanation. Short and keyword-rich is best.\n\n"
@@ -405,8 +290,12 @@ def rewrite_query_for_rag(
         "Rewritten query:"
     )
 
-    try:
-        resp = client.chat.completions.create(
+    if _completion_guard.breaker.is_open():
+        # Provider is failing; don't spend a request timeout on the rewrite too.
+        return question
+
+    def rewrite() -> str:
+        resp = client.with_options(timeout=llm_options().timeout_s, max_retries=0).chat.completions.create(
             model=query_model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.1,
@@ -417,129 +306,281 @@ def rewrite_query_for_rag(
             return question
         _rewrite_cache[cache_key] = rewritten
         return rewritten
+
+    try:
+        return _rewrite_flight.do((query_model, *cache_key), rewrite)
     except Exception:
         return question
 
 
-def answer_question(
+def complete_chat(
     *,
-    openai_api_key: str,
+    client: OpenAI,
+    chat_model: str,
+    messages: list[dict[str, str]],
+    json_schema: dict | None = None,
+) -> str:
+    """
+    Final answer completion. Concurrent requests with identical messages (same question, history
+    and retrieved context) share one upstream call. Deadline/hedging/circuit breaker per llm.py;
+    raises LLMUnavailable when no answer can be had. With json_schema the reply is structured
+    output (a JSON string matching it).
+    """
+    key = hashlib.sha256(
+        json.dumps([chat_model, messages, json_schema], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    extra = {"response_format": {"type": "json_schema", "json_schema": json_schema}} if json_schema else {}
+
+    def complete(timeout_s: float) -> str:
+        resp = client.with_options(timeout=timeout_s, max_retries=0).chat.completions.create(
+            model=chat_model,
+            messages=messages,
+            temperature=0.2,
+            max_completion_tokens=400,  # Cap length for faster response
+            **extra,
+        )
+        return resp.choices[0].message.content or ""
+
+    return _completion_flight.do(key, lambda: _completion_guard.call(complete))
+
+
+def _retrieval_only_answer(product: str | None, hits: ChromaHits | ChunkHits) -> RagResult:
+    """
+    Answer without the LLM (provider down or too slow): the product card built from the retrieved
+    chunks' structured facts, else a short apology with the catalog.
+    """
+    facts = None
+    if product:
+        texts = [
+            hits.text(i)
+            for i in range(len(hits))
+            if hits.distances[i] <= SIMILARITY_THRESHOLD and hits.product(i) == product
+        ]
+        facts = extract_product_facts(product, texts)
+    if facts:
+        answer = render_product_card(facts)
+    else:
+        answer = (
+            "Sorry, I can't give a full answer right now. Please try again in a moment.\n\n"
+            f"Our products: {', '.join(get_catalog().names)}"
+        )
+    return RagResult(
+        answer=answer,
+        sources=[],
+        answer_lines=tuple((line.strip() or "\u00A0") for line in answer.split("\n")),
+        intent="degraded",
+        product=product if facts else None,
+    )
+
+
+def _filtered_hits_are_confident(hits: ChromaHits | ChunkHits) -> bool:
+    return sum(1 for d in hits.distances if d <= SIMILARITY_THRESHOLD) >= FILTERED_MIN_HITS
+
+
+@dataclass
+class _Prepared:
+    """A question after the cheap pre-retrieval steps: the search query and the detected product."""
+
+    question: str
+    history: list[dict[str, str]] | None
+    search_query: str
+    detected_product: str | None
+
+
+# How each question's search query was made: "skipped" (already in doc vocabulary), "local" (spelling.py)
+# or "llm" (rewrite_query_for_rag). query.rewrite.llm_rate is the share that needed the LLM.
+_rewrite_counts = {"skipped": 0, "local": 0, "llm": 0}
+_rewrite_counts_lock = threading.Lock()
+
+
+def _count_rewrite(path: str) -> None:
+    with _rewrite_counts_lock:
+        _rewrite_counts[path] += 1
+        rate = _rewrite_counts["llm"] / sum(_rewrite_counts.values())
+    metrics.incr(f"query.rewrite.{path}")
+    metrics.gauge("query.rewrite.llm_rate", round(rate, 4))
+
+
+def _prepare_question(
+    *,
+    client: OpenAI,
     chat_model: str,
-    embed_model: str,
-    embed_dimensions: int | None = None,
-    persist_dir: str,
     question: str,
-    k: int = 12,  # Fewer chunks = faster LLM; 12 is enough for most queries
-    history: list[dict[str, str]] | None = None,
-    use_query_rewrite: bool = True,
-) -> RagResult:
-    t_rag_start = time.perf_counter()
+    history: list[dict[str, str]] | None,
+    use_query_rewrite: bool,
+    use_product_filter: bool,
+) -> RagResult | _Prepared:
+    """Yes-to-buy short-circuit (returns the RagResult), else query normalization/rewrite and product detection."""
     # Handle "Yes" to buy before RAG: return Parle G links or "unavailable" (no retrieval/LLM)
     yes_result = _try_handle_yes_to_buy(question, history)
     if yes_result is not None:
-        logger.warning("Handled 'Yes to buy' without RAG")
+        logs.diag(logger, "query", "Handled 'Yes to buy' without RAG")
         return yes_result
 
-    client = OpenAI(api_key=openai_api_key)
-
     # Step 1: Normalize product names (lays -> Lays), then optionally LLM rewrite (skip when query has doc terms or is short product-only)
     t0 = time.perf_counter()
     search_query = _normalize_product_names_in_query(question)
+    detect_text = question
     if use_query_rewrite and _query_needs_rewrite(question):
-        rewritten = rewrite_query_for_rag(
-            client=client,
-            query_model=chat_model,
-            question=search_query,
-            history=history,
-        )
-        if rewritten and rewritten.strip():
-            search_query = _normalize_product_names_in_query(rewritten.strip())
-            logger.warning(f"Query rewrite: '{question[:50]}...' -> '{search_query[:70]}...'")
+        # Spelling fixes and field intent locally first; the LLM rewrite only for what that can't resolve.
+        normalized = get_speller().normalize(question)
+        if normalized.resolved:
+            search_query = normalized.search_query()
+            detect_text = normalized.text  # "kurkre" -> "Kurkure" for the product filter too
+            _count_rewrite("local")
+            metrics.incr("query.spelling.corrections", len(normalized.corrections))
+            logs.diag(
+                logger, "query", "Local rewrite: %r -> %r %s", question, search_query, normalized.corrections,
+                rewrite="local", search_query=search_query,
+            )
+        else:
+            _count_rewrite("llm")
+            rewritten = rewrite_query_for_rag(
+                client=client,
+                query_model=chat_model,
+                question=search_query,
+                history=history,
+            )
+            if rewritten and rewritten.strip():
+                search_query = _normalize_product_names_in_query(rewritten.strip())
+                logs.diag(
+                    logger, "query", "Query rewrite: %r -> %r", question, search_query,
+                    rewrite="llm", search_query=search_query,
+                )
     else:
-        # Lightweight expansion when we skip rewrite (e.g. "Kurkure" or "Kurkure price") so retrieval still gets availability/price
-        q_lower = question.lower()
-        if not any(term in q_lower for term in _DOC_TERMS):
-            search_query = f"{search_query} Stock Availability Price Range INR pack sizes".strip()
-            logger.warning(f"Skip rewrite; expanded query: '{search_query[:70]}...'")
+        search_query = _expanded_search_query(question)
+        _count_rewrite("skipped")
+        logs.diag(logger, "query", "Skip rewrite; expanded query: %r", search_query, rewrite="skipped", search_query=search_query)
 
     # If history exists and question is vague, prepend product name so retrieval finds that product's chunks
     if history:
-        recent_text = " ".join([h.get("content", "") for h in history[-4:]])
-        for product in KNOWN_PRODUCTS:
-            if product.lower() in recent_text.lower():
-                vague_words = ["it", "its", "the", "this", "that", "they", "their"]
-                if any(word in question.lower() for word in vague_words):
-                    search_query = f"{product} {search_query}"
-                    logger.warning(f"Added product context for vague question: '{search_query[:60]}...'")
-                break
-    logger.warning(f"TIMING query_expansion: {time.perf_counter() - t0:.3f}s")
-
-    # Step 2: Retrieve from vector store
-    # TEMPORARILY DISABLE product filtering - it might be too strict
-    # Just retrieve all chunks and let similarity do the work
-    detected_product = None
-    # if history:
-    #     recent_text = " ".join([h.get("content", "") for h in history[-6:]])
-    #     detected_product = _normalize_product_name(recent_text)
-    # 
-    # # Also check current question for product name
-    # if not detected_product:
-    #     detected_product = _normalize_product_name(question)
-    
-    # Don't filter by product - get all chunks
-    retrieval_k = k
+        mentioned = _mentioned_products(" ".join([h.get("content", "") for h in history[-4:]]))
+        if mentioned:
+            vague_words = ["it", "its", "the", "this", "that", "they", "their"]
+            if any(word in question.lower() for word in vague_words):
+                search_query = f"{mentioned[0]} {search_query}"
+                logs.diag(logger, "query", "Added product context for vague question: %r", search_query)
+    logs.timing(logger, "query_expansion", t0)
+
+    # Exactly one product named (question first, then recent history) -> product-filtered retrieval.
+    detected_product = detect_single_product(detect_text, history) if use_product_filter else None
+    return _Prepared(question, history, search_query, detected_product)
+
+
+def _retrieve(
+    *,
+    prepared: _Prepared,
+    openai_api_key: str,
+    embed_model: str,
+    embed_dimensions: int | None,
+    persist_dir: str,
+    k: int,
+    index_backend: str,
+) -> tuple[ChromaHits | ChunkHits, str]:
+    """Hits for the prepared query and the retrieval path taken ("filtered", "fallback" or "unfiltered")."""
+    # Step 2: Retrieve from vector store.
+    # When exactly one product is named (question first, then recent history) search only that
+    # product's chunks with a small k; fall back to the full collection if those hits are weak
+    # (e.g. the product's text lives in another product's section of the doc).
+    search_query, detected_product = prepared.search_query, prepared.detected_product
+    retrieval_path = "unfiltered"
 
     t0 = time.perf_counter()
-    hits = vs_query(
-        persist_dir=persist_dir,
-        openai_api_key=openai_api_key,
-        embed_model=embed_model,
-        embed_dimensions=embed_dimensions,
-        q=search_query,
-        k=retrieval_k,
-        product_filter=None,  # NO FILTERING - get all chunks
-    )
-    logger.warning(f"TIMING retrieval: {time.perf_counter() - t0:.3f}s")
+    hits = None
+    if detected_product:
+        hits = vs_query(
+            persist_dir=persist_dir,
+            openai_api_key=openai_api_key,
+            embed_model=embed_model,
+            embed_dimensions=embed_dimensions,
+            q=search_query,
+            k=FILTERED_RETRIEVAL_K,
+            product_filter=detected_product,
+            index_backend=index_backend,
+        )
+        if _filtered_hits_are_confident(hits):
+            retrieval_path = "filtered"
+        else:
+            retrieval_path = "fallback"
+            hits = None
+    if hits is None:
+        # Embedding is cached by vs_query, so the fallback only costs the vector search.
+        hits = vs_query(
+            persist_dir=persist_dir,
+            openai_api_key=openai_api_key,
+            embed_model=embed_model,
+            embed_dimensions=embed_dimensions,
+            q=search_query,
+            k=k,
+            product_filter=None,
+            index_backend=index_backend,
+        )
+    logs.timing(logger, "retrieval", t0)
+    return hits, retrieval_path
 
-    docs = (hits.get("documents") or [[]])[0]
-    metas = (hits.get("metadatas") or [[]])[0]
-    ids = (hits.get("ids") or [[]])[0]
-    distances = (hits.get("distances") or [[]])[0]
-    
-    logger.warning(f"🔍 QUERY DEBUG: '{question}' → rewritten to: '{search_query}'")
-    logger.warning(f"📊 Retrieved {len(docs)} chunks from database (NO product filter)")
+
+def _generate(
+    *,
+    client: OpenAI,
+    chat_model: str,
+    prepared: _Prepared,
+    hits: ChromaHits | ChunkHits,
+    retrieval_path: str,
+    history_keep_last: int,
+    history_token_budget: int,
+    answer_format: str = "text",
+) -> RagResult:
+    """Context from the hits, prompt, completion (or the retrieval-only answer when the LLM is unavailable)."""
+    question, history = prepared.question, prepared.history
+    search_query, detected_product = prepared.search_query, prepared.detected_product
+    distances = hits.distances
+
+    logs.diag(
+        logger, "retrieval", "Retrieved %d chunks for %r (path=%s, product=%s)",
+        len(hits), search_query, retrieval_path, detected_product,
+        chunks=len(hits), path=retrieval_path, product=detected_product,
+    )
 
     # Step 3: Very lenient similarity filtering - accept almost all chunks
     t0 = time.perf_counter()
-    SIMILARITY_THRESHOLD = 0.98  # Very lenient - only reject completely unrelated
 
-    context_blocks: list[str] = []
+    candidates: list[int] = []
     filtered_count = 0
 
-    for i, doc in enumerate(docs):
-        distance = distances[i] if i < len(distances) else 1.0
-        meta = metas[i] if i < len(metas) else {}
-        product_name = meta.get("product", "Unknown")
+    for i in range(len(hits)):
+        distance = float(distances[i]) if i < len(distances) else 1.0
 
-        if i < 3:
-            logger.warning(f"Chunk {i}: distance={distance:.3f}, product={product_name}, preview={doc[:100]}")
+        if i < 3 and logs.enabled("chunks"):
+            logs.diag(
+                logger, "chunks", "Chunk %d: distance=%.3f, product=%s, preview=%s",
+                i, distance, hits.product(i), hits.text(i)[:100],
+            )
 
         if distance > SIMILARITY_THRESHOLD:
             filtered_count += 1
-            logger.debug(f"Filtered out chunk {i} with distance {distance:.3f}")
             continue
 
-        context_blocks.append(f"[{len(context_blocks) + 1}] {doc}")
+        candidates.append(i)
+
+    # Step 3b: Optional rerank - only the best few candidates go into the prompt (see rerank.py)
+    candidates = rerank(search_query, hits, candidates, product=detected_product)
+    context_blocks = [f"[{n}] {hits.text(i)}" for n, i in enumerate(candidates, 1)]
 
     context = "\n\n".join(context_blocks).strip()
-    logger.warning(f"TIMING filter_and_context: {time.perf_counter() - t0:.3f}s")
+    logs.timing(logger, "filter_and_context", t0)
+    metrics.incr(f"retrieval.path.{retrieval_path}")
+    metrics.observe(f"retrieval.context_chunks.{retrieval_path}", len(context_blocks))
+    metrics.observe(f"retrieval.context_chars.{retrieval_path}", len(context))
     if len(context_blocks) == 0:
-        logger.error(f"❌ CRITICAL: No chunks in context! Retrieved {len(docs)} but all filtered out.")
-        logger.error(f"Distances: {distances[:10] if len(distances) > 0 else 'none'}")
-        logger.error(f"Docs preview: {[d[:50] for d in docs[:3]] if docs else 'none'}")
+        logger.error(
+            "No chunks in context: retrieved %d but all filtered out. Distances: %s. Docs preview: %s",
+            len(hits),
+            [round(float(d), 3) for d in distances[:10]] if len(distances) > 0 else "none",
+            [hits.text(i)[:50] for i in range(min(3, len(hits)))] if len(hits) else "none",
+        )
     
     # When no context was retrieved, use a minimal context so we can still answer catalog questions (which products we have, etc.)
-    product_list_str = ", ".join(KNOWN_PRODUCTS)
+    product_list_str = ", ".join(get_catalog().names)
     if not context:
         context = (
             "(No product details were retrieved for this query. "
@@ -577,51 +618,270 @@ def answer_question(
         "[200g](/products/parle-g-200g)\n"
         "[800g](/products/parle-g-800g)\n"
         "- If the product is ANY other product (Lays, Kurkure, Maggi, etc.): Reply with exactly: 'Purchase options for this product are currently unavailable.'\n\n"
-        "OUTPUT FORMAT (strict): Return product replies in this exact structure. Do not combine lines. Each bullet must be on a new line.\n"
-        "Yes, we have {Product Name}.\n\n"
-        "Availability: {In Stock or Out of Stock}\n\n"
-        "Price:\n"
-        "- {Size} – ₹{Price}\n"
-        "(one line per pack/price)\n\n"
-        "Pack sizes:\n"
-        "- {Size}\n"
-        "(one line per size)\n\n"
-        "Would you like to buy this product? (Yes/No)\n"
-        "Use plain text. For Parle G purchase links use the format [text](/products/parle-g-XXg) as shown above."
     )
+    if answer_format == "json":
+        # The server renders the reply from these fields (facts.render_structured_answer).
+        system += (
+            "OUTPUT FORMAT (strict): Return only the JSON object defined by the response schema:\n"
+            "- product: the product the answer is about, null for catalog/general answers\n"
+            "- availability: 'In Stock' or 'Out of Stock' from CONTEXT, else null\n"
+            "- prices: one {size, inr} per pack from 'Price Range (INR)' (e.g. 30g – ₹10 -> {\"size\": \"30g\", \"inr\": 10})\n"
+            "- pack_sizes: from 'Available Pack Sizes'\n"
+            "- message: short plain-text answer for anything the fields above don't cover (catalog lists, ingredients, "
+            "nutrition, missing information, purchase replies), else null. Don't repeat the fields in it.\n"
+            "- follow_up: true for product replies (the purchase question is added for you), else false"
+        )
+    else:
+        system += (
+            "OUTPUT FORMAT (strict): Return product replies in this exact structure. Do not combine lines. Each bullet must be on a new line.\n"
+            "Yes, we have {Product Name}.\n\n"
+            "Availability: {In Stock or Out of Stock}\n\n"
+            "Price:\n"
+            "- {Size} – ₹{Price}\n"
+            "(one line per pack/price)\n\n"
+            "Pack sizes:\n"
+            "- {Size}\n"
+            "(one line per size)\n\n"
+            "Would you like to buy this product? (Yes/No)\n"
+            "Use plain text. For Parle G purchase links use the format [text](/products/parle-g-XXg) as shown above."
+        )
 
-    # Build messages: system + conversation history + current turn (context + question)
+    # Build messages: system + compacted history (recent turns verbatim, older ones condensed) + current turn
     messages: list[dict[str, str]] = [{"role": "system", "content": system}]
 
     if history:
-        for h in history:
-            role = (h.get("role") or "").strip().lower()
-            content = (h.get("content") or "").strip()
-            if role in ("user", "assistant") and content:
-                messages.append({"role": role, "content": content})
+        compacted = compact_history(history, keep_last=history_keep_last, token_budget=history_token_budget)
+        messages.extend(compacted)
+        metrics.observe("prompt.history_messages", len(compacted))
+        metrics.observe("prompt.history_tokens", sum(estimate_tokens(m["content"]) for m in compacted))
 
     current_user = (
         f"CONTEXT:\n{context if context else '(no context found)'}\n\n"
         f"QUESTION:\n{question}\n\n"
-        "Return a helpful answer. Do not combine lines. Each bullet must be on a new line."
+        + ("Return the JSON answer." if answer_format == "json" else
+           "Return a helpful answer. Do not combine lines. Each bullet must be on a new line.")
     )
     messages.append({"role": "user", "content": current_user})
 
     t0 = time.perf_counter()
-    resp = client.chat.completions.create(
-        model=chat_model,
-        messages=messages,
-        temperature=0.2,
-        max_completion_tokens=400,  # Cap length for faster response
-    )
-    logger.warning(f"TIMING llm_call: {time.perf_counter() - t0:.3f}s")
+    try:
+        answer = complete_chat(
+            client=client,
+            chat_model=chat_model,
+            messages=messages,
+            json_schema=PRODUCT_ANSWER_SCHEMA if answer_format == "json" else None,
+        )
+    except LLMUnavailable as e:
+        logger.warning(f"LLM unavailable, answering from retrieval only: {e}")
+        metrics.incr("llm.degraded_answers")
+        return _retrieval_only_answer(detected_product or detect_single_product(question, history), hits)
+    logs.timing(logger, "llm_call", t0)
 
-    answer = resp.choices[0].message.content or ""
     raw = answer.strip()
+    if answer_format == "json":
+        structured = parse_structured_answer(raw)
+        if structured is not None:
+            return _structured_result(structured)
+        metrics.incr("llm.structured_invalid")
+        logger.warning(f"Structured answer could not be parsed, using it as text: {raw[:200]}")
     # Option 3: Always clean messy one-line output so we get proper line breaks (don't depend on LLM formatting)
     cleaned = _clean_product_response(raw)
     answer_lines = tuple((s.strip() or "\u00A0") for s in cleaned.split("\n"))
     if not answer_lines:
         answer_lines = (raw,)
-    logger.warning(f"TIMING rag_pipeline_total: {time.perf_counter() - t_rag_start:.3f}s")
     return RagResult(answer=cleaned.strip() or raw, sources=[], answer_lines=answer_lines)
+
+
+def _structured_result(structured: dict) -> RagResult:
+    """RagResult rendered from a structured answer; its product facts are kept for the purchase flow."""
+    product = _normalize_product_name(structured["product"]) if structured["product"] else None
+    if product:
+        structured["product"] = product
+        if structured["availability"] or structured["prices"] or structured["pack_sizes"]:
+            remember_product_facts(structured)
+    text = render_structured_answer(structured)
+    if not text:
+        text = "Sorry, I don't have that information in the product docs."
+    metrics.incr("llm.structured_answers")
+    return RagResult(answer=text, sources=[], answer_lines=tuple((line.strip() or "\u00A0") for line in text.split("\n")))
+
+
+def answer_question(
+    *,
+    openai_api_key: str,
+    chat_model: str,
+    embed_model: str,
+    embed_dimensions: int | None = None,
+    persist_dir: str,
+    question: str,
+    k: int = 12,  # Fewer chunks = faster LLM; 12 is enough for most queries
+    history: list[dict[str, str]] | None = None,
+    use_query_rewrite: bool = True,
+    use_product_filter: bool = True,
+    index_backend: str = "chroma",
+    history_keep_last: int = 4,
+    history_token_budget: int = 800,
+    answer_format: str = "text",
+) -> RagResult:
+    t_rag_start = time.perf_counter()
+    client = get_openai_client(openai_api_key)
+    prepared = _prepare_question(
+        client=client,
+        chat_model=chat_model,
+        question=question,
+        history=history,
+        use_query_rewrite=use_query_rewrite,
+        use_product_filter=use_product_filter,
+    )
+    if isinstance(prepared, RagResult):
+        return prepared
+    hits, retrieval_path = _retrieve(
+        prepared=prepared,
+        openai_api_key=openai_api_key,
+        embed_model=embed_model,
+        embed_dimensions=embed_dimensions,
+        persist_dir=persist_dir,
+        k=k,
+        index_backend=index_backend,
+    )
+    res = _generate(
+        client=client,
+        chat_model=chat_model,
+        prepared=prepared,
+        hits=hits,
+        retrieval_path=retrieval_path,
+        history_keep_last=history_keep_last,
+        history_token_budget=history_token_budget,
+        answer_format=answer_format,
+    )
+    logs.timing(logger, "rag_pipeline_total", t_rag_start)
+    return res
+
+
+def answer_questions(
+    *,
+    openai_api_key: str,
+    chat_model: str,
+    embed_model: str,
+    embed_dimensions: int | None = None,
+    persist_dir: str,
+    items: list[dict],
+    k: int = 12,
+    use_query_rewrite: bool = True,
+    use_product_filter: bool = True,
+    index_backend: str = "chroma",
+    history_keep_last: int = 4,
+    history_token_budget: int = 800,
+    answer_format: str = "text",
+    concurrency: int = 4,
+) -> Iterator[tuple[int, RagResult | Exception]]:
+    """
+    answer_question() for many items ({"question": ..., "history": [...]}), yielding (index, result)
+    as each one finishes. All search queries are embedded in one API call and retrieved with one
+    batched search per product filter; query rewrites and completions run on at most `concurrency`
+    threads. A failing item yields its exception instead of stopping the batch. Closing the generator
+    early (client disconnected) cancels the items not started yet instead of waiting for them.
+    """
+    t_batch_start = time.perf_counter()
+    client = get_openai_client(openai_api_key)
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="rag-batch")
+    try:
+        futures = {
+            pool.submit(
+                _prepare_question,
+                client=client,
+                chat_model=chat_model,
+                question=item["question"],
+                history=item.get("history"),
+                use_query_rewrite=use_query_rewrite,
+                use_product_filter=use_product_filter,
+            ): i
+            for i, item in enumerate(items)
+        }
+        prepared: dict[int, _Prepared] = {}
+        for f in as_completed(futures):
+            i = futures[f]
+            try:
+                p = f.result()
+            except Exception as e:
+                yield i, e
+                continue
+            if isinstance(p, RagResult):
+                yield i, p
+            else:
+                prepared[i] = p
+        if not prepared:
+            return
+
+        t0 = time.perf_counter()
+        order = sorted(prepared)
+        embeddings = embed_queries(
+            openai_api_key=openai_api_key,
+            embed_model=embed_model,
+            embed_dimensions=embed_dimensions,
+            queries=[prepared[i].search_query for i in order],
+            persist_dir=persist_dir,
+        )
+        emb_of = dict(zip(order, embeddings))
+        logs.timing(logger, "batch_embed", t0, f"{len(order)} queries")
+
+        # Same two-stage retrieval as _retrieve(): product-filtered first, full collection for the rest.
+        t0 = time.perf_counter()
+        hits: dict[int, ChromaHits | ChunkHits] = {}
+        paths: dict[int, str] = {}
+        filtered = [i for i in order if prepared[i].detected_product]
+        if filtered:
+            found = search_batch(
+                persist_dir=persist_dir,
+                embeddings=[emb_of[i] for i in filtered],
+                k=FILTERED_RETRIEVAL_K,
+                product_filters=[prepared[i].detected_product for i in filtered],
+                index_backend=index_backend,
+            )
+            for i, h in zip(filtered, found):
+                if _filtered_hits_are_confident(h):
+                    hits[i], paths[i] = h, "filtered"
+                else:
+                    paths[i] = "fallback"
+        rest = [i for i in order if i not in hits]
+        if rest:
+            found = search_batch(
+                persist_dir=persist_dir,
+                embeddings=[emb_of[i] for i in rest],
+                k=k,
+                product_filters=[None] * len(rest),
+                index_backend=index_backend,
+            )
+            for i, h in zip(rest, found):
+                hits[i] = h
+                paths.setdefault(i, "unfiltered")
+        logs.timing(logger, "batch_retrieval", t0)
+
+        futures = {
+            pool.submit(
+                _generate,
+                client=client,
+                chat_model=chat_model,
+                prepared=prepared[i],
+                hits=hits[i],
+                retrieval_path=paths[i],
+                history_keep_last=history_keep_last,
+                history_token_budget=history_token_budget,
+                answer_format=answer_format,
+            ): i
+            for i in order
+        }
+        for f in as_completed(futures):
+            try:
+                yield futures[f], f.result()
+            except Exception as e:
+                yield futures[f], e
+    except GeneratorExit:
+        metrics.incr("batch.cancelled")
+        raise
+    finally:
+        # Every future is done on normal completion; otherwise queued LLM calls are dropped, not awaited.
+        pool.shutdown(wait=False, cancel_futures=True)
+        # Also when every item was answered (or failed) in preparation and the batch ended early.
+        metrics.observe("batch.items", len(items))
+        logs.timing(logger, "batch_total", t_batch_start, f"{len(items)} items")
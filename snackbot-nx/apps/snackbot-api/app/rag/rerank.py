@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+from .. import metrics
+
+if TYPE_CHECKING:
+    from .chunkstore import ChunkHits
+    from .vectorstore import ChromaHits
+
+# Second-stage ranking of the retrieved chunks, run before the prompt is built. Retrieval over-fetches
+# (k=12) because the vector ranking alone isn't trusted; the reranker orders those candidates and
+# only the best top_n go into the prompt, so the LLM reads a fraction of the context.
+#   "lexical":       vector similarity + BM25 over the candidates + a bonus for the detected product's
+#                    chunks and for chunks holding the doc fields the question asks about
+#                    (price -> "Price Range (INR)", ...). Pure Python, well under a millisecond.
+#   "cross-encoder": a local sentence-transformers CrossEncoder (optional dependency, loaded once per
+#                    process); falls back to "lexical" when the package or model isn't available.
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "lexical", "cross-encoder")
+
+
+@dataclass(frozen=True)
+class RerankOptions:
+    mode: str = "off"
+    top_n: int = 4  # chunks kept for the prompt
+    model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+_options = RerankOptions()
+
+
+def configure(options: RerankOptions) -> None:
+    global _options
+    _options = options
+
+
+def current_options() -> RerankOptions:
+    return _options
+
+
+# Doc field label (as written in the product docs) -> question words that ask for it. Also the
+# vocabulary of the local spelling corrector (spelling.py).
+FIELD_KEYWORDS: dict[str, tuple[str, ...]] = {
+    "stock availability": ("available", "availability", "stock", "in stock", "out of stock"),
+    "price range": ("price", "prices", "cost", "how much", "rate", "rupees", "₹", "mrp"),
+    "available pack sizes": ("pack", "packs", "package", "packaging", "packet", "size", "sizes", "sizing", "grams", "weight", "variant"),
+    "ingredients": ("ingredient", "ingredients", "made of", "made from", "contain", "contains"),
+    "nutritional information": ("nutrition", "nutritional", "calorie", "calories", "protein", "fat", "sugar", "energy", "carb"),
+    "allergen information": ("allergen", "allergens", "allergy", "gluten", "nuts", "lactose", "vegan"),
+    "shelf life": ("shelf life", "expiry", "expire", "expires", "best before"),
+    "storage instructions": ("store", "storage", "keep", "refrigerate"),
+    "brand": ("brand", "company", "manufacturer", "made by"),
+    "category": ("category",),
+}
+# A plain product question ("do you have Lays?") is answered with the product card fields.
+CARD_FIELDS = ("stock availability", "price range", "available pack sizes")
+
+_VECTOR_WEIGHT = 2.0  # per unit of cosine similarity (hits' distances are cosine distances)
+_LEXICAL_WEIGHT = 0.5
+_PRODUCT_WEIGHT = 1.0
+_FIELD_WEIGHT = 0.75
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9₹]+")
+_STOPWORDS = frozenset(
+    "a an and are at be can do does for from have how i in is it me of on or please the this to we what "
+    "which with you your".split()
+)
+
+
+def _tokens(text: str) -> list[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def _has_phrase(text: str, phrase: str) -> bool:
+    if not phrase[0].isalnum():
+        return phrase in text
+    return re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+
+
+def wanted_fields(query: str) -> tuple[str, ...]:
+    """Doc fields the query asks about (the product card fields when it names none)."""
+    q = query.lower()
+    fields = tuple(f for f, words in FIELD_KEYWORDS.items() if any(_has_phrase(q, w) for w in words))
+    return fields or CARD_FIELDS
+
+
+def _bm25(query_terms: list[str], docs: list[list[str]]) -> list[float]:
+    n = len(docs)
+    avg_len = sum(len(d) for d in docs) / n or 1.0
+    df = Counter(t for d in docs for t in set(d))
+    scores = []
+    for d in docs:
+        tf = Counter(d)
+        s = 0.0
+        for t in set(query_terms):
+            if t not in tf:
+                continue
+            idf = math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5))
+            s += idf * tf[t] * (_BM25_K1 + 1) / (tf[t] + _BM25_K1 * (1 - _BM25_B + _BM25_B * len(d) / avg_len))
+        scores.append(s)
+    return scores
+
+
+def lexical_scores(query: str, hits: ChromaHits | ChunkHits, candidates: list[int], *, product: str | None) -> list[float]:
+    texts = [hits.text(i) for i in candidates]
+    bm25 = _bm25(_tokens(query), [_tokens(t) for t in texts])
+    top = max(bm25) or 1.0
+    fields = wanted_fields(query)
+    scores = []
+    for i, text, lex in zip(candidates, texts, bm25):
+        lowered = text.lower()
+        score = _VECTOR_WEIGHT * (1.0 - float(hits.distances[i])) + _LEXICAL_WEIGHT * lex / top
+        if product and hits.product(i) == product:
+            score += _PRODUCT_WEIGHT
+        score += _FIELD_WEIGHT * sum(1 for f in fields if f in lowered) / len(fields)
+        scores.append(score)
+    return scores
+
+
+_cross_encoders: dict[str, Any] = {}
+_cross_encoder_lock = threading.Lock()
+_cross_encoder_failed: set[str] = set()
+
+
+def load_cross_encoder(model: str) -> Any | None:
+    """The CrossEncoder for model, loaded once per process; None if it can't be loaded."""
+    if model in _cross_encoders or model in _cross_encoder_failed:
+        return _cross_encoders.get(model)
+    with _cross_encoder_lock:
+        if model in _cross_encoders or model in _cross_encoder_failed:
+            return _cross_encoders.get(model)
+        t0 = time.perf_counter()
+        try:
+            from sentence_transformers import CrossEncoder
+
+            _cross_encoders[model] = CrossEncoder(model, device="cpu")
+        except Exception as e:
+            _cross_encoder_failed.add(model)
+            logger.warning(f"Cross-encoder {model} unavailable ({type(e).__name__}: {e}); using lexical rerank")
+            return None
+        logger.warning(f"TIMING cross_encoder_load: {time.perf_counter() - t0:.3f}s ({model})")
+        return _cross_encoders[model]
+
+
+def rerank(
+    query: str,
+    hits: ChromaHits | ChunkHits,
+    candidates: list[int],
+    *,
+    product: str | None = None,
+    options: RerankOptions | None = None,
+) -> list[int]:
+    """Hit indices from candidates, best first, cut to options.top_n (all of them when mode is "off")."""
+    options = options or _options
+    if options.mode == "off" or not candidates:
+        return candidates
+    t0 = time.perf_counter()
+    mode = options.mode
+    encoder = load_cross_encoder(options.model) if mode == "cross-encoder" else None
+    if encoder is not None:
+        scores = [float(s) for s in encoder.predict([(query, hits.text(i)) for i in candidates])]
+    else:
+        mode = "lexical"
+        scores = lexical_scores(query, hits, candidates, product=product)
+    # Stable on ties, so equal scores keep the vector order.
+    ranked = [i for _, i in sorted(zip(scores, candidates), key=lambda p: -p[0])][: max(1, options.top_n)]
+    metrics.observe(f"rerank.{mode}.latency_s", time.perf_counter() - t0)
+    metrics.observe("rerank.dropped", len(candidates) - len(ranked))
+    return ranked
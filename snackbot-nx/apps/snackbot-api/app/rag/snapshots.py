@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import logging
+import os
+import secrets
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from .. import metrics
+
+# Versioned index snapshots under CHROMA_PERSIST_DIR (the index root):
+#   <root>/CURRENT              name of the active snapshot (replaced atomically by ingest)
+#   <root>/snapshots/<name>/    one complete, never-modified Chroma directory per ingest
+# Ingest builds a new snapshot and flips CURRENT. Workers stat CURRENT at most once per
+# check interval; on a change the new snapshot is loaded in the background (registered loaders)
+# while requests keep using the old one, then swapped in and swap listeners drop old caches.
+# A root without CURRENT is used as the index directory itself (pre-snapshot layout).
+
+CURRENT_FILE = "CURRENT"
+SNAPSHOTS_DIR = "snapshots"
+
+logger = logging.getLogger(__name__)
+
+_check_interval_s = 10.0
+_lock = threading.Lock()
+_loaders: list[Callable[[str], None]] = []
+_swap_listeners: list[Callable[[str, str], None]] = []
+
+
+@dataclass
+class _Root:
+    active: str
+    stamp: tuple[int, int, int] | None
+    checked_at: float
+    switching: bool = False
+
+
+_roots: dict[str, _Root] = {}
+
+
+def configure(*, check_interval_s: float) -> None:
+    global _check_interval_s
+    _check_interval_s = check_interval_s
+
+
+def on_load(fn: Callable[[str], None]) -> None:
+    """fn(snapshot_dir) prepares a new snapshot (open/load it) before it becomes active."""
+    _loaders.append(fn)
+
+
+def on_swap(fn: Callable[[str, str], None]) -> None:
+    """fn(old_dir, new_dir) runs after a swap, e.g. to drop caches tied to the old snapshot."""
+    _swap_listeners.append(fn)
+
+
+def _stamp(root: str) -> tuple[int, int, int] | None:
+    try:
+        st = os.stat(os.path.join(root, CURRENT_FILE))
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _pointed_dir(root: str) -> str:
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return root
+    return os.path.join(root, SNAPSHOTS_DIR, name) if name else root
+
+
+def active_dir(persist_dir: str) -> str:
+    """Directory of the snapshot this process currently reads for the index root persist_dir."""
+    root = os.path.abspath(os.path.normpath(persist_dir))
+    now = time.monotonic()
+    st = _roots.get(root)
+    if st is not None and (st.switching or now - st.checked_at < _check_interval_s):
+        return st.active
+    with _lock:
+        st = _roots.get(root)
+        if st is None:
+            st = _roots[root] = _Root(_pointed_dir(root), _stamp(root), now)
+            return st.active
+        if st.switching or now - st.checked_at < _check_interval_s:
+            return st.active
+        st.checked_at = now
+        stamp = _stamp(root)
+        if stamp == st.stamp:
+            return st.active
+        new_dir = _pointed_dir(root)
+        if new_dir == st.active:
+            st.stamp = stamp
+            return st.active
+        st.switching = True
+    threading.Thread(target=_switch, args=(st, stamp, new_dir), name="index-swap", daemon=True).start()
+    return st.active
+
+
+def _switch(st: _Root, stamp: tuple[int, int, int] | None, new_dir: str) -> None:
+    t0 = time.perf_counter()
+    try:
+        for load in _loaders:
+            load(new_dir)
+    except Exception:
+        logger.exception(f"Index snapshot {new_dir} failed to load; staying on {st.active}")
+        metrics.incr("index.swap_failed")
+        with _lock:
+            st.stamp, st.switching = stamp, False  # don't retry the same pointer every interval
+        return
+    with _lock:
+        old_dir = st.active
+        st.active, st.stamp, st.switching = new_dir, stamp, False
+    for listener in _swap_listeners:
+        listener(old_dir, new_dir)
+    metrics.incr("index.swaps")
+    logger.warning(f"TIMING index_swap: {time.perf_counter() - t0:.3f}s ({old_dir} -> {new_dir})")
+
+
+def create_snapshot(persist_dir: str) -> str:
+    """A new, empty snapshot directory for ingest to build into (not visible until published)."""
+    name = time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(3)
+    path = os.path.join(os.path.abspath(persist_dir), SNAPSHOTS_DIR, name)
+    os.makedirs(path)
+    return path
+
+
+def publish_snapshot(persist_dir: str, snapshot_dir: str, *, keep: int = 3) -> None:
+    """
+    Atomically point CURRENT at snapshot_dir, then delete older snapshots so `keep` remain (at least
+    2: the new one and the one it replaces, which workers read until their next check).
+    """
+    root = os.path.abspath(persist_dir)
+    name = os.path.basename(os.path.normpath(snapshot_dir))
+    previous_dir = _pointed_dir(root)
+    previous = os.path.basename(previous_dir) if previous_dir != root else None
+    tmp = os.path.join(root, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(name + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+    # The replaced snapshot is still open in every worker until it sees the new CURRENT, so it is only
+    # pruned by the next publish; older ones have been swapped out (and released) everywhere by then.
+    snapshots_root = os.path.join(root, SNAPSHOTS_DIR)
+    names = sorted(os.listdir(snapshots_root), reverse=True)
+    prunable = [n for n in names if n not in (name, previous)]
+    for old in prunable[max(0, keep - 2):]:
+        shutil.rmtree(os.path.join(snapshots_root, old), ignore_errors=True)
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import re
+import threading
+from dataclasses import dataclass, field
+
+from .catalog import Catalog, get_catalog
+from .rerank import FIELD_KEYWORDS
+
+# Local spelling/intent normalizer used before falling back to the LLM query rewrite. Each word of
+# the question is checked against a vocabulary made of the doc field words (FIELD_KEYWORDS) and the
+# catalog's product words; unknown words are corrected with a symmetric-delete index (every
+# vocabulary word is indexed under all its 1-2 character deletions, a typo is looked up under its
+# own deletions) and ranked by edit distance. "paxcakge sizing" -> "package sizing" -> pack sizes;
+# "kurkre ingrediants" -> "Kurkure ingredients". Questions it can't fully resolve go to the LLM.
+
+# Doc phrases appended to the search query per field asked for (the same vocabulary the LLM rewrite
+# prompt asks for).
+FIELD_EXPANSIONS = {
+    "stock availability": "Stock Availability In Stock",
+    "price range": "Price Range INR",
+    "available pack sizes": "pack sizes Available Pack Sizes",
+    "ingredients": "Ingredients",
+    "nutritional information": "Nutritional Information",
+    "allergen information": "Allergen Information",
+    "shelf life": "Shelf Life",
+    "storage instructions": "Storage Instructions",
+    "brand": "Brand",
+    "category": "Category",
+}
+
+# Words that are never "corrected" into vocabulary words (e.g. "what" is two edits from "fat").
+COMMON_WORDS = frozenset(
+    """
+    about after again all also and any anything are between buy can compare could details did
+    difference does doing else every for from get give good got have having hello help here hey how info information into
+    just know let like list looking many more most much need not now offer offers one only other
+    please product products sell selling show some something tell than thank thanks that the their
+    them then there these they thing things this those versus want was what when where which who why
+    will with would yes you your
+    """.split()
+)
+
+_WORD_RE = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+_MIN_CORRECT_LEN = 4
+
+
+def _max_distance(word: str) -> int:
+    return 1 if len(word) <= 5 else 2
+
+
+def _deletes(word: str, depth: int) -> set[str]:
+    out = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1 :] for w in frontier for i in range(len(w))}
+        out |= frontier
+    return out
+
+
+def _osa_distance(a: str, b: str) -> int:
+    """Optimal string alignment distance (Levenshtein plus adjacent transpositions)."""
+    prev2: list[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+@dataclass
+class Normalized:
+    text: str  # question with corrected words and canonical product names
+    corrections: list[tuple[str, str]] = field(default_factory=list)
+    fields: list[str] = field(default_factory=list)  # FIELD_KEYWORDS labels asked for
+    products: list[str] = field(default_factory=list)
+    unknown: list[str] = field(default_factory=list)  # words neither known nor correctable
+
+    @property
+    def resolved(self) -> bool:
+        """Clear enough to search without the LLM: names a product or a field, no unexplained words."""
+        return bool(self.products or self.fields) and not self.unknown
+
+    def search_query(self) -> str:
+        expansions = [FIELD_EXPANSIONS[f] for f in self.fields] or [
+            FIELD_EXPANSIONS[f] for f in ("stock availability", "price range", "available pack sizes")
+        ]
+        return " ".join([self.text, *expansions]).strip()
+
+
+class Speller:
+    def __init__(self, catalog: Catalog) -> None:
+        self.catalog = catalog
+        self.field_words: dict[str, str] = {}  # vocabulary word -> field label
+        for label, keywords in FIELD_KEYWORDS.items():
+            for phrase in (label, *keywords):
+                for word in _WORD_RE.findall(phrase.lower()):
+                    self.field_words.setdefault(word, label)
+        self.product_words = {w for term in catalog.by_term for w in term.split()}
+        self.vocabulary = set(self.field_words) | self.product_words
+        self.index: dict[str, list[str]] = {}
+        for word in sorted(self.vocabulary):
+            if len(word) < _MIN_CORRECT_LEN:
+                continue
+            for d in _deletes(word, _max_distance(word)):
+                self.index.setdefault(d, []).append(word)
+
+    def correct(self, word: str) -> str | None:
+        """Closest vocabulary word within the allowed edit distance, or None."""
+        max_d = _max_distance(word)
+        best: tuple[int, int, str] | None = None
+        seen: set[str] = set()
+        for d in _deletes(word, max_d):
+            for candidate in self.index.get(d, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                dist = _osa_distance(word, candidate)
+                if dist > max_d:
+                    continue
+                # Same first letter wins ties (typos rarely hit the first letter).
+                rank = (dist, 0 if candidate[0] == word[0] else 1, candidate)
+                if best is None or rank < best:
+                    best = rank
+        return best[2] if best else None
+
+    def normalize(self, question: str) -> Normalized:
+        corrections: list[tuple[str, str]] = []
+        unknown: list[str] = []
+        parts: list[str] = []
+        pos = 0
+        for m in _WORD_RE.finditer(question):
+            word = m.group(0).lower().replace("'", "")
+            if len(word) < _MIN_CORRECT_LEN or word in self.vocabulary or word in COMMON_WORDS:
+                continue
+            fixed = self.correct(word)
+            if fixed is None:
+                unknown.append(word)
+                continue
+            corrections.append((m.group(0), fixed))
+            parts.append(question[pos : m.start()])
+            parts.append(fixed)
+            pos = m.end()
+        parts.append(question[pos:])
+        text = "".join(parts)
+
+        words = {w.lower().replace("'", "") for w in _WORD_RE.findall(text)}
+        lowered = " ".join(text.lower().split())
+        fields = [
+            label
+            for label, keywords in FIELD_KEYWORDS.items()
+            if label in lowered
+            or any((k in words) if " " not in k else (k in lowered) for k in keywords if k[0].isalpha())
+        ]
+        # Canonical product names, as _normalize_product_names_in_query does.
+        spans = self.catalog.find_spans(text)
+        products: list[str] = []
+        out: list[str] = []
+        pos = 0
+        for product, start, end in spans:
+            out.append(text[pos:start])
+            out.append(product.name)
+            pos = end
+            if product.name not in products:
+                products.append(product.name)
+        out.append(text[pos:])
+        return Normalized(
+            text=" ".join("".join(out).split()),
+            corrections=corrections,
+            fields=fields,
+            products=products,
+            unknown=unknown,
+        )
+
+
+_speller: Speller | None = None
+_speller_lock = threading.Lock()
+
+
+def get_speller() -> Speller:
+    """Speller for the current catalog (rebuilt when the catalog is reloaded)."""
+    global _speller
+    catalog = get_catalog()
+    speller = _speller
+    if speller is not None and speller.catalog is catalog:
+        return speller
+    with _speller_lock:
+        if _speller is None or _speller.catalog is not catalog:
+            _speller = Speller(catalog)
+        return _speller
@@ -1,23 +1,135 @@
 from __future__ import annotations
 
 import logging
-import os
+import sys
+import threading
 import time
-from typing import Any
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable
 
-import chromadb
-from chromadb.config import Settings as ChromaSettings
-from openai import OpenAI
+from .. import logs, metrics
+from ..singleflight import SingleFlight
+from . import query_templates, snapshots
+
+# chromadb and openai are imported on first use (or during warm-up), not at module import:
+# together they are most of the process start-up time, which matters on a host that sleeps.
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+    from .chunkstore import ChunkHits
 
 
 COLLECTION_NAME = "snackbot_products"
 
+SPACES = ("l2", "cosine", "ip")
+
+
+@dataclass(frozen=True)
+class IndexParams:
+    """
+    Distance space and HNSW parameters new collections are created with (INDEX_SPACE, INDEX_HNSW_*).
+    Chroma fixes them when a collection is created, so an existing snapshot keeps the ones it was
+    built with until scripts/reindex.py rebuilds it.
+    space: "cosine", "l2" (squared L2, Chroma's default) or "ip" (1 - dot product).
+    m / construction_ef: graph degree and build-time beam width (recall vs build time and memory).
+    search_ef: query-time beam width (recall vs latency); hnswlib searches with max(search_ef, k).
+    """
+
+    space: str = "cosine"
+    m: int = 16
+    construction_ef: int = 100
+    search_ef: int = 100
+
+    def metadata(self) -> dict[str, Any]:
+        return {
+            "hnsw:space": self.space,
+            "hnsw:M": self.m,
+            "hnsw:construction_ef": self.construction_ef,
+            "hnsw:search_ef": self.search_ef,
+        }
+
+    @classmethod
+    def of(cls, col) -> "IndexParams":
+        """The parameters a collection was built with (Chroma's defaults for keys it has no metadata for)."""
+        meta = col.metadata or {}
+        return cls(
+            space=str(meta.get("hnsw:space", "l2")),
+            m=int(meta.get("hnsw:M", 16)),
+            construction_ef=int(meta.get("hnsw:construction_ef", 100)),
+            search_ef=int(meta.get("hnsw:search_ef", 10)),
+        )
+
+
+_params = IndexParams()
+
+
+def configure(params: IndexParams) -> None:
+    """Set the parameters new collections are created with (create_app and the ingest scripts do)."""
+    global _params
+    _params = params
+
+
 # Reuse the same Chroma client/collection per persist_dir so we don't reopen the DB on every request.
 _chroma_collection_cache: dict[str, Any] = {}
+_chroma_lock = threading.Lock()  # warm-up thread and first request may open the collection concurrently
+
+# After a snapshot swap the old snapshot's Chroma System is stopped this much later, once requests
+# that fetched the old collection just before the swap are done querying it.
+_RELEASE_DELAY_S = 30.0
+
+# One OpenAI client per API key: the client keeps a pooled HTTP connection, so reusing it
+# avoids a new TLS handshake on every request.
+_openai_client_cache: dict[str, OpenAI] = {}
 
 # Cache for query embeddings (same question + model + dimensions → skip API call). Max 200 entries.
 _embed_query_cache: dict[tuple[str, str, int | None], list[float]] = {}
 _embed_query_cache_max = 200
+_embed_flight = SingleFlight("query_embed")
+
+
+class ChromaHits:
+    """
+    One query's results from Chroma's collection.query(), with the same accessors as
+    chunkstore.ChunkHits so callers don't care which backend answered.
+    distances are cosine distances (1 - cosine similarity) whatever the collection's space, the one
+    scale SIMILARITY_THRESHOLD and rerank use: OpenAI embeddings are unit length, so squared L2 is
+    twice the cosine distance and ip's 1 - dot is the cosine distance itself.
+    """
+
+    __slots__ = ("ids", "documents", "metadatas", "distances")
+
+    def __init__(self, result: dict, index: int = 0, space: str = "l2") -> None:
+        # index selects one query when several embeddings were sent in one collection.query() call.
+        self.ids = (result.get("ids") or [[]] * (index + 1))[index]
+        self.documents = (result.get("documents") or [[]] * (index + 1))[index]
+        self.metadatas = (result.get("metadatas") or [[]] * (index + 1))[index]
+        distances = (result.get("distances") or [[]] * (index + 1))[index]
+        self.distances = [d * 0.5 for d in distances] if space == "l2" else distances
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def text(self, i: int) -> str:
+        return self.documents[i]
+
+    def product(self, i: int) -> str:
+        return self.metadata(i).get("product", "Unknown")
+
+    def chunk_id(self, i: int) -> str:
+        return self.ids[i] if i < len(self.ids) else ""
+
+    def metadata(self, i: int) -> dict:
+        return (self.metadatas[i] if i < len(self.metadatas) else None) or {}
+
+
+def get_openai_client(api_key: str) -> OpenAI:
+    client = _openai_client_cache.get(api_key)
+    if client is None:
+        from openai import OpenAI
+
+        client = OpenAI(api_key=api_key)
+        _openai_client_cache[api_key] = client
+    return client
 
 
 def _openai_embedder(client: OpenAI, model: str, dimensions: int | None = None):
@@ -33,20 +145,226 @@ def _openai_embedder(client: OpenAI, model: str, dimensions: int | None = None):
     return embed
 
 
-def get_chroma_collection(*, persist_dir: str):
+def get_chroma_collection(*, persist_dir: str, params: IndexParams | None = None):
     """
-    Persistent local Chroma collection. Cached per persist_dir so the DB is not reopened on every request.
+    Persistent local Chroma collection for the active snapshot of persist_dir (see snapshots.py).
+    Cached per snapshot directory so the DB is not reopened on every request. A missing collection
+    is created with params (default: the configured IndexParams).
     """
-    key = os.path.abspath(os.path.normpath(persist_dir))
+    key = snapshots.active_dir(persist_dir)
     if key in _chroma_collection_cache:
         return _chroma_collection_cache[key]
-    chroma_client = chromadb.PersistentClient(
-        path=persist_dir,
-        settings=ChromaSettings(anonymized_telemetry=False),
+    with _chroma_lock:
+        if key in _chroma_collection_cache:
+            return _chroma_collection_cache[key]
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+
+        chroma_client = chromadb.PersistentClient(
+            path=key,
+            settings=ChromaSettings(anonymized_telemetry=False),
+        )
+        col = chroma_client.get_or_create_collection(name=COLLECTION_NAME, metadata=(params or _params).metadata())
+        built = IndexParams.of(col)
+        if params is None and built != _params:
+            logging.getLogger(__name__).warning(
+                "Index %s was built with %s; INDEX_SPACE/INDEX_HNSW_* ask for %s (run scripts/reindex.py to rebuild it)",
+                key, built, _params,
+            )
+        _chroma_collection_cache[key] = col
+        return col
+
+
+def collection_space(col) -> str:
+    return (col.metadata or {}).get("hnsw:space", "l2")
+
+
+def _release_system(path: str) -> None:
+    """
+    Stop and forget the System chromadb keeps per persist path (sqlite connection, loaded HNSW
+    segments), unless the path's collection has been opened again meanwhile.
+    """
+    with _chroma_lock:
+        if path in _chroma_collection_cache or "chromadb" not in sys.modules:
+            return
+        from chromadb.api.shared_system_client import SharedSystemClient
+
+        system = SharedSystemClient._identifier_to_system.pop(path, None)
+    if system is not None:
+        system.stop()
+
+
+def release_collection(*, persist_dir: str) -> None:
+    """
+    Close the active snapshot's collection of persist_dir now (cache entry and chromadb System), e.g.
+    in the gunicorn master once the memory index is read: sqlite connections must not cross a fork.
+    """
+    key = snapshots.active_dir(persist_dir)
+    with _chroma_lock:
+        _chroma_collection_cache.pop(key, None)
+    _release_system(key)
+
+
+def _drop_collection(old_dir: str, new_dir: str) -> None:
+    with _chroma_lock:
+        _chroma_collection_cache.pop(old_dir, None)
+    # chromadb keeps the System of every path it has opened, so without this each swap leaks the old index.
+    timer = threading.Timer(_RELEASE_DELAY_S, _release_system, args=(old_dir,))
+    timer.daemon = True
+    timer.start()
+
+
+snapshots.on_swap(_drop_collection)
+
+
+def warm_new_snapshots() -> None:
+    """INDEX_BACKEND=chroma: open (and page in) a new snapshot's collection before requests are switched to it."""
+    snapshots.on_load(lambda snapshot_dir: touch_index(persist_dir=snapshot_dir))
+
+
+def touch_index(*, persist_dir: str) -> int:
+    """
+    Open the collection and run one nearest-neighbour query with a stored vector so the
+    HNSW index is loaded into memory before the first real request. Returns the chunk count.
+    """
+    col = get_chroma_collection(persist_dir=persist_dir)
+    n = col.count()
+    if n:
+        sample = col.get(limit=1, include=["embeddings"])
+        embeddings = sample.get("embeddings")
+        if embeddings is not None and len(embeddings):
+            col.query(query_embeddings=[list(embeddings[0])], n_results=1, include=[])
+    return n
+
+
+def _cache_query_embedding(cache_key: tuple[str, str, int | None], q_emb: list[float]) -> None:
+    if len(_embed_query_cache) >= _embed_query_cache_max:
+        _embed_query_cache.pop(next(iter(_embed_query_cache)), None)  # threads may evict concurrently
+    _embed_query_cache[cache_key] = q_emb
+
+
+def _template_embedding(
+    persist_dir: str | None, cache_key: tuple[str, str, int | None]
+) -> list[float] | None:
+    """Precomputed embedding of the query's product x field template (query_templates.py), cached like an API result."""
+    if persist_dir is None:
+        return None
+    q, embed_model, embed_dimensions = cache_key
+    emb = query_templates.lookup(persist_dir, q, embed_model=embed_model, embed_dimensions=embed_dimensions)
+    if emb is not None:
+        metrics.incr("query_embed.template_hits")
+        _cache_query_embedding(cache_key, emb)
+    return emb
+
+
+def prime_query_embeddings(
+    *,
+    openai_api_key: str,
+    embed_model: str,
+    embed_dimensions: int | None = None,
+    queries: list[str],
+    persist_dir: str | None = None,
+) -> int:
+    """Embed the not-yet-cached queries in one API call and fill the query-embedding cache. Returns how many were embedded."""
+    missing: list[str] = []
+    for q in queries:
+        key = (q.strip(), embed_model, embed_dimensions)
+        if not q.strip() or key in _embed_query_cache or q.strip() in missing:
+            continue
+        if _template_embedding(persist_dir, key) is None:
+            missing.append(q.strip())
+    missing = missing[:_embed_query_cache_max]
+    if not missing:
+        return 0
+    embed = _openai_embedder(get_openai_client(openai_api_key), embed_model, dimensions=embed_dimensions)
+    for q, emb in zip(missing, embed(missing)):
+        _cache_query_embedding((q, embed_model, embed_dimensions), emb)
+    return len(missing)
+
+
+def embed_queries(
+    *,
+    openai_api_key: str,
+    embed_model: str,
+    embed_dimensions: int | None = None,
+    queries: list[str],
+    persist_dir: str | None = None,
+) -> list[list[float]]:
+    """Embeddings for all queries (in order): cached or precomputed ones without a call, the rest in one API call."""
+    keys = [(q.strip(), embed_model, embed_dimensions) for q in queries]
+    missing = list(
+        dict.fromkeys(
+            key[0]
+            for key in keys
+            if key not in _embed_query_cache and _template_embedding(persist_dir, key) is None
+        )
     )
-    col = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
-    _chroma_collection_cache[key] = col
-    return col
+    fresh: dict[str, list[float]] = {}
+    if missing:
+        embed = _openai_embedder(get_openai_client(openai_api_key), embed_model, dimensions=embed_dimensions)
+        fresh = dict(zip(missing, embed(missing)))
+        for q, emb in fresh.items():
+            _cache_query_embedding((q, embed_model, embed_dimensions), emb)
+    return [fresh[key[0]] if key[0] in fresh else _cached_or_template(persist_dir, key) for key in keys]
+
+
+def _cached_or_template(persist_dir: str | None, cache_key: tuple[str, str, int | None]) -> list[float]:
+    # The cache may have evicted a template hit while the rest of the batch was embedded.
+    emb = _embed_query_cache.get(cache_key)
+    return emb if emb is not None else _template_embedding(persist_dir, cache_key)
+
+
+def search_batch(
+    *,
+    persist_dir: str,
+    embeddings: list[list[float]],
+    k: int,
+    product_filters: list[str | None],
+    index_backend: str = "chroma",
+) -> "list[ChromaHits | ChunkHits]":
+    """
+    k nearest chunks for each embedding (product_filters[i] applies to embeddings[i]). Queries sharing
+    a filter are searched together: one matrix product (memory) or one collection.query() (Chroma).
+    """
+    groups: dict[str | None, list[int]] = {}
+    for i, product in enumerate(product_filters):
+        groups.setdefault(product, []).append(i)
+    out: list[Any] = [None] * len(embeddings)
+
+    if index_backend == "memory":
+        from .chunkstore import ChunkHits, get_chunk_store
+
+        store = get_chunk_store(persist_dir=persist_dir)
+        for product, idx in groups.items():
+            found = store.search_many([embeddings[i] for i in idx], k, product=product)
+            for i, (rows, distances) in zip(idx, found):
+                out[i] = ChunkHits(store, rows, distances)
+        return out
+
+    col = get_chroma_collection(persist_dir=persist_dir)
+    space = collection_space(col)
+    for product, idx in groups.items():
+        result = col.query(
+            query_embeddings=[embeddings[i] for i in idx],
+            n_results=k,
+            where={"product": product} if product else None,
+            include=["documents", "metadatas", "distances"],
+        )
+        for j, i in enumerate(idx):
+            out[i] = ChromaHits(result, j, space)
+    return out
+
+
+def embed_documents(
+    *,
+    openai_api_key: str,
+    embed_model: str,
+    embed_dimensions: int | None = None,
+    texts: list[str],
+) -> list[list[float]]:
+    """Chunk embeddings in one API call (ingest; query embeddings go through the cached paths below)."""
+    client = get_openai_client(openai_api_key)
+    return _openai_embedder(client, embed_model, dimensions=embed_dimensions)(texts)
 
 
 def upsert_documents(
@@ -58,18 +376,54 @@ def upsert_documents(
     ids: list[str],
     texts: list[str],
     metadatas: list[dict[str, Any]],
+    embeddings: list[list[float]] | None = None,
 ) -> None:
+    """Write chunks to the collection, embedding them first unless embeddings are given."""
     if not ids:
         return
 
-    client = OpenAI(api_key=openai_api_key)
-    embed = _openai_embedder(client, embed_model, dimensions=embed_dimensions)
-    embeddings = embed(texts)
+    if embeddings is None:
+        embeddings = embed_documents(
+            openai_api_key=openai_api_key, embed_model=embed_model, embed_dimensions=embed_dimensions, texts=texts
+        )
 
     col = get_chroma_collection(persist_dir=persist_dir)
     col.upsert(ids=ids, documents=texts, metadatas=metadatas, embeddings=embeddings)
 
 
+def reindex(
+    *,
+    source_dir: str,
+    target_dir: str,
+    params: IndexParams,
+    batch_size: int = 500,
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """
+    Copy every chunk (ids, texts, metadata and stored embeddings - no embeddings calls) of
+    source_dir's collection into a new collection in target_dir built with params. Returns the
+    number of chunks copied; progress(done, total) is called after every batch.
+    """
+    src = get_chroma_collection(persist_dir=source_dir)
+    dst = get_chroma_collection(persist_dir=target_dir, params=params)
+    total = src.count()
+    done = 0
+    while done < total:
+        page = src.get(offset=done, limit=batch_size, include=["embeddings", "documents", "metadatas"])
+        if not page["ids"]:
+            break
+        dst.add(
+            ids=page["ids"],
+            embeddings=page["embeddings"],
+            documents=page["documents"],
+            metadatas=page["metadatas"],
+        )
+        done += len(page["ids"])
+        if progress:
+            progress(done, total)
+    return done
+
+
 def query(
     *,
     persist_dir: str,
@@ -79,26 +433,45 @@ def query(
     q: str,
     k: int = 6,
     product_filter: str | None = None,
-) -> dict:
+    index_backend: str = "chroma",
+) -> "ChromaHits | ChunkHits":
+    """
+    Embed q and return the k nearest chunks, nearest first.
+    index_backend="memory" searches the in-process ChunkStore copy instead of Chroma.
+    """
     log = logging.getLogger(__name__)
     cache_key = (q.strip(), embed_model, embed_dimensions)
     if cache_key in _embed_query_cache:
         q_emb = _embed_query_cache[cache_key]
-        log.warning("TIMING retrieval_embed: 0.000s (cached)")
+        logs.diag(log, "timing", "TIMING retrieval_embed: 0.000s (cached)", stage="retrieval_embed", seconds=0.0, cached=True)
+    elif (q_emb := _template_embedding(persist_dir, cache_key)) is not None:
+        logs.diag(log, "timing", "TIMING retrieval_embed: 0.000s (template)", stage="retrieval_embed", seconds=0.0, template=True)
     else:
-        client = OpenAI(api_key=openai_api_key)
-        embed = _openai_embedder(client, embed_model, dimensions=embed_dimensions)
+        def embed_query() -> list[float]:
+            embed = _openai_embedder(get_openai_client(openai_api_key), embed_model, dimensions=embed_dimensions)
+            emb = embed([q])[0]
+            _cache_query_embedding(cache_key, emb)
+            return emb
+
+        t0 = time.perf_counter()
+        # Identical queries arriving together share one embedding call.
+        q_emb = _embed_flight.do(cache_key, embed_query)
+        logs.timing(log, "retrieval_embed", t0)
+
+    if index_backend == "memory":
+        from .chunkstore import ChunkHits, get_chunk_store
+
         t0 = time.perf_counter()
-        q_emb = embed([q])[0]
-        log.warning(f"TIMING retrieval_embed: {time.perf_counter() - t0:.3f}s")
-        if len(_embed_query_cache) >= _embed_query_cache_max:
-            _embed_query_cache.pop(next(iter(_embed_query_cache)))
-        _embed_query_cache[cache_key] = q_emb
+        store = get_chunk_store(persist_dir=persist_dir)
+        rows, distances = store.search(q_emb, k, product=product_filter)
+        logs.timing(log, "retrieval_memory", t0)
+        return ChunkHits(store, rows, distances)
 
     t0 = time.perf_counter()
     col = get_chroma_collection(persist_dir=persist_dir)
-    log.warning(f"TIMING retrieval_chroma_load: {time.perf_counter() - t0:.3f}s")
-    log.debug("Chroma collection count: %s", col.count())
+    logs.timing(log, "retrieval_chroma_load", t0)
+    if log.isEnabledFor(logging.DEBUG):  # count() is a query of its own
+        log.debug("Chroma collection count: %s", col.count())
 
     where_clause = None
     if product_filter:
@@ -112,6 +485,6 @@ def query(
         where=where_clause,
         include=["documents", "metadatas", "distances"],
     )
-    log.warning(f"TIMING retrieval_chroma: {time.perf_counter() - t0:.3f}s")
-    return result
+    logs.timing(log, "retrieval_chroma", t0)
+    return ChromaHits(result, space=collection_space(col))
 
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+# Server-side conversation state so clients send only {session_id, message} instead of the full history.
+# SQLite (WAL) so all gunicorn workers see the same sessions; rows expire after a TTL and the table
+# is trimmed to a maximum size.
+
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# Rolling summary: one short entry per turn, only the most recent ones are kept.
+SUMMARY_MAX_ENTRIES = 6
+SUMMARY_QUESTION_CHARS = 80
+
+# Expired/overflow rows are purged on every Nth write rather than on every request.
+_PURGE_EVERY = 50
+
+
+@dataclass
+class SessionState:
+    """Compact per-conversation state: current product, last intent, rolling summary and the last turn."""
+
+    product: str | None = None
+    intent: str | None = None
+    summary: list[str] = field(default_factory=list)
+    last_user: str = ""
+    last_assistant: str = ""
+    turns: int = 0
+
+    def to_history(self) -> list[dict[str, str]]:
+        """A short history for answer_question(): summary line + the last exchange (max 3 messages)."""
+        history: list[dict[str, str]] = []
+        if self.summary:
+            history.append({"role": "assistant", "content": "Earlier in this conversation: " + "; ".join(self.summary)})
+        if self.last_user:
+            history.append({"role": "user", "content": self.last_user})
+        if self.last_assistant:
+            history.append({"role": "assistant", "content": self.last_assistant})
+        return history
+
+    def record_turn(self, *, question: str, answer: str, product: str | None, intent: str | None) -> None:
+        if product:
+            self.product = product
+        self.intent = intent
+        q = " ".join(question.split())[:SUMMARY_QUESTION_CHARS]
+        self.summary.append(f"user asked '{q}' ({product or self.product or 'no product'}, {intent})")
+        self.summary = self.summary[-SUMMARY_MAX_ENTRIES:]
+        self.last_user = question
+        self.last_assistant = answer
+        self.turns += 1
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def valid_session_id(sid: object) -> bool:
+    return isinstance(sid, str) and bool(_SESSION_ID_RE.match(sid))
+
+
+class SessionStore:
+    def __init__(self, path: str, *, ttl_s: float, max_sessions: int) -> None:
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._local = threading.local()
+        self._writes = 0
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads; one per thread (and per forked worker).
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, sid: str) -> SessionState | None:
+        row = self._conn().execute(
+            "SELECT state FROM sessions WHERE id = ? AND updated_at >= ?", (sid, time.time() - self.ttl_s)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return SessionState(**json.loads(row[0]))
+        except (TypeError, ValueError):
+            return None
+
+    def exists(self, sid: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM sessions WHERE id = ? AND updated_at >= ?", (sid, time.time() - self.ttl_s)
+        ).fetchone()
+        return row is not None
+
+    def put(self, sid: str, state: SessionState) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO sessions (id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (sid, json.dumps(asdict(state), ensure_ascii=False), time.time()),
+        )
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            self.purge()
+
+    def purge(self) -> None:
+        """Drop expired sessions, then the oldest ones beyond max_sessions."""
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_s,))
+        conn.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        )
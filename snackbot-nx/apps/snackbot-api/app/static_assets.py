@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import time
+from dataclasses import dataclass, field
+
+from flask import Request, Response, send_file
+
+try:  # optional: brotli variants are only built when the package is installed
+    import brotli
+except ImportError:
+    brotli = None
+
+from . import metrics
+
+# Static site (the built React app in static/site) served from a manifest built once at startup:
+# - assets/ files carry a content hash in their name (Vite), so they are cached for a year, immutable;
+# - everything else gets a strong ETag and is revalidated (304 when unchanged);
+# - text files get gzip (and brotli, if installed) variants computed up front and kept in memory;
+# - SPA routes are answered from a cached index.html;
+# - product images are answered with the best resized variant from scripts/build_images.py
+#   (AVIF/WebP/JPEG by Accept, size by ?w=) when its manifest exists.
+# Rebuilding the site needs a restart (deploys do that anyway).
+
+IMMUTABLE_PREFIX = "assets/"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "public, max-age=0, must-revalidate"
+# Images and the like change rarely but have stable names: cache a day, then revalidate by ETag.
+MEDIA_CACHE = "public, max-age=86400"
+
+# Written by scripts/build_images.py under images/.
+IMAGE_VARIANTS_DIR = "_variants"
+IMAGE_MANIFEST = "manifest.json"
+# Preferred order when the browser accepts it; JPEG is always acceptable.
+_IMAGE_FORMATS = ("avif", "webp")
+_MAX_WIDTH_PARAM = 4096
+
+# Formats that are already compressed; gzip/brotli would only cost CPU.
+_PRECOMPRESSED_TYPES = ("image/", "video/", "audio/", "font/woff", "application/zip", "application/gzip")
+_MIN_COMPRESS_BYTES = 512
+# A variant is kept only if it is at least this much smaller than the original.
+_MIN_SAVING = 0.9
+
+
+@dataclass
+class _Asset:
+    path: str
+    mimetype: str
+    size: int
+    etag: str
+    cache_control: str
+    data: bytes | None = None  # kept in memory only for compressible files
+    variants: dict[str, bytes] = field(default_factory=dict)  # content-encoding -> body
+
+
+def _compressible(mimetype: str) -> bool:
+    return not mimetype.startswith(_PRECOMPRESSED_TYPES)
+
+
+def _accepted_encodings(header: str) -> set[str]:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class StaticSite:
+    def __init__(self, site_dir: str) -> None:
+        t0 = time.perf_counter()
+        self.site_dir = site_dir
+        self.assets: dict[str, _Asset] = {}
+        for root, _dirs, files in os.walk(site_dir):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, site_dir).replace(os.sep, "/")
+                self.assets[rel] = self._load(rel, path)
+        self.index = self.assets.get("index.html")
+        self.images: dict[str, dict] = {}  # image stem -> build_images manifest entry
+        manifest_path = os.path.join(site_dir, "images", IMAGE_VARIANTS_DIR, IMAGE_MANIFEST)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                self.images = json.load(f)
+        logging.getLogger(__name__).warning(
+            f"TIMING static_manifest: {time.perf_counter() - t0:.3f}s ({len(self.assets)} files, "
+            f"{sum(len(v) for a in self.assets.values() for v in a.variants.values()) / 1e3:.0f} kB compressed variants)"
+        )
+
+    @staticmethod
+    def _load(rel: str, path: str) -> _Asset:
+        mimetype = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+        if rel.startswith(IMMUTABLE_PREFIX):
+            cache_control = IMMUTABLE_CACHE
+        elif mimetype.startswith(("image/", "video/", "font/")):
+            cache_control = MEDIA_CACHE
+        else:
+            cache_control = REVALIDATE_CACHE
+        st = os.stat(path)
+        if not _compressible(mimetype) or st.st_size < _MIN_COMPRESS_BYTES:
+            # Served from disk; the ETag comes from size + mtime so large files aren't read at startup.
+            etag = hashlib.blake2b(f"{rel}:{st.st_size}:{st.st_mtime_ns}".encode(), digest_size=12).hexdigest()
+            return _Asset(path, mimetype, st.st_size, etag, cache_control)
+        with open(path, "rb") as f:
+            data = f.read()
+        asset = _Asset(path, mimetype, len(data), hashlib.blake2b(data, digest_size=12).hexdigest(), cache_control, data)
+        candidates = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            candidates["br"] = brotli.compress(data, quality=11)
+        asset.variants = {enc: body for enc, body in candidates.items() if len(body) <= len(data) * _MIN_SAVING}
+        return asset
+
+    def response(self, rel: str, request: Request) -> Response | None:
+        """Response for a site file, or None if there is no such file."""
+        if self.images and rel.startswith("images/") and not rel.startswith(f"images/{IMAGE_VARIANTS_DIR}/"):
+            resp = self._image_response(rel, request)
+            if resp is not None:
+                return resp
+        asset = self.assets.get(rel)
+        if asset is None:
+            return None
+        return self._respond(asset, request)
+
+    def _image_response(self, rel: str, request: Request) -> Response | None:
+        # Keyed by stem, so /images/x.jpg also finds a variant built from x.png.
+        entry = self.images.get(os.path.splitext(os.path.basename(rel))[0])
+        if entry is None:
+            return None
+        try:
+            width = min(int(request.args.get("w", "0")), _MAX_WIDTH_PARAM)
+        except ValueError:
+            width = 0
+        accept = request.headers.get("Accept", "")
+        for fmt in [f for f in _IMAGE_FORMATS if f"image/{f}" in accept] + ["jpg"]:
+            candidates = sorted((v for v in entry["variants"] if v["format"] == fmt), key=lambda v: v["width"])
+            if not candidates:
+                continue
+            # Smallest variant at least as wide as asked; the largest one when no width is given.
+            chosen = next((v for v in candidates if v["width"] >= width), candidates[-1]) if width > 0 else candidates[-1]
+            asset = self.assets.get(f"images/{chosen['file']}")
+            if asset is None:
+                continue
+            metrics.incr(f"static.image_variant.{fmt}")
+            resp = self._respond(asset, request)
+            resp.vary.add("Accept")
+            return resp
+        return None
+
+    def index_response(self, request: Request) -> Response:
+        """index.html (SPA fallback for client-side routes)."""
+        return self._respond(self.index, request)
+
+    def _respond(self, asset: _Asset, request: Request) -> Response:
+        if asset.data is None:
+            resp = send_file(asset.path, mimetype=asset.mimetype, etag=asset.etag, conditional=True, max_age=None)
+        else:
+            encoding = None
+            if asset.variants:
+                accepted = _accepted_encodings(request.headers.get("Accept-Encoding", ""))
+                encoding = next((e for e in ("br", "gzip") if e in asset.variants and e in accepted), None)
+            body = asset.variants[encoding] if encoding else asset.data
+            resp = Response(body, mimetype=asset.mimetype)
+            # Each representation gets its own strong ETag (required when the body bytes differ).
+            resp.set_etag(f"{asset.etag}-{encoding}" if encoding else asset.etag)
+            if encoding:
+                resp.headers["Content-Encoding"] = encoding
+            if asset.variants:
+                resp.vary.add("Accept-Encoding")
+            resp = resp.make_conditional(request)
+        resp.headers["Cache-Control"] = asset.cache_control
+        if resp.status_code == 304:
+            metrics.incr("static.not_modified")
+        return resp
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from .config import Settings
+from .rag.catalog import get_catalog
+from .rag.rag import warmup_search_queries
+from .rag.vectorstore import get_openai_client, prime_query_embeddings, touch_index
+
+# Settings for a warm-up that must wait until after fork (gunicorn preload_app), see gunicorn.conf.py.
+_deferred: Settings | None = None
+
+logger = logging.getLogger(__name__)
+
+# Warm-up state for this worker process, reported by GET /ready.
+_state: dict[str, Any] = {
+    "started": False,
+    "ready": False,
+    "started_at": None,
+    "duration_s": None,
+    "steps": {},
+    "errors": {},
+}
+_lock = threading.Lock()
+
+
+def _run_step(name: str, fn: Callable[[], Any]) -> Any:
+    t0 = time.perf_counter()
+    try:
+        result = fn()
+    except Exception as e:
+        # A failed step (e.g. OpenAI unreachable) is reported but doesn't block readiness:
+        # the worker can still serve, it just pays that cost on the first request.
+        _state["errors"][name] = f"{type(e).__name__}: {e}"
+        logger.warning(f"Warm-up step '{name}' failed: {e}")
+        result = None
+    _state["steps"][name] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+def run_warmup(s: Settings) -> dict[str, Any]:
+    """
+    Pay the first-request costs up front: open the Chroma collection, load the vector index,
+    create the pooled OpenAI client and prime the query-embedding cache for the top questions.
+    """
+    with _lock:
+        if _state["started"]:
+            return status()
+        _state["started"] = True
+        _state["started_at"] = time.time()
+
+    t0 = time.perf_counter()
+    if s.index_backend == "memory":
+        from .rag.chunkstore import get_chunk_store
+
+        _state["chunks"] = _run_step("index", lambda: len(get_chunk_store(persist_dir=s.chroma_persist_dir)))
+    else:
+        _state["chunks"] = _run_step("index", lambda: touch_index(persist_dir=s.chroma_persist_dir))
+    _run_step("openai_client", lambda: get_openai_client(s.openai_api_key))
+    if s.rerank == "cross-encoder":
+        from .rag.rerank import load_cross_encoder
+
+        _run_step("reranker", lambda: load_cross_encoder(s.rerank_model))
+    queries = warmup_search_queries(s.warmup_queries or list(get_catalog().names))
+    _state["primed_queries"] = _run_step(
+        "prime_embeddings",
+        lambda: prime_query_embeddings(
+            openai_api_key=s.openai_api_key,
+            embed_model=s.openai_embed_model,
+            embed_dimensions=s.openai_embed_dimensions,
+            queries=queries,
+            persist_dir=s.chroma_persist_dir,
+        ),
+    )
+    _state["duration_s"] = round(time.perf_counter() - t0, 3)
+    _state["ready"] = True
+    logger.warning(f"TIMING warmup_total: {_state['duration_s']:.3f}s steps={_state['steps']}")
+    return status()
+
+
+def start_warmup_thread(s: Settings) -> None:
+    """Run warm-up in a daemon thread so the worker can answer /health (and /ready = not yet) meanwhile."""
+    threading.Thread(target=run_warmup, args=(s,), name="snackbot-warmup", daemon=True).start()
+
+
+def defer_until_fork(s: Settings) -> None:
+    """App is being created in the gunicorn master: threads don't survive fork, so each worker starts warm-up in post_fork."""
+    global _deferred
+    _deferred = s
+
+
+def start_deferred() -> None:
+    if _deferred is not None:
+        start_warmup_thread(_deferred)
+
+
+def mark_ready() -> None:
+    """Used when warm-up is disabled: the worker is ready as soon as the app exists."""
+    _state["ready"] = True
+
+
+def status() -> dict[str, Any]:
+    return {
+        "ready": _state["ready"],
+        "warmup_duration_s": _state["duration_s"],
+        "steps": dict(_state["steps"]),
+        "errors": dict(_state["errors"]),
+        "chunks": _state.get("chunks"),
+        "primed_queries": _state.get("primed_queries"),
+    }
@@ -15,4 +15,7 @@ cd ../snackbot-api
 echo "Installing Python dependencies..."
 pip install -r requirements.txt
 
+echo "Building image variants..."
+python -m scripts.build_images
+
 echo "Build complete!"
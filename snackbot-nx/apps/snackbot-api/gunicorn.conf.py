@@ -0,0 +1,38 @@
+"""
+Gunicorn settings (loaded automatically from this directory, or with -c gunicorn.conf.py).
+
+PRELOAD_INDEX=1 loads the app - and the read-only memory index - once in the master before
+forking workers, so the embedding matrix and chunk texts are shared copy-on-write instead of
+being loaded by every worker. See scripts/bench_worker_memory.py for the per-worker numbers.
+
+Workers are threaded (gthread): chat requests mostly wait on OpenAI, and spare threads keep
+/health and /ready answering while CHAT_MAX_CONCURRENT chats (+ CHAT_MAX_QUEUE waiting) are busy.
+Keep GUNICORN_THREADS above their sum.
+"""
+import gc
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "12"))
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+preload_app = os.getenv("PRELOAD_INDEX", "").strip().lower() in ("1", "true", "yes", "on")
+
+if preload_app:
+    # Avoid GC holes/refcount writes in pages that workers inherit: disable GC in the master,
+    # freeze all objects into the permanent generation right before fork, re-enable in workers.
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()
+        from app import jobs, warmup
+
+        warmup.start_deferred()
+        jobs.start_deferred()
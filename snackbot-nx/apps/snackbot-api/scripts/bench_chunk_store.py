@@ -0,0 +1,84 @@
+"""
+Compare retrieval through Chroma with the in-process ChunkStore on an ingested collection:
+latency, peak Python allocation per query (tracemalloc) and memory per chunk.
+
+Stored chunk embeddings are used as queries, so no OpenAI calls are made.
+
+Usage (from apps/snackbot-api):
+  python -m scripts.bench_chunk_store [--persist-dir ./data/chroma] [--queries 200] [--k 12]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app.rag.chunkstore import ChunkHits, get_chunk_store
+from app.rag.vectorstore import ChromaHits, get_chroma_collection
+
+
+def _consume(hits: ChromaHits | ChunkHits) -> int:
+    # What answer_question does with the hits: read each text once.
+    return sum(len(hits.text(i)) for i in range(len(hits)))
+
+
+def _measure(label: str, run, queries: list[list[float]]) -> None:
+    latencies: list[float] = []
+    for q in queries:
+        t0 = time.perf_counter()
+        run(q)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    peaks: list[int] = []
+    tracemalloc.start()
+    for q in queries:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        run(q)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else max(latencies)
+    print(
+        f"{label:<8} median {statistics.median(latencies):7.3f} ms  p95 {p95:7.3f} ms  "
+        f"peak Python allocation/query {statistics.median(peaks) / 1024:8.1f} KiB"
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persist-dir", default=os.getenv("CHROMA_PERSIST_DIR", os.path.join(".", "data", "chroma")))
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=12)
+    args = ap.parse_args()
+
+    store = get_chunk_store(persist_dir=args.persist_dir)
+    if not len(store):
+        raise SystemExit(f"No chunks in {args.persist_dir}; run the ingest first.")
+    col = get_chroma_collection(persist_dir=args.persist_dir)
+    step = max(1, len(store) // args.queries)
+    queries = [store.embeddings[i].tolist() for i in range(0, len(store), step)][: args.queries]
+
+    print(f"{len(store)} chunks, dim {store.embeddings.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(f"ChunkStore memory: {store.nbytes / 1e6:.1f} MB ({store.nbytes / len(store):.0f} B/chunk)")
+
+    def chroma(q: list[float]) -> int:
+        res = col.query(query_embeddings=[q], n_results=args.k, include=["documents", "metadatas", "distances"])
+        return _consume(ChromaHits(res))
+
+    def memory(q: list[float]) -> int:
+        rows, distances = store.search(q, args.k)
+        return _consume(ChunkHits(store, rows, distances))
+
+    _measure("chroma", chroma, queries)
+    _measure("memory", memory, queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Cold-start benchmark: import-time profile (python -X importtime) and time-to-first-response.
+
+Usage (from apps/snackbot-api):
+  python -m scripts.bench_cold_start
+  python -m scripts.bench_cold_start --runs 7 --budget-ms 400 --profile-out importtime.txt
+
+Exits with status 1 when the median `import wsgi` time exceeds --budget-ms, so it can gate CI.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+
+# Start-up budget for `import wsgi` (Flask app module, no warm-up). chromadb/openai must stay lazy to fit.
+DEFAULT_BUDGET_MS = 500
+
+_FIRST_RESPONSE_SNIPPET = """
+import time
+t0 = time.perf_counter()
+from wsgi import app
+t_app = time.perf_counter()
+resp = app.test_client().get("/health")
+t_resp = time.perf_counter()
+assert resp.status_code == 200, resp.status_code
+print(f"{(t_app - t0) * 1000:.1f} {(t_resp - t0) * 1000:.1f}")
+"""
+
+
+def _child_env() -> dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench-cold-start")
+    env["WARMUP_ON_START"] = "0"  # measure the process itself, not the background warm-up
+    return env
+
+
+def import_profile() -> tuple[float, list[tuple[str, int, int]], str]:
+    """Run `python -X importtime -c "import wsgi"`; return (total ms, [(module, self_us, cumulative_us)], raw output)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import wsgi"],
+        cwd=api_dir,
+        env=_child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows: list[tuple[str, int, int]] = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.replace("import time:", "", 1).split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    total_us = next((c for name, _, c in rows if name == "wsgi"), 0)
+    return total_us / 1000, rows, proc.stderr
+
+
+def first_response() -> tuple[float, float, float]:
+    """Spawn a fresh interpreter and time: app import, first /health response (in-process) and wall clock."""
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", _FIRST_RESPONSE_SNIPPET],
+        cwd=api_dir,
+        env=_child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall_ms = (time.perf_counter() - t0) * 1000
+    app_ms, resp_ms = (float(x) for x in proc.stdout.split())
+    return app_ms, resp_ms, wall_ms
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15, help="How many top-level packages to list")
+    ap.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    ap.add_argument("--profile-out", help="Write the raw -X importtime output of the last run here")
+    args = ap.parse_args()
+
+    totals: list[float] = []
+    rows: list[tuple[str, int, int]] = []
+    raw = ""
+    for _ in range(args.runs):
+        total_ms, rows, raw = import_profile()
+        totals.append(total_ms)
+    if args.profile_out:
+        with open(args.profile_out, "w", encoding="utf-8") as f:
+            f.write(raw)
+
+    by_package: dict[str, int] = defaultdict(int)
+    for name, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+    print(f"import wsgi: median {statistics.median(totals):.1f} ms over {args.runs} runs (min {min(totals):.1f})")
+    print(f"Top {args.top} packages by self import time (last run):")
+    for pkg, us in sorted(by_package.items(), key=lambda kv: -kv[1])[: args.top]:
+        print(f"  {pkg:<32} {us / 1000:8.1f} ms")
+
+    results = [first_response() for _ in range(args.runs)]
+    print("Time to first response (fresh interpreter, GET /health via test client):")
+    print(f"  app import   median {statistics.median(r[0] for r in results):8.1f} ms")
+    print(f"  first /health median {statistics.median(r[1] for r in results):8.1f} ms")
+    print(f"  process wall median {statistics.median(r[2] for r in results):8.1f} ms (includes interpreter start-up)")
+
+    median_ms = statistics.median(totals)
+    if median_ms > args.budget_ms:
+        print(f"FAIL: import wsgi {median_ms:.1f} ms exceeds start-up budget {args.budget_ms:.0f} ms")
+        raise SystemExit(1)
+    print(f"OK: within start-up budget of {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Chroma HNSW parameters: build time, query latency and recall as the collection grows.
+
+For each --sizes collection size, synthetic chunk embeddings (unit length, clustered by product like
+real product docs) are written to a throwaway Chroma collection per --configs entry
+(M/construction_ef/search_ef, in --space), then queried one at a time as /api/chat does:
+  recall@k      unfiltered top --k against exact search (the in-memory ChunkStore, same space)
+  product@fk    product-filtered top --filtered-k (rag's first retrieval pass), same comparison
+The exact NumPy search (INDEX_BACKEND=memory) is timed as a reference row. No network, no API key.
+
+Usage (from apps/snackbot-api):
+  python -m scripts.bench_hnsw [--sizes 1000,5000,20000] [--dims 512] [--configs 16/100/10,16/100/50,32/200/100]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app.rag.chunkstore import ChunkStore
+from app.rag.vectorstore import IndexParams, get_chroma_collection
+
+_ADD_BATCH = 1000
+
+
+def _corpus(n: int, dims: int, products: int, rng: np.random.Generator) -> tuple[np.ndarray, list[str]]:
+    """Unit vectors around one centre per product (chunks of one product doc are alike)."""
+    centres = rng.normal(size=(products, dims)).astype(np.float32)
+    owner = rng.integers(0, products, size=n)
+    x = centres[owner] + rng.normal(scale=1.5, size=(n, dims)).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x, [f"p{o}" for o in owner]
+
+
+def _queries(x: np.ndarray, products: list[str], count: int, rng: np.random.Generator) -> tuple[np.ndarray, list[str]]:
+    """A blend of two stored chunks of one product plus noise, so queries fall between chunks."""
+    by_product: dict[str, np.ndarray] = {}
+    for p in sorted(set(products)):
+        by_product[p] = np.flatnonzero(np.array(products) == p)
+    names = list(by_product)
+    qs, owners = [], []
+    for _ in range(count):
+        p = names[rng.integers(len(names))]
+        a, b = rng.choice(by_product[p], size=2)
+        qs.append(x[a] + x[b] + rng.normal(scale=0.02, size=x.shape[1]))
+        owners.append(p)
+    q = np.asarray(qs, dtype=np.float32)
+    return q / np.linalg.norm(q, axis=1, keepdims=True), owners
+
+
+def _recall(got: list[set[str]], truth: list[set[str]]) -> float:
+    return sum(len(g & t) for g, t in zip(got, truth)) / max(1, sum(len(t) for t in truth))
+
+
+def _p95(values: list[float]) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * 0.95) - 1)]
+
+
+def _parse_config(raw: str, space: str) -> IndexParams:
+    m, construction_ef, search_ef = (int(v) for v in raw.split("/"))
+    return IndexParams(space=space, m=m, construction_ef=construction_ef, search_ef=search_ef)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="1000,5000,20000", help="collection sizes (chunks)")
+    ap.add_argument("--dims", type=int, default=512)
+    ap.add_argument("--products", type=int, default=15)
+    ap.add_argument("--space", default="cosine", choices=("l2", "cosine", "ip"))
+    ap.add_argument("--configs", default="16/100/10,16/100/50,16/100/100,32/200/100",
+                    help="comma-separated M/construction_ef/search_ef")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--filtered-k", type=int, default=4)
+    args = ap.parse_args()
+    configs = [_parse_config(c, args.space) for c in args.configs.split(",") if c.strip()]
+    rng = np.random.default_rng(0)
+
+    print(f"{args.dims}-dim unit vectors, {args.products} products, {args.queries} queries, space {args.space}")
+    print(
+        f"{'chunks':>7} {'M/cEF/sEF':<12} {'build s':>8} {'median ms':>10} {'p95 ms':>8} "
+        f"{f'recall@{args.k}':>10} {f'product@{args.filtered_k}':>10}"
+    )
+    for n in (int(v) for v in args.sizes.split(",") if v.strip()):
+        x, products = _corpus(n, args.dims, args.products, rng)
+        ids = [f"c{i}" for i in range(n)]
+        q, q_products = _queries(x, products, args.queries, rng)
+
+        exact = ChunkStore(ids=ids, texts=[""] * n, products=products, embeddings=x, space=args.space)
+        latencies, truth, truth_filtered = [], [], []
+        for qi, p in zip(q, q_products):
+            t0 = time.perf_counter()
+            rows, _ = exact.search(qi, args.k)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            truth.append({exact.chunk_id(r) for r in rows})
+            rows, _ = exact.search(qi, args.filtered_k, product=p)
+            truth_filtered.append({exact.chunk_id(r) for r in rows})
+        print(
+            f"{n:>7} {'exact numpy':<12} {'-':>8} {statistics.median(latencies):10.3f} {_p95(latencies):8.3f} "
+            f"{1.0:10.3f} {1.0:10.3f}"
+        )
+
+        for params in configs:
+            with tempfile.TemporaryDirectory() as tmp:
+                col = get_chroma_collection(persist_dir=tmp, params=params)
+                t0 = time.perf_counter()
+                for start in range(0, n, _ADD_BATCH):
+                    end = min(n, start + _ADD_BATCH)
+                    col.add(
+                        ids=ids[start:end],
+                        embeddings=x[start:end].tolist(),
+                        metadatas=[{"product": p} for p in products[start:end]],
+                    )
+                build_s = time.perf_counter() - t0
+
+                latencies, got, got_filtered = [], [], []
+                for qi, p in zip(q, q_products):
+                    emb = qi.tolist()
+                    t0 = time.perf_counter()
+                    res = col.query(query_embeddings=[emb], n_results=args.k, include=["documents", "metadatas", "distances"])
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                    got.append(set(res["ids"][0]))
+                    res = col.query(query_embeddings=[emb], n_results=args.filtered_k, where={"product": p}, include=[])
+                    got_filtered.append(set(res["ids"][0]))
+                label = f"{params.m}/{params.construction_ef}/{params.search_ef}"
+                print(
+                    f"{n:>7} {label:<12} {build_s:8.2f} {statistics.median(latencies):10.3f} {_p95(latencies):8.3f} "
+                    f"{_recall(got, truth):10.3f} {_recall(got_filtered, truth_filtered):10.3f}"
+                )
+    print("Chroma's defaults are 16/100/10 (search_ef is raised to k when smaller).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Job queue benchmark: /api/order latency with the order's post-processing inline versus queued, queue
+throughput, and a retry/dead-letter check.
+
+  1. /api/order under --concurrency clients, order post-processing taking --work-ms (a simulated
+     notification call): done inline in the request, versus enqueued and left to --workers job
+     threads. Reports request latency (median/p95/max) and, for the queue, how long the workers
+     took to drain it.
+  2. Raw queue throughput: enqueues/s (1 and --concurrency threads) and claim+complete/s.
+  3. A job that always fails must be retried and end up dead-lettered after JOBS_MAX_ATTEMPTS.
+
+Runs against a throwaway SQLite file; no network, no API key.
+
+Usage (from apps/snackbot-api):
+  python -m scripts.bench_jobs [--orders 400] [--concurrency 16] [--work-ms 50] [--workers 4]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, jsonify, request
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app import jobs, orders
+
+ORDER = {
+    "name": "Bench",
+    "phone": "9999999999",
+    "address": "1 Bench Street",
+    "items": [{"productId": "parle-g-56g", "productName": "Parle G", "quantity": 2}],
+}
+
+
+def _p95(values: list[float]) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * 0.95) - 1)]
+
+
+def _post_orders(app: Flask, n: int, concurrency: int) -> list[float]:
+    client = app.test_client()
+
+    def one(_: int) -> float:
+        t0 = time.perf_counter()
+        resp = client.post("/api/order", json=ORDER)
+        assert resp.status_code == 200, resp.get_data(as_text=True)
+        return time.perf_counter() - t0
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(one, range(n)))
+
+
+def _order_app(queue: jobs.JobQueue | None) -> Flask:
+    """/api/order as in app/main.py; queue=None runs the post-processing inline (the old behaviour)."""
+    app = Flask(__name__)
+
+    @app.post("/api/order")
+    def order():
+        order_record, error = orders.parse_order(request.get_json(silent=True) or {})
+        if error:
+            return jsonify({"error": error}), 400
+        if queue is None:
+            orders.handle_order(order_record)
+        else:
+            queue.enqueue(orders.ORDER_JOB, order_record)
+        return jsonify({"success": True})
+
+    return app
+
+
+def _row(label: str, latencies: list[float]) -> str:
+    ms = [x * 1000 for x in latencies]
+    return f"{label:<22} {statistics.median(ms):9.2f}ms {_p95(ms):9.2f}ms {max(ms):9.2f}ms"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--orders", type=int, default=400)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--work-ms", type=float, default=50.0, help="simulated post-processing time per order")
+    ap.add_argument("--workers", type=int, default=4, help="job worker threads")
+    ap.add_argument("--queue-ops", type=int, default=2000)
+    args = ap.parse_args()
+    logging.disable(logging.WARNING)  # the order handler logs every order
+
+    def slow_order(order: dict) -> None:
+        time.sleep(args.work_ms / 1000)
+
+    orders.handle_order = slow_order
+    jobs.register(orders.ORDER_JOB, slow_order)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"/api/order, {args.orders} orders, {args.concurrency} clients, post-processing {args.work_ms:.0f}ms")
+        print(f"{'':<22} {'median':>11} {'p95':>11} {'max':>11}")
+        print(_row("inline", _post_orders(_order_app(None), args.orders, args.concurrency)))
+
+        queue = jobs.JobQueue(os.path.join(tmp, "orders.sqlite3"))
+        stop = threading.Event()
+        workers = [
+            threading.Thread(target=queue.work, args=(stop,), kwargs={"poll_interval_s": 0.05}, daemon=True)
+            for _ in range(args.workers)
+        ]
+        for w in workers:
+            w.start()
+        t0 = time.perf_counter()
+        latencies = _post_orders(_order_app(queue), args.orders, args.concurrency)
+        print(_row(f"queued ({args.workers} workers)", latencies))
+        while queue.counts()[jobs.DONE] < args.orders:
+            time.sleep(0.01)
+        drained = time.perf_counter() - t0
+        stop.set()
+        print(f"queue drained {args.orders} jobs in {drained:.2f}s ({args.orders / drained:.0f} jobs/s)")
+
+        print(f"\nqueue throughput ({args.queue_ops} jobs, no work)")
+        raw = jobs.JobQueue(os.path.join(tmp, "raw.sqlite3"))
+        jobs.register("bench.noop", lambda payload: None)
+        t0 = time.perf_counter()
+        for i in range(args.queue_ops):
+            raw.enqueue("bench.noop", {"i": i})
+        print(f"  {'enqueue, 1 thread':<24} {args.queue_ops / (time.perf_counter() - t0):8.0f}/s")
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(lambda i: raw.enqueue("bench.noop", {"i": i}), range(args.queue_ops)))
+        print(f"  {f'enqueue, {args.concurrency} threads':<24} {args.queue_ops / (time.perf_counter() - t0):8.0f}/s")
+        t0 = time.perf_counter()
+        ran = 0
+        while raw.run_one("bench"):
+            ran += 1
+        print(f"  {'claim + run + complete':<24} {ran / (time.perf_counter() - t0):8.0f}/s")
+
+        print("\nretries / dead letter")
+
+        def always_fails(payload: dict) -> None:
+            raise RuntimeError("downstream unavailable")
+
+        jobs.register("bench.fail", always_fails)
+        failing = jobs.JobQueue(os.path.join(tmp, "fail.sqlite3"), max_attempts=3, retry_base_s=0.0)
+        job_id = failing.enqueue("bench.fail", {})
+        attempts = 0
+        while failing.run_one("bench"):
+            attempts += 1
+        dead = failing.dead_letters()
+        ok = attempts == 3 and len(dead) == 1 and dead[0]["id"] == job_id
+        print(f"  {attempts} attempts, dead letters: {[(d['id'], d['error']) for d in dead]}  {'OK' if ok else 'FAIL'}")
+        requeued = failing.requeue_dead()
+        print(f"  requeue_dead -> {requeued} job(s) queued again: {failing.counts()}")
+        if not ok:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
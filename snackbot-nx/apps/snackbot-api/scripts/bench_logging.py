@@ -0,0 +1,156 @@
+"""
+Logging overhead on the chat hot path: the log lines one /api/chat request emits, timed from
+--threads concurrent "requests" (no LLM or retrieval, only the logging), for
+
+  sync f-string   the previous setup: logging.basicConfig(WARNING) + logger.warning(f"...") for every
+                  diagnostic, each one formatted and written to the stream in the request thread;
+  async, all      app/logs.py with every diagnostic category on (LOG_SAMPLING=*=1);
+  async, default  app/logs.py with the production sampling (LOG_SAMPLING=chunks=0,*=0.1).
+
+Records go to --out (a file, so every write is a real syscall as with stderr). Reports the logging
+time per request (median/p99), requests per second across all threads (including --gap-ms), lines written and records
+dropped because the writer fell behind (the queue holds 10000; requests never wait for it).
+
+Usage (from apps/snackbot-api):
+  python -m scripts.bench_logging [--threads 16] [--requests 2000] [--gap-ms 5] [--out /tmp/bench-logging.log]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app import logs, metrics
+
+logger = logging.getLogger("app.rag.rag")
+
+QUESTION = "What is the price of Kurkure Masala Munch and which pack sizes do you have?"
+SEARCH_QUERY = "Kurkure Stock Availability In Stock Price Range INR pack sizes Available Pack Sizes"
+CHUNK = "Kurkure Masala Munch. Stock Availability: In Stock. Price Range (INR): 10-50. " * 3
+HISTORY = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "Hello!"}]
+
+
+def old_request() -> None:
+    """The lines the chat path logged before app/logs.py, as it logged them."""
+    t0 = time.perf_counter()
+    logger.warning(f"📨 Received question: '{QUESTION}'")
+    logger.warning(f"📚 History: {len(HISTORY) if HISTORY else 0} messages")
+    logger.warning(f"Skip rewrite; expanded query: '{SEARCH_QUERY[:70]}...'")
+    logger.warning(f"TIMING query_expansion: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"TIMING retrieval_embed: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"TIMING retrieval_memory: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"TIMING retrieval: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"🔍 QUERY DEBUG: '{QUESTION}' → rewritten to: '{SEARCH_QUERY}'")
+    logger.warning(f"📊 Retrieved 6 chunks from database (path=filtered, product=Kurkure)")
+    for i in range(3):
+        logger.warning(f"Chunk {i}: distance={0.41 + i / 10:.3f}, product=Kurkure, preview={CHUNK[:100]}")
+    logger.warning(f"TIMING filter_and_context: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"TIMING llm_call: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"TIMING rag_pipeline_total: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"TIMING rag_total: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"TIMING request_total: {time.perf_counter() - t0:.3f}s")
+    logger.warning(f"✅ Answer length: {len(CHUNK)} chars")
+
+
+def new_request() -> None:
+    """The same lines as the chat path logs them now."""
+    t0 = time.perf_counter()
+    logs.diag(logger, "request", "Received question: %r (%d history messages)", QUESTION, len(HISTORY), history_messages=len(HISTORY))
+    logs.diag(logger, "query", "Skip rewrite; expanded query: %r", SEARCH_QUERY, rewrite="skipped", search_query=SEARCH_QUERY)
+    logs.timing(logger, "query_expansion", t0)
+    logs.timing(logger, "retrieval_embed", t0)
+    logs.timing(logger, "retrieval_memory", t0)
+    logs.timing(logger, "retrieval", t0)
+    logs.diag(
+        logger, "retrieval", "Retrieved %d chunks for %r (path=%s, product=%s)", 6, SEARCH_QUERY, "filtered", "Kurkure",
+        chunks=6, path="filtered", product="Kurkure",
+    )
+    for i in range(3):
+        if logs.enabled("chunks"):
+            logs.diag(
+                logger, "chunks", "Chunk %d: distance=%.3f, product=%s, preview=%s", i, 0.41 + i / 10, "Kurkure", CHUNK[:100]
+            )
+    logs.timing(logger, "filter_and_context", t0)
+    logs.timing(logger, "llm_call", t0)
+    logs.timing(logger, "rag_pipeline_total", t0)
+    logs.timing(logger, "rag_total", t0)
+    logs.timing(logger, "request_total", t0)
+    logs.diag(logger, "request", "Answer length: %d chars", len(CHUNK), answer_chars=len(CHUNK))
+
+
+def _run(request_fn, threads: int, requests: int, gap_s: float) -> tuple[list[float], float]:
+    per_thread = max(1, requests // threads)
+    samples: list[list[float]] = [[] for _ in range(threads)]
+    start = threading.Barrier(threads + 1)
+
+    def worker(n: int) -> None:
+        start.wait()
+        out = samples[n]
+        for _ in range(per_thread):
+            token = logs.begin_request(f"bench-{n}")
+            t0 = time.perf_counter()
+            request_fn()
+            out.append(time.perf_counter() - t0)
+            logs.end_request(token)
+            time.sleep(gap_s)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in pool:
+        t.join()
+    return [x for s in samples for x in s], time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--gap-ms", type=float, default=5.0,
+                    help="time each request spends outside logging (waiting on OpenAI in production)")
+    ap.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "bench-logging.log"))
+    args = ap.parse_args()
+
+    print(f"{args.requests} requests from {args.threads} threads, {args.gap_ms:g}ms apart, log lines to {args.out}")
+    print(f"{'setup':<16} {'median':>10} {'p99':>10} {'req/s':>10} {'lines':>8} {'dropped':>8}")
+    with open(args.out, "w", encoding="utf-8") as out:
+        setups = [
+            ("sync f-string", lambda: logging.basicConfig(level=logging.WARNING, stream=out, force=True), old_request),
+            ("async, all", lambda: logs.configure(sampling={"*": 1.0}, stream=out), new_request),
+            ("async, default", lambda: logs.configure(sampling=logs.parse_sampling("chunks=0,*=0.1"), stream=out), new_request),
+        ]
+        for label, setup, request_fn in setups:
+            setup()
+            lines0 = _count_lines(out)
+            dropped0 = metrics.snapshot()["counters"].get("logs.dropped", 0)
+            latencies, elapsed = _run(request_fn, args.threads, args.requests, args.gap_ms / 1000)
+            logs.shutdown()  # write out what is still queued before counting
+            us = sorted(x * 1e6 for x in latencies)
+            print(
+                f"{label:<16} {statistics.median(us):8.1f}us {us[int(len(us) * 0.99) - 1]:8.1f}us "
+                f"{len(latencies) / elapsed:10.0f} {_count_lines(out) - lines0:8d} "
+                f"{metrics.snapshot()['counters'].get('logs.dropped', 0) - dropped0:8d}"
+            )
+        logging.basicConfig(force=True)
+
+
+def _count_lines(out) -> int:
+    out.flush()
+    with open(out.name, "rb") as f:
+        return sum(1 for _ in f)
+
+
+if __name__ == "__main__":
+    main()
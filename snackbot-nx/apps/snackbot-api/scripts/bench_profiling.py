@@ -0,0 +1,116 @@
+"""
+Cost of the on-demand chat profiler (app/profiling.py): answer_question() end to end on a fake OpenAI
+client (no network) and a small in-memory chunk store, so only the Python work is timed, under
+
+  off             PROFILE_TOKEN and PROFILE_SAMPLE_RATE unset (the default);
+  armed           PROFILE_TOKEN set but the chat sent without the header (every chat pays the check);
+  profiled 5ms    every chat profiled with the default sampling interval;
+  profiled 1ms    every chat profiled at 1ms.
+
+Reports the per-chat time (median/p95) and the time added against "off", then the summary of the
+last profile written (what /api/admin/profiles returns).
+
+Usage (from apps/snackbot-api):
+  python -m scripts.bench_profiling [--chats 400] [--latency-ms 20]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app import profiling
+from app.rag import chunkstore, rag, vectorstore
+from app.rag.catalog import get_catalog
+from app.rag.chunkstore import ChunkStore
+from scripts.check_singleflight import FakeOpenAI
+
+PERSIST_DIR = os.path.join(api_dir, "data", "profiling-bench")
+TOKEN = "bench-token"
+QUESTIONS = ("what is the price of {}", "do you have {}", "{} pack sizes", "is {} in stock", "tell me about {}")
+
+
+def _store() -> ChunkStore:
+    names = list(get_catalog().names)
+    ids, texts, products = [], [], []
+    for product in names:
+        for i, body in enumerate((
+            "Stock Availability: In Stock. Price Range (INR): 30g - Rs 10, 55g - Rs 20, 90g - Rs 35.",
+            "Available Pack Sizes: 30g, 55g, 90g, 115g. Category: Snacks.",
+            "Brand and ingredients: made by the manufacturer from potatoes, oil and seasoning.",
+        )):
+            ids.append(f"{product}-{i}")
+            texts.append(f"{product}. {body}")
+            products.append(product)
+    rng = np.random.default_rng(0)
+    return ChunkStore(ids=ids, texts=texts, products=products, embeddings=rng.normal(size=(len(ids), 4)))
+
+
+def _chat(question: str, header: str | None, n: int) -> float:
+    t0 = time.perf_counter()
+    with profiling.profile_request(header, request_id=f"bench-{n}"):
+        rag.answer_question(
+            openai_api_key="k",
+            chat_model="m",
+            embed_model="e",
+            persist_dir=PERSIST_DIR,
+            question=question,
+            index_backend="memory",
+        )
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chats", type=int, default=400)
+    ap.add_argument("--latency-ms", type=float, default=20.0, help="simulated OpenAI round trip (0 = Python work only)")
+    args = ap.parse_args()
+    logging.disable(logging.WARNING)
+
+    client = FakeOpenAI(args.latency_ms / 1000)
+    rag.get_openai_client = vectorstore.get_openai_client = lambda api_key: client
+    chunkstore._stores[os.path.abspath(os.path.normpath(PERSIST_DIR))] = _store()
+    names = list(get_catalog().names)
+    questions = [t.format(p) for p in names for t in QUESTIONS]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setups = [
+            ("off", {}, None),
+            ("armed", {"token": TOKEN}, None),
+            ("profiled 5ms", {"token": TOKEN, "interval_ms": 5.0}, TOKEN),
+            ("profiled 1ms", {"token": TOKEN, "interval_ms": 1.0}, TOKEN),
+        ]
+        for n, q in enumerate(questions):  # fill the rewrite/embedding caches first, like a warm worker
+            _chat(q, None, n)
+        print(f"{args.chats} chats, OpenAI latency {args.latency_ms:g}ms, {len(questions)} distinct questions")
+        print(f"{'setup':<14} {'median':>10} {'p95':>10} {'added':>10}")
+        base = None
+        for label, options, header in setups:
+            profiling.configure(directory=tmp, keep=args.chats, **options)
+            times = sorted(_chat(questions[n % len(questions)], header, n) * 1e6 for n in range(args.chats))
+            median = statistics.median(times)
+            base = base or median
+            print(
+                f"{label:<14} {median:8.0f}us {times[int(len(times) * 0.95) - 1]:8.0f}us {median - base:+8.0f}us "
+                f"({median / base - 1:+.1%})"
+            )
+        time.sleep(0.1)  # the last profile's files are written by its sampler thread
+        latest = profiling.recent_profiles(1)
+        if latest:
+            print(f"\nlast profile: {json.dumps(latest[0], indent=2)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Memory / latency / recall of the memory index at different search dims and vector precisions.
+
+Builds ChunkStore variants from one read of the ingested collection and compares each against exact
+float32 search on the full vectors. Queries are synthetic (normalized sum of two stored chunk
+vectors), so no OpenAI calls are made.
+
+Usage (from apps/snackbot-api):
+  python -m scripts.bench_quantization [--persist-dir ./data/chroma] [--dims 1536,512,256] [--k 12]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app.rag.chunkstore import FULL_VECTORS_FILENAME, ChunkStore, StoreOptions, read_collection
+
+
+def _run(store: ChunkStore, queries: np.ndarray, k: int) -> tuple[list[set[int]], float]:
+    results: list[set[int]] = []
+    latencies: list[float] = []
+    for q in queries:
+        t0 = time.perf_counter()
+        rows, _ = store.search(q, k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append(set(int(r) for r in rows))
+    return results, statistics.median(latencies)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persist-dir", default=os.getenv("CHROMA_PERSIST_DIR", os.path.join(".", "data", "chroma")))
+    ap.add_argument("--dims", default="1536,512,256")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--rescore", type=int, default=50)
+    args = ap.parse_args()
+
+    data = read_collection(persist_dir=args.persist_dir)
+    n, dim = data["embeddings"].shape if data["embeddings"].ndim == 2 else (0, 0)
+    if not n:
+        raise SystemExit(f"No chunks in {args.persist_dir}; run the ingest first.")
+    dims = [d for d in (int(x) for x in args.dims.split(",")) if d <= dim]
+
+    baseline = ChunkStore(**data)
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(0, n, size=(args.queries, 2))
+    queries = baseline.embeddings[pairs[:, 0]] + baseline.embeddings[pairs[:, 1]]
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth, base_ms = _run(baseline, queries, args.k)
+
+    print(f"{n} chunks, stored dim {dim}, {len(queries)} queries, recall@{args.k} vs exact float32 {dim}-dim search")
+    print(f"{'dims':>5} {'vectors':<8} {'rescore':>7} {'MB':>8} {'B/chunk':>8} {'median ms':>10} {'recall':>7}")
+    print(f"{dim:>5} {'float32':<8} {'-':>7} {baseline.vector_nbytes / 1e6:8.2f} {baseline.vector_nbytes / n:8.0f} {base_ms:10.3f} {1.0:7.3f}")
+    with tempfile.TemporaryDirectory() as tmp:
+        full_path = os.path.join(tmp, FULL_VECTORS_FILENAME)
+        np.save(full_path, baseline.embeddings)  # what write_full_vectors() puts in a snapshot
+        for d in dims:
+            for quant in ("none", "float16", "int8"):
+                if d == dim and quant == "none":
+                    continue
+                for rescore in (0, args.rescore):
+                    store = ChunkStore(
+                        **data,
+                        options=StoreOptions(quantization=quant, search_dims=d, rescore=rescore),
+                        full_path=full_path,
+                    )
+                    got, ms = _run(store, queries, args.k)
+                    recall = sum(len(g & t) for g, t in zip(got, truth)) / sum(len(t) for t in truth)
+                    label = "float32" if quant == "none" else quant
+                    print(
+                        f"{d:>5} {label:<8} {rescore or '-':>7} {store.vector_nbytes / 1e6:8.2f} "
+                        f"{store.vector_nbytes / n:8.0f} {ms:10.3f} {recall:7.3f}"
+                    )
+    print("MB = resident vector memory; with rescoring the full float32 vectors are memory-mapped from disk.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Rerank cost versus prompt savings on an ingested collection.
+
+For each question the full-collection retrieval (k=12) is run once, then for every rerank mode:
+  - rerank latency (median/p95 over --repeats runs, no network),
+  - prompt context size (estimated tokens) and whether the product facts a card needs
+    (availability, prices, pack sizes) are still in the kept chunks,
+  - with --llm: the completion latency of _generate() with that context, alternating modes per
+    question so provider drift hits all of them alike.
+
+Needs OPENAI_API_KEY (query embeddings; completions with --llm).
+
+Usage (from apps/snackbot-api):
+  python -m scripts.bench_rerank [--persist-dir ./data/chroma] [--top-n 4] [--llm] [--repeats 50]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app.config import load_settings
+from app.rag import rerank as rerank_module
+from app.rag.catalog import get_catalog
+from app.rag.facts import extract_product_facts
+from app.rag.history import estimate_tokens
+from app.rag.rag import SIMILARITY_THRESHOLD, _generate, _prepare_question
+from app.rag.rerank import RerankOptions, load_cross_encoder, rerank
+from app.rag.vectorstore import get_openai_client, query as vs_query
+
+QUESTION_TEMPLATES = (
+    "Do you have {p}?",
+    "What is the price of {p}?",
+    "Is {p} in stock?",
+    "What are the ingredients of {p}?",
+)
+
+
+def _p95(values: list[float]) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * 0.95) - 1)]
+
+
+def _fact_count(facts: dict | None) -> int:
+    if not facts:
+        return 0
+    return int(bool(facts["availability"])) + len(facts["prices"]) + len(facts["pack_sizes"])
+
+
+def main() -> None:
+    load_dotenv(dotenv_path=os.path.join(os.getcwd(), "..", "..", ".env"), override=False)
+    load_dotenv(override=False)
+    s = load_settings()
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--persist-dir", default=s.chroma_persist_dir)
+    ap.add_argument("--k", type=int, default=12)
+    ap.add_argument("--top-n", type=int, default=s.rerank_top_n)
+    ap.add_argument("--model", default=s.rerank_model)
+    ap.add_argument("--repeats", type=int, default=50)
+    ap.add_argument("--llm", action="store_true", help="also time completions with each context")
+    args = ap.parse_args()
+
+    modes = ["off", "lexical"]
+    if load_cross_encoder(args.model) is not None:
+        modes.append("cross-encoder")
+    else:
+        print(f"(cross-encoder skipped: {args.model} could not be loaded)")
+
+    client = get_openai_client(s.openai_api_key)
+    questions = [t.format(p=p) for p in get_catalog().names for t in QUESTION_TEMPLATES]
+    rerank_ms: dict[str, list[float]] = {m: [] for m in modes}
+    tokens: dict[str, list[int]] = {m: [] for m in modes}
+    fact_recall: dict[str, list[float]] = {m: [] for m in modes}
+    llm_s: dict[str, list[float]] = {m: [] for m in modes}
+
+    for qn, question in enumerate(questions):
+        prepared = _prepare_question(
+            client=client,
+            chat_model=s.openai_chat_model,
+            question=question,
+            history=None,
+            use_query_rewrite=False,
+            use_product_filter=True,
+        )
+        hits = vs_query(
+            persist_dir=args.persist_dir,
+            openai_api_key=s.openai_api_key,
+            embed_model=s.openai_embed_model,
+            embed_dimensions=s.openai_embed_dimensions,
+            q=prepared.search_query,
+            k=args.k,
+            index_backend=s.index_backend,
+        )
+        candidates = [i for i in range(len(hits)) if hits.distances[i] <= SIMILARITY_THRESHOLD]
+        product = prepared.detected_product
+        full_facts = _fact_count(extract_product_facts(product, [hits.text(i) for i in candidates])) if product else 0
+        for mode in modes:
+            options = RerankOptions(mode=mode, top_n=args.top_n, model=args.model)
+            for _ in range(args.repeats if mode != "off" else 1):
+                t0 = time.perf_counter()
+                kept = rerank(prepared.search_query, hits, candidates, product=product, options=options)
+                rerank_ms[mode].append((time.perf_counter() - t0) * 1000)
+            tokens[mode].append(sum(estimate_tokens(hits.text(i)) for i in kept))
+            if full_facts:
+                facts = extract_product_facts(product, [hits.text(i) for i in kept])
+                fact_recall[mode].append(_fact_count(facts) / full_facts)
+
+        if args.llm:
+            rotated = modes[qn % len(modes):] + modes[: qn % len(modes)]
+            for mode in rotated:
+                rerank_module.configure(RerankOptions(mode=mode, top_n=args.top_n, model=args.model))
+                t0 = time.perf_counter()
+                _generate(
+                    client=client,
+                    chat_model=s.openai_chat_model,
+                    prepared=prepared,
+                    hits=hits,
+                    retrieval_path="unfiltered",
+                    history_keep_last=s.history_keep_last,
+                    history_token_budget=s.history_token_budget,
+                )
+                llm_s[mode].append(time.perf_counter() - t0)
+
+    print(f"{len(questions)} questions, k={args.k}, top_n={args.top_n}, rerank repeats={args.repeats}")
+    header = f"{'mode':<14} {'rerank med':>11} {'rerank p95':>11} {'ctx tokens':>11} {'fact recall':>12}"
+    if args.llm:
+        header += f" {'generate med':>13} {'vs off':>9}"
+    print(header)
+    base = statistics.median(llm_s["off"]) if args.llm else 0.0
+    for mode in modes:
+        row = (
+            f"{mode:<14} {statistics.median(rerank_ms[mode]):9.3f}ms {_p95(rerank_ms[mode]):9.3f}ms "
+            f"{statistics.median(tokens[mode]):11.0f} "
+            f"{(statistics.mean(fact_recall[mode]) if fact_recall[mode] else 1.0):11.0%}"
+        )
+        if args.llm:
+            med = statistics.median(llm_s[mode])
+            row += f" {med:12.3f}s {med - base:+8.3f}s"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
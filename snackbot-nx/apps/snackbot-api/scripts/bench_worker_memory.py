@@ -0,0 +1,131 @@
+"""
+Per-worker memory report for gunicorn (Linux only: reads /proc/<pid>/smaps_rollup).
+
+USS (unique set size = Private_Clean + Private_Dirty) is what each worker really costs;
+PSS splits shared pages between the processes that map them.
+
+Usage (from apps/snackbot-api):
+  # Report on a running server
+  python -m scripts.bench_worker_memory --pid <gunicorn master pid>
+
+  # Start gunicorn with the memory index, per-worker load vs preloaded in the master, and compare
+  python -m scripts.bench_worker_memory --launch --workers 4
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+
+
+def _smaps_rollup(pid: int) -> dict[str, int]:
+    """Memory counters of one process in kB."""
+    out: dict[str, int] = {}
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                out[parts[0][:-1]] = int(parts[1])
+    return out
+
+
+def _children(pid: int) -> list[int]:
+    kids: list[int] = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="utf-8") as f:
+                # Field 4 is the parent pid; comm (field 2) may contain spaces, so split after ')'.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            kids.append(int(entry))
+    return sorted(kids)
+
+
+def report(master_pid: int, label: str = "") -> dict[str, float]:
+    workers = _children(master_pid)
+    if label:
+        print(f"\n== {label} ==")
+    print(f"{'pid':>8} {'role':<7} {'RSS MB':>9} {'PSS MB':>9} {'USS MB':>9}")
+    uss_total = 0.0
+    for pid, role in [(master_pid, "master")] + [(w, "worker") for w in workers]:
+        m = _smaps_rollup(pid)
+        uss = (m.get("Private_Clean", 0) + m.get("Private_Dirty", 0)) / 1024
+        if role == "worker":
+            uss_total += uss
+        print(f"{pid:>8} {role:<7} {m.get('Rss', 0) / 1024:9.1f} {m.get('Pss', 0) / 1024:9.1f} {uss:9.1f}")
+    avg = uss_total / len(workers) if workers else 0.0
+    print(f"workers: {len(workers)}, unique memory per worker (avg USS): {avg:.1f} MB, total: {uss_total:.1f} MB")
+    return {"workers": len(workers), "avg_uss_mb": avg, "total_uss_mb": uss_total}
+
+
+def _wait_ready(port: int, timeout_s: float) -> None:
+    deadline = time.time() + timeout_s
+    ok = 0
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=5) as resp:
+                ok = ok + 1 if resp.status == 200 else 0
+        except (urllib.error.URLError, OSError):
+            ok = 0
+        if ok >= 8:  # several probes in a row, so (most likely) every worker answered ready
+            return
+        time.sleep(0.5)
+    raise SystemExit(f"Server on port {port} did not become ready within {timeout_s:.0f}s")
+
+
+def launch(preload: bool, workers: int, port: int, timeout_s: float, settle_s: float) -> dict[str, float]:
+    env = dict(os.environ)
+    env.update(INDEX_BACKEND="memory", PRELOAD_INDEX="1" if preload else "0", PORT=str(port))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-w", str(workers), "wsgi:app"],
+        cwd=api_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(port, timeout_s)
+        time.sleep(settle_s)
+        return report(proc.pid, label=f"INDEX_BACKEND=memory PRELOAD_INDEX={'1' if preload else '0'}")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pid", type=int, help="gunicorn master pid to report on")
+    ap.add_argument("--launch", action="store_true", help="start gunicorn without and with preload and compare")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--port", type=int, default=5099)
+    ap.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for /ready")
+    ap.add_argument("--settle", type=float, default=2.0, help="seconds to wait after ready before measuring")
+    args = ap.parse_args()
+
+    if args.pid:
+        report(args.pid)
+        return
+    if not args.launch:
+        ap.error("pass --pid or --launch")
+    before = launch(False, args.workers, args.port, args.timeout, args.settle)
+    after = launch(True, args.workers, args.port, args.timeout, args.settle)
+    saved = before["avg_uss_mb"] - after["avg_uss_mb"]
+    print(
+        f"\nUnique memory per worker: {before['avg_uss_mb']:.1f} MB -> {after['avg_uss_mb']:.1f} MB "
+        f"({saved:.1f} MB less per worker, {saved * after['workers']:.1f} MB across {after['workers']} workers)"
+    )
+
+
+if __name__ == "__main__":
+    main()
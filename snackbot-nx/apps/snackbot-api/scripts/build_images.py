@@ -0,0 +1,113 @@
+"""
+Build resized product image variants for the static site.
+
+For every image in static/site/images (copied there from snackbot-web/public by the web build) this
+writes AVIF (when Pillow supports it), WebP and JPEG versions at each breakpoint width no larger
+than the original into static/site/images/_variants/, plus manifest.json describing them. The API
+then serves the best variant for the browser's Accept header and an optional ?w= width (see
+app/static_assets.py). Variants that are already newer than their source are kept.
+
+Usage (from apps/snackbot-api, after the web build):
+  python -m scripts.build_images [--images-dir static/site/images] [--widths 320,640,960,1280]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from PIL import Image, ImageOps, features
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app.static_assets import IMAGE_MANIFEST, IMAGE_VARIANTS_DIR
+
+SOURCE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+DEFAULT_WIDTHS = "320,640,960,1280"
+# Output format -> (Pillow format, save options)
+FORMATS = {
+    "avif": ("AVIF", {"quality": 50, "speed": 6}),
+    "webp": ("WEBP", {"quality": 80, "method": 6}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def _formats() -> list[str]:
+    return [ext for ext in FORMATS if ext != "avif" or features.check("avif")]
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """JPEG has no alpha: composite transparent images onto white."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def build(images_dir: str, widths: list[int]) -> dict:
+    out_dir = os.path.join(images_dir, IMAGE_VARIANTS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    formats = _formats()
+    manifest: dict[str, dict] = {}
+    for name in sorted(os.listdir(images_dir)):
+        stem, ext = os.path.splitext(name)
+        src = os.path.join(images_dir, name)
+        if ext.lower() not in SOURCE_EXTENSIONS or not os.path.isfile(src):
+            continue
+        src_mtime = os.path.getmtime(src)
+        with Image.open(src) as opened:
+            img = ImageOps.exif_transpose(opened)
+            img.load()
+        targets = [w for w in widths if w < img.width] + [min(img.width, max(widths))]
+        entry = {"source": name, "width": img.width, "height": img.height, "bytes": os.path.getsize(src), "variants": []}
+        for w in sorted(set(targets)):
+            h = max(1, round(img.height * w / img.width))
+            resized = None
+            for fmt in formats:
+                file = f"{stem}-{w}.{fmt}"
+                path = os.path.join(out_dir, file)
+                if not (os.path.exists(path) and os.path.getmtime(path) >= src_mtime):
+                    if resized is None:
+                        resized = img.resize((w, h), Image.LANCZOS) if w != img.width else img.copy()
+                    pil_format, options = FORMATS[fmt]
+                    if fmt == "jpg":
+                        out = _flatten(resized)
+                    else:
+                        alpha = resized.mode in ("RGBA", "LA", "PA") or "transparency" in resized.info
+                        out = resized.convert("RGBA" if alpha else "RGB")
+                    out.save(path, pil_format, **options)
+                entry["variants"].append(
+                    {"format": fmt, "width": w, "file": f"{IMAGE_VARIANTS_DIR}/{file}", "bytes": os.path.getsize(path)}
+                )
+        manifest[stem] = entry
+    with open(os.path.join(out_dir, IMAGE_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--images-dir", default=os.path.join(api_dir, "static", "site", "images"))
+    ap.add_argument("--widths", default=DEFAULT_WIDTHS)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    manifest = build(args.images_dir, sorted(int(w) for w in args.widths.split(",")))
+    original = sum(e["bytes"] for e in manifest.values())
+    print(f"{len(manifest)} images, formats: {', '.join(_formats())}, {time.perf_counter() - t0:.1f}s")
+    print(f"{'image':<28} {'original':>10} " + " ".join(f"{fmt + '@640':>10}" for fmt in _formats()))
+    for stem, e in manifest.items():
+        at = {v["format"]: v["bytes"] for v in e["variants"] if v["width"] == min(640, e["width"])}
+        print(f"{stem:<28} {e['bytes'] / 1e3:9.0f}k " + " ".join(f"{at.get(fmt, 0) / 1e3:9.0f}k" for fmt in _formats()))
+    print(f"total original {original / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
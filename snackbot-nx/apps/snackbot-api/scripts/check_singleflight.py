@@ -0,0 +1,131 @@
+"""
+Concurrency check for request coalescing: N identical concurrent requests must produce exactly one
+upstream call for the query rewrite, the query embedding and the final completion.
+
+Uses a fake OpenAI client that counts calls and sleeps to simulate latency (no network, no API key)
+and a small in-memory chunk store. Exits 1 if any stage made more than one upstream call.
+
+Usage (from apps/snackbot-api):
+  python -m scripts.check_singleflight [--concurrency 32] [--latency-ms 200]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app.rag import chunkstore, rag, vectorstore
+from app.rag.chunkstore import ChunkStore
+
+PERSIST_DIR = os.path.join(api_dir, "data", "singleflight-check")
+
+
+class FakeOpenAI:
+    """Counts chat/embedding calls; each call blocks for `latency` seconds like a real round trip."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls = {"chat": 0, "embeddings": 0}
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    def with_options(self, **kwargs) -> FakeOpenAI:
+        return self
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            self.calls[kind] += 1
+        time.sleep(self.latency)
+
+    def _chat(self, **kwargs):
+        self._count("chat")
+        content = "Lays price pack sizes" if kwargs.get("max_completion_tokens") == 80 else "Yes, we have Lays."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def _embed(self, **kwargs):
+        self._count("embeddings")
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0, 0.0, 0.0, 0.0]) for _ in kwargs["input"]])
+
+
+def _concurrently(n: int, fn) -> list:
+    barrier = threading.Barrier(n)
+
+    def run(_: int):
+        barrier.wait()
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        return list(pool.map(run, range(n)))
+
+
+def _check(label: str, client: FakeOpenAI, kind: str, results: list) -> bool:
+    calls = client.calls[kind]
+    ok = calls == 1 and len(set(map(str, results))) == 1
+    print(f"{label:<16} {len(results)} concurrent requests -> {calls} upstream call(s)  {'OK' if ok else 'FAIL'}")
+    client.calls[kind] = 0
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--latency-ms", type=float, default=200)
+    args = ap.parse_args()
+    n = args.concurrency
+    logging.getLogger("app").setLevel(logging.ERROR)  # silence per-request TIMING lines
+
+    client = FakeOpenAI(args.latency_ms / 1000)
+    vectorstore.get_openai_client = lambda api_key: client
+
+    store = ChunkStore(
+        ids=["lays-0", "lays-1"],
+        texts=["Lays Stock Availability In Stock", "Lays Price Range (INR) 30g – ₹10"],
+        products=["Lays", "Lays"],
+        embeddings=np.eye(2, 4, dtype=np.float32),
+    )
+    chunkstore._stores[os.path.abspath(os.path.normpath(PERSIST_DIR))] = store
+
+    ok = True
+    results = _concurrently(
+        n, lambda: rag.rewrite_query_for_rag(client=client, query_model="m", question="lays packt sise")
+    )
+    ok &= _check("query rewrite", client, "chat", results)
+
+    results = _concurrently(
+        n,
+        lambda: list(
+            vectorstore.query(
+                persist_dir=PERSIST_DIR,
+                openai_api_key="k",
+                embed_model="m",
+                q="lays price",
+                k=2,
+                index_backend="memory",
+            ).distances
+        ),
+    )
+    ok &= _check("query embedding", client, "embeddings", results)
+
+    messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "lays price"}]
+    results = _concurrently(n, lambda: rag.complete_chat(client=client, chat_model="m", messages=messages))
+    ok &= _check("completion", client, "chat", results)
+
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
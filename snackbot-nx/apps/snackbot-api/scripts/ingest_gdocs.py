@@ -1,9 +1,18 @@
+"""
+Build the vector index from the product docs (Google Docs in GDOCS_PUBLISHED_URLS, or local
+HTML/Markdown files with --local) into a new index snapshot and publish it.
+
+One doc: a master doc with every product under its own heading. Several docs: one per product
+(Google Docs in catalog order, see app/rag/catalog.json; local files by name, e.g. kurkure.md).
+
+Usage (from apps/snackbot-api):
+  python -m scripts.ingest_gdocs [--local docs/] [--resume] [--batch-size 64]
+"""
 from __future__ import annotations
 
+import argparse
 import os
 import sys
-import re
-from typing import Iterable
 
 from dotenv import load_dotenv
 
@@ -14,106 +23,21 @@ if api_dir not in sys.path:
     sys.path.insert(0, api_dir)
 
 from app.config import load_settings
-from app.rag.chunking import chunk_text
-from app.rag.gdocs import fetch_published_doc
-from app.rag.vectorstore import upsert_documents
-
-
-PRODUCTS = [
-    "Lays",
-    "Kurkure",
-    "Cadbury Dairy Milk Silk",
-    "Maggi",
-    "Nescafe Classic",
-    "Parle G",
-]
-
-
-def _slug(s: str) -> str:
-    return re.sub(r"[^a-z0-9]+", "-", s.lower()).strip("-")
-
-
-def _split_doc_by_products(doc_text: str, products: Iterable[str]) -> dict[str, str]:
-    """
-    Split a single doc into sections by product headings.
-
-    This expects the doc to contain the product names as standalone headings/lines, like:
-      Lays
-      ...
-      Cadbury Dairy Milk Silk
-      ...
-    """
-    text = doc_text or ""
-    parts: dict[str, str] = {}
-
-    # Normalize whitespace a bit while keeping newlines for heading detection.
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
-    text = re.sub(r"\n{3,}", "\n\n", text).strip()
-
-    # Build a case-insensitive regex that matches any product heading on its own line.
-    # Also try to match headings that might have extra formatting
-    escaped = [re.escape(p) for p in products]
-    # Match product name at start of line, optionally followed by whitespace and end of line
-    # Case-insensitive matching - also allow partial matches
-    headings_re = re.compile(rf"(?mi)^(?:{'|'.join(escaped)})\s*$")
-    
-    # Also try to find headings that contain product names (more flexible)
-    partial_headings_re = re.compile(rf"(?mi)^.*(?:{'|'.join(escaped)}).*$")
-
-    matches = list(headings_re.finditer(text))
-    
-    # If no exact matches, try partial matches
-    if not matches:
-        print("No exact product heading matches found, trying partial matches...")
-        partial_matches = list(partial_headings_re.finditer(text))
-        if partial_matches:
-            print(f"Found {len(partial_matches)} partial matches, using those")
-            matches = partial_matches
-    
-    if not matches:
-        # Debug: print first 1000 chars to help diagnose
-        print(f"\n{'='*80}")
-        print("WARNING: Could not find product headings!")
-        print(f"{'='*80}")
-        print(f"Looking for these headings (case-insensitive): {list(products)}")
-        print(f"\nFirst 1000 chars of document:")
-        print("-"*80)
-        print(text[:1000])
-        print("-"*80)
-        print("\nIf your Google Doc has different product names, update the PRODUCTS list in ingest_gdocs.py")
-        print("="*80)
-        return parts
-
-    print(f"Found {len(matches)} product headings in document")
-    
-    for i, m in enumerate(matches):
-        start = m.end()
-        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
-        heading = m.group(0).strip()
-        
-        # Normalize heading to match one of our product names (case-insensitive)
-        # Try exact match first, then partial match
-        normalized_heading = None
-        for product in products:
-            if heading.lower() == product.lower():
-                normalized_heading = product
-                break
-        
-        # If no exact match, try partial match
-        if not normalized_heading:
-            for product in products:
-                if product.lower() in heading.lower() or heading.lower() in product.lower():
-                    normalized_heading = product
-                    break
-        
-        if not normalized_heading:
-            normalized_heading = heading  # Use as-is if no match
-
-        section = text[start:end].strip()
-        if section:
-            parts[normalized_heading] = section
-
-    return parts
+from app.rag import catalog
+from app.rag.chunkstore import write_full_vectors
+from app.rag.ingest import (
+    CHECKPOINT_FILE,
+    LOCAL_EXTENSIONS,
+    Checkpoint,
+    Source,
+    local_sources,
+    print_progress,
+    run_ingest,
+)
+from app.rag.query_templates import build_templates
+from app.rag.snapshots import SNAPSHOTS_DIR, create_snapshot, publish_snapshot
+from app.rag.vectorstore import IndexParams, configure as configure_index, embed_documents
+
 
 
 def main() -> None:
@@ -121,73 +45,92 @@ def main() -> None:
     load_dotenv(dotenv_path=os.path.join(os.getcwd(), "..", "..", ".env"), override=False)
     load_dotenv(override=False)
 
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--local", action="append", metavar="PATH",
+                    help="ingest local .html/.md/.txt files (file or directory, repeatable) instead of Google Docs")
+    ap.add_argument("--resume", action="store_true", help="continue the snapshot of an interrupted ingest")
+    ap.add_argument("--batch-size", type=int, default=64, help="chunks per embeddings call")
+    ap.add_argument("--parse-workers", type=int, default=min(4, os.cpu_count() or 1))
+    ap.add_argument("--embed-workers", type=int, default=2, help="concurrent embeddings calls")
+    args = ap.parse_args()
+
     s = load_settings()
-    if not s.gdocs_published_urls:
+    catalog.configure(path=s.catalog_path)
+    configure_index(
+        IndexParams(
+            space=s.index_space,
+            m=s.index_hnsw_m,
+            construction_ef=s.index_hnsw_construction_ef,
+            search_ef=s.index_hnsw_search_ef,
+        )
+    )
+    if not args.local and not s.gdocs_published_urls:
         raise SystemExit(
             "GDOCS_PUBLISHED_URLS is empty. Publish your Google Docs to web and set URLs (comma-separated) in .env."
         )
 
-    all_ids: list[str] = []
-    all_texts: list[str] = []
-    all_metas: list[dict] = []
-
-    # If you provided ONE doc URL, we treat it as a single "master" doc and
-    # split it into per-product sections by product headings.
-    if len(s.gdocs_published_urls) == 1:
-        url = s.gdocs_published_urls[0]
-        doc = fetch_published_doc(url)
-        sections = _split_doc_by_products(doc.text, PRODUCTS)
-
-        if not sections:
-            print(
-                "\n" + "="*80 + "\n"
-                "WARNING: Could not find product headings in the doc.\n"
-                "The script is looking for these exact headings (case-insensitive):\n"
-            )
-            for p in PRODUCTS:
-                print(f"  - {p}")
-            print(
-                "\nMake sure each product name appears as a heading on its own line.\n"
-                "First 1000 characters of the document:\n"
-                + "-"*80 + "\n"
-                + doc.text[:1000]
-                + "\n" + "-"*80 + "\n"
-                "Ingesting the entire doc as a single source (not split by products).\n"
-                + "="*80 + "\n"
-            )
-            sections = {doc.title: doc.text}
-
-        for product, section_text in sections.items():
-            chunks = chunk_text(section_text)
-            for c_idx, c in enumerate(chunks):
-                cid = f"{_slug(product)}-{c_idx}"
-                all_ids.append(cid)
-                all_texts.append(c)
-                all_metas.append({"url": doc.url, "title": doc.title, "product": product})
-
-    # Otherwise, assume one doc per product, mapped by order.
+    if args.local:
+        sources = local_sources(args.local)
+        if not sources:
+            raise SystemExit(f"No {', '.join(LOCAL_EXTENSIONS)} files found in: {', '.join(args.local)}")
     else:
-        for idx, url in enumerate(s.gdocs_published_urls):
-            doc = fetch_published_doc(url)
-            product = PRODUCTS[idx] if idx < len(PRODUCTS) else doc.title
-            chunks = chunk_text(doc.text)
-            for c_idx, c in enumerate(chunks):
-                cid = f"{_slug(product)}-{c_idx}"
-                all_ids.append(cid)
-                all_texts.append(c)
-                all_metas.append({"url": doc.url, "title": doc.title, "product": product})
-
-    upsert_documents(
-        persist_dir=s.chroma_persist_dir,
-        openai_api_key=s.openai_api_key,
-        embed_model=s.openai_embed_model,
-        embed_dimensions=s.openai_embed_dimensions,
-        ids=all_ids,
-        texts=all_texts,
-        metadatas=all_metas,
-    )
+        sources = [Source(url) for url in s.gdocs_published_urls]
+
+    # Build into a fresh snapshot and publish it only once complete: running workers keep serving
+    # the previous snapshot and switch to this one on their next check (no restart needed).
+    # --resume continues the newest unpublished snapshot, embedding only what isn't written yet.
+    snapshot_dir = _resumable_snapshot(s.chroma_persist_dir) if args.resume else None
+    if snapshot_dir:
+        print(f"Resuming snapshot {os.path.basename(snapshot_dir)}")
+    else:
+        snapshot_dir = create_snapshot(s.chroma_persist_dir)
+    try:
+        stats = run_ingest(
+            sources=sources,
+            products=list(catalog.get_catalog().names),
+            snapshot_dir=snapshot_dir,
+            openai_api_key=s.openai_api_key,
+            embed_model=s.openai_embed_model,
+            embed_dimensions=s.openai_embed_dimensions,
+            batch_size=args.batch_size,
+            parse_workers=args.parse_workers,
+            embed_workers=args.embed_workers,
+            progress=print_progress,
+        )
+        templates = build_templates(
+            snapshot_dir=snapshot_dir,
+            products=list(catalog.get_catalog().names),
+            embed=lambda texts: embed_documents(
+                openai_api_key=s.openai_api_key,
+                embed_model=s.openai_embed_model,
+                embed_dimensions=s.openai_embed_dimensions,
+                texts=texts,
+            ),
+            embed_model=s.openai_embed_model,
+            embed_dimensions=s.openai_embed_dimensions,
+        )
+        write_full_vectors(snapshot_dir=snapshot_dir)  # memory index rescoring (INDEX_QUANTIZATION/INDEX_SEARCH_DIMS)
+    except BaseException:
+        print(file=sys.stderr)
+        print(f"Ingest stopped; re-run with --resume to continue snapshot {os.path.basename(snapshot_dir)}")
+        raise
+    print(file=sys.stderr)
+    Checkpoint(snapshot_dir).remove()
+    publish_snapshot(s.chroma_persist_dir, snapshot_dir, keep=s.index_keep_snapshots)
+    print(f"Published index snapshot {os.path.basename(snapshot_dir)}: {stats.line()}, {templates} query templates")
+
+
+def _resumable_snapshot(persist_dir: str) -> str | None:
+    """Newest snapshot left behind by an interrupted ingest (it still has its checkpoint), if any."""
+    root = os.path.join(persist_dir, SNAPSHOTS_DIR)
+    if not os.path.isdir(root):
+        return None
+    for name in sorted(os.listdir(root), reverse=True):
+        path = os.path.join(root, name)
+        if os.path.exists(os.path.join(path, CHECKPOINT_FILE)):
+            return path
+    return None
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,74 @@
+"""
+Standalone job worker for the background job queue (app/jobs.py): runs queued jobs such as order
+post-processing outside the web workers. Use with JOBS_WORKER=external, or alongside the in-process
+workers to add capacity; any number of worker processes can share the queue.
+
+Usage (from apps/snackbot-api):
+  python -m scripts.jobs_worker [--threads 2]
+  python -m scripts.jobs_worker --stats            # job counts and the newest dead letters
+  python -m scripts.jobs_worker --requeue-dead [ID ...]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+
+from dotenv import load_dotenv
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app import jobs, orders
+from app.config import load_settings
+
+
+def main() -> None:
+    load_dotenv(dotenv_path=os.path.join(os.getcwd(), "..", "..", ".env"), override=False)
+    load_dotenv(override=False)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--threads", type=int, default=None, help="worker threads (default JOBS_THREADS)")
+    ap.add_argument("--stats", action="store_true", help="print job counts and dead letters, then exit")
+    ap.add_argument("--requeue-dead", nargs="*", type=int, metavar="ID",
+                    help="give dead-lettered jobs (all, or these ids) new attempts, then exit")
+    args = ap.parse_args()
+
+    s = load_settings()
+    orders.configure(webhook_url=s.order_webhook_url)
+    queue = jobs.JobQueue(s.jobs_db_path, max_attempts=s.jobs_max_attempts, retry_base_s=s.jobs_retry_base_s)
+
+    if args.stats:
+        print(json.dumps({"counts": queue.counts(), "dead_letters": queue.dead_letters(20)}, indent=2, ensure_ascii=False))
+        return
+    if args.requeue_dead is not None:
+        print(f"Requeued {queue.requeue_dead(args.requeue_dead or None)} dead-lettered job(s)")
+        return
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    threads = [
+        threading.Thread(
+            target=queue.work, args=(stop,), kwargs={"poll_interval_s": s.jobs_poll_interval_s}, name=f"jobs-{n}"
+        )
+        for n in range(args.threads or s.jobs_threads)
+    ]
+    for t in threads:
+        t.start()
+    print(f"Job worker running ({len(threads)} thread(s), queue {s.jobs_db_path}); Ctrl+C to stop")
+    # A job in progress finishes before its thread exits.
+    for t in threads:
+        while t.is_alive():
+            t.join(0.5)
+
+
+if __name__ == "__main__":
+    main()
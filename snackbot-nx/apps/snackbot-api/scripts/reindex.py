@@ -0,0 +1,92 @@
+"""
+Rebuild the active index snapshot's Chroma collection under new distance space / HNSW parameters
+(INDEX_SPACE, INDEX_HNSW_M, INDEX_HNSW_CONSTRUCTION_EF, INDEX_HNSW_SEARCH_EF, or the flags below)
+into a new snapshot and publish it. Chunks are copied with their stored embeddings, so no OpenAI
+calls are made; running workers switch to the new snapshot on their next check, as after an ingest.
+
+Chroma fixes these parameters when a collection is created, so this is how an existing index
+picks up changed settings.
+
+Usage (from apps/snackbot-api):
+  python -m scripts.reindex [--space cosine] [--m 16] [--construction-ef 100] [--search-ef 100]
+  python -m scripts.reindex --show           # parameters of the active snapshot and the settings
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+from dotenv import load_dotenv
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+api_dir = os.path.dirname(script_dir)
+if api_dir not in sys.path:
+    sys.path.insert(0, api_dir)
+
+from app.config import load_settings
+from app.rag import query_templates, snapshots
+from app.rag.chunkstore import write_full_vectors
+from app.rag.vectorstore import SPACES, IndexParams, get_chroma_collection, reindex
+
+
+def main() -> None:
+    load_dotenv(dotenv_path=os.path.join(os.getcwd(), "..", "..", ".env"), override=False)
+    load_dotenv(override=False)
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--space", choices=SPACES, help="distance space (default INDEX_SPACE)")
+    ap.add_argument("--m", type=int, help="HNSW graph degree (default INDEX_HNSW_M)")
+    ap.add_argument("--construction-ef", type=int, help="HNSW build beam width (default INDEX_HNSW_CONSTRUCTION_EF)")
+    ap.add_argument("--search-ef", type=int, help="HNSW query beam width (default INDEX_HNSW_SEARCH_EF)")
+    ap.add_argument("--batch-size", type=int, default=500, help="chunks copied per batch")
+    ap.add_argument("--show", action="store_true", help="print the active snapshot's parameters, then exit")
+    args = ap.parse_args()
+
+    s = load_settings()
+    params = IndexParams(
+        space=args.space or s.index_space,
+        m=args.m or s.index_hnsw_m,
+        construction_ef=args.construction_ef or s.index_hnsw_construction_ef,
+        search_ef=args.search_ef or s.index_hnsw_search_ef,
+    )
+    source_dir = snapshots.active_dir(s.chroma_persist_dir)
+    source = get_chroma_collection(persist_dir=source_dir, params=params)
+    built = IndexParams.of(source)
+    print(f"Active snapshot {source_dir}: {source.count()} chunks, built with {built}")
+    if args.show:
+        print(f"Settings ask for {params}")
+        return
+    if not source.count():
+        raise SystemExit("The active snapshot has no chunks; run the ingest instead.")
+
+    target_dir = snapshots.create_snapshot(s.chroma_persist_dir)
+    t0 = time.perf_counter()
+    try:
+        copied = reindex(
+            source_dir=source_dir,
+            target_dir=target_dir,
+            params=params,
+            batch_size=args.batch_size,
+            progress=lambda done, total: print(f"\r{done}/{total} chunks", end="", file=sys.stderr, flush=True),
+        )
+        print(file=sys.stderr)
+        # Query templates are embeddings of template questions, independent of the index parameters.
+        templates = os.path.join(source_dir, query_templates.TEMPLATES_FILENAME)
+        if os.path.exists(templates):
+            shutil.copy2(templates, target_dir)
+        write_full_vectors(snapshot_dir=target_dir)  # row order/normalization follow the new space
+    except BaseException:
+        shutil.rmtree(target_dir, ignore_errors=True)
+        raise
+    snapshots.publish_snapshot(s.chroma_persist_dir, target_dir, keep=s.index_keep_snapshots)
+    print(
+        f"Published index snapshot {os.path.basename(target_dir)}: {copied} chunks with {params} "
+        f"in {time.perf_counter() - t0:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -41,6 +41,8 @@ export default function SnackbotChat({ apiUrl }) {
   const [loading, setLoading] = useState(false);
   const logRef = useRef(null);
   const inputRef = useRef(null);
+  // Server keeps the conversation state; once we have a session id we send only the new message.
+  const sessionIdRef = useRef(null);
 
   useEffect(() => {
     console.log('Messages:', messages);
@@ -76,13 +78,27 @@ export default function SnackbotChat({ apiUrl }) {
       .slice(-MAX_HISTORY_TURNS * 2)
       .map((m) => ({ role: m.role === 'bot' ? 'assistant' : 'user', content: m.text }));
 
-    try {
-      const res = await fetch(`${baseUrl || ''}/api/chat`, {
+    const post = (body) =>
+      fetch(`${baseUrl || ''}/api/chat`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: text, history: historyForApi }),
+        body: JSON.stringify(body),
       });
-      const data = await res.json();
+
+    try {
+      let res = await post(
+        sessionIdRef.current
+          ? { message: text, session_id: sessionIdRef.current }
+          : { message: text, history: historyForApi }
+      );
+      let data = await res.json();
+      if (!res.ok && data.session_reset) {
+        // The server no longer has our session (expired): start a new one from the local history.
+        sessionIdRef.current = null;
+        res = await post({ message: text, history: historyForApi });
+        data = await res.json();
+      }
+      if (res.ok && data.session_id) sessionIdRef.current = data.session_id;
       setMessages((prev) =>
         prev.filter((m) => !m.typing).concat({
           role: 'bot',
@@ -108,6 +124,7 @@ export default function SnackbotChat({ apiUrl }) {
   };
 
   const clear = () => {
+    sessionIdRef.current = null;
     setMessages([
       { role: 'bot', text: 'Hi! I can help you learn about our products—ingredients, allergens, pricing, and more. What would you like to know?', sources: [] },
     ]);
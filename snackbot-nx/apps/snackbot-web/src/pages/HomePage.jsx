@@ -24,6 +24,11 @@ function productImage(id, name) {
   if (USE_MY_IMAGES) return `/images/${id}.jpg`;
   return `https://placehold.co/400x400/f8fafc/e2e8f0?text=${encodeURIComponent(name)}`;
 }
+// The API serves a resized AVIF/WebP/JPEG variant for ?w= (see scripts/build_images.py)
+function productImageSrcSet(id) {
+  if (!USE_MY_IMAGES) return undefined;
+  return [320, 640, 960].map((w) => `/images/${id}.jpg?w=${w} ${w}w`).join(', ');
+}
 
 export default function HomePage() {
   const { addToCart } = useCart();
@@ -45,6 +50,9 @@ export default function HomePage() {
               <div className="product-image-wrap">
                 <img
                   src={productImage(product.id, product.name)}
+                  srcSet={productImageSrcSet(product.id)}
+                  sizes="(max-width: 640px) 100vw, 400px"
+                  loading="lazy"
                   alt={product.name}
                   className="product-image"
                 />
@@ -383,6 +383,8 @@ export default function ProductDetail() {
           <div className="product-detail-image-wrap">
             <img
               src={`/images/${pack.productId}.jpg`}
+              srcSet={[320, 640, 960].map((w) => `/images/${pack.productId}.jpg?w=${w} ${w}w`).join(', ')}
+              sizes="(max-width: 560px) 100vw, 320px"
               alt={pack.productName}
               className="product-detail-image"
               onError={(e) => { e.target.src = `https://placehold.co/400x400/f8fafc/e2e8f0?text=${encodeURIComponent(pack.productName)}`; }}